@@ -0,0 +1,112 @@
+"""
+هزینه لاگ روی مسیر کوئری‌های دیتابیس
+
+اجرا:
+    python benchmarks/bench_db_logging.py [-n 200000] [--debug]
+
+لاگ‌های یک فراخوانی get_product (یک debug، یک log_db و سه لاگ _get_connection)
+بدون خود کوئری اجرا می‌شوند تا نویز SQLite در اندازه‌گیری نباشد:
+- eager: الگوی قبلی - f-string و رشته log_db همیشه ساخته می‌شوند، بدون guard
+- lazy: الگوی فعلی - %-style، log_db با isEnabledFor و یک guard برای _get_connection
+
+زمان کامل Database.get_product هم برای مقایسه نمایش داده می‌شود.
+با --debug سطح DEBUG فعال می‌شود (فقط فایل، بدون کنسول) تا هزینه
+وقتی لاگ واقعاً نوشته می‌شود هم دیده شود؛ LOG_DB_SAMPLE_EVERY را هم امتحان کنید.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from utils.logger import get_logger, log_db, persian_logger, shutdown_logging
+
+logger = get_logger('database')
+
+PRODUCT = {'product_id': 1, 'name': "مانتو تست", 'price': 500000}
+
+
+def _eager_log_db(operation: str, details: str = ""):
+    """log_db قبلی: ساخت پیام قبل از بررسی سطح"""
+    db_logger = persian_logger.get_logger('database')
+    message = f"DB | {operation}"
+    if details:
+        message += f" | {details}"
+    db_logger.debug(message)
+
+
+def logs_eager(product_id: int, result: dict):
+    logger.debug(f"دریافت محصول {product_id}")
+    logger.debug("اتصال به دیتابیس برقرار شد")
+    _eager_log_db("SELECT", f"product {product_id} found: {result['name']}")
+    logger.debug("تغییرات commit شد")
+    logger.debug("اتصال بسته شد")
+
+
+def logs_lazy(product_id: int, result: dict):
+    logger.debug("دریافت محصول %s", product_id)
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug("اتصال به دیتابیس برقرار شد")
+    log_db("SELECT", "product %s found: %s", product_id, result['name'])
+    if debug:
+        logger.debug("تغییرات commit شد")
+    if debug:
+        logger.debug("اتصال بسته شد")
+
+
+def measure(func, n: int) -> float:
+    """میانگین زمان هر فراخوانی (میکروثانیه)"""
+    for _ in range(min(n // 10, 1000)):
+        func()
+
+    started = time.perf_counter()
+    for _ in range(n):
+        func()
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DB logging overhead benchmark")
+    parser.add_argument('-n', type=int, default=200000, help="تعداد تکرار لاگ‌ها در هر حالت")
+    parser.add_argument('--debug', action='store_true', help="فعال کردن سطح DEBUG")
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='bench_db_logging_')
+    db = Database(os.path.join(data_dir, 'shop.db'))
+    product_id = db.add_product(PRODUCT['name'], PRODUCT['price'], "توضیحات", 10)
+
+    if args.debug:
+        # فقط فایل؛ کنسول مسیر مشترک stdout است و اندازه‌گیری را خراب می‌کند
+        routes = persian_logger.router.routes
+        routes['database'] = [h for h in routes['database'] if h is not persian_logger.console_handler]
+        for handler in routes['database']:
+            handler.setLevel(logging.DEBUG)
+        logger.setLevel(logging.DEBUG)
+
+    n = args.n // 20 if args.debug else args.n
+    level = logging.getLevelName(logger.getEffectiveLevel())
+    print(f"🧪 DB logging benchmark (n={n:,}, سطح: {level}, "
+          f"نمونه‌برداری log_db: 1/{persian_logger.db_sampler.every})\n")
+
+    eager = measure(lambda: logs_eager(product_id, PRODUCT), n)
+    lazy = measure(lambda: logs_lazy(product_id, PRODUCT), n)
+    query = measure(lambda: db.get_product(product_id), max(n // 20, 1000))
+
+    print(f"{'لاگ‌های هر کوئری':<22} {'µs':>8}")
+    print(f"{'eager (قبلی)':<22} {eager:>8.2f}")
+    print(f"{'lazy (فعلی)':<22} {lazy:>8.2f}  ({eager / lazy:.1f}x)")
+    print(f"{'get_product کامل':<22} {query:>8.2f}  (سهم لاگ: {lazy / query * 100:.1f}%)")
+
+    stats = persian_logger.get_stats()
+    print(f"\nصف لاگ: {stats['queued']} منتظر، {stats['dropped']} حذف شده")
+    shutdown_logging()
+
+
+if __name__ == "__main__":
+    main()
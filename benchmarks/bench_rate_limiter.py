@@ -0,0 +1,92 @@
+"""
+مقایسه سرعت Rate Limiter قدیمی (لیست datetime / deque) با نسخه GCRA
+
+اجرا:
+    python benchmarks/bench_rate_limiter.py
+"""
+
+import os
+import sys
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.rate_limiter import RateLimiter  # noqa: E402
+
+
+class LegacyListLimiter:
+    """نسخه قدیمی utils/rate_limiter: لیست datetime برای هر کاربر"""
+    
+    def __init__(self, max_per_minute: int, max_per_hour: int):
+        self.max_per_minute = max_per_minute
+        self.max_per_hour = max_per_hour
+        self.requests = defaultdict(list)
+    
+    def check_rate_limit(self, user_id: int) -> bool:
+        now = datetime.now()
+        user_requests = self.requests[user_id]
+        cutoff_time = now - timedelta(hours=1)
+        user_requests[:] = [t for t in user_requests if t > cutoff_time]
+        minute_ago = now - timedelta(minutes=1)
+        if sum(1 for t in user_requests if t > minute_ago) >= self.max_per_minute:
+            return False
+        if len(user_requests) >= self.max_per_hour:
+            return False
+        user_requests.append(now)
+        return True
+
+
+class LegacyDequeLimiter:
+    """نسخه قدیمی rate_limiter.py ریشه: deque زمان‌ها برای هر کاربر"""
+    
+    def __init__(self):
+        self._user_requests = defaultdict(lambda: deque(maxlen=100))
+    
+    def check_rate_limit(self, user_id: int, max_requests: int, window_seconds: int) -> bool:
+        cutoff_time = time.time() - window_seconds
+        requests = self._user_requests[user_id]
+        while requests and requests[0] < cutoff_time:
+            requests.popleft()
+        if len(requests) >= max_requests:
+            return False
+        requests.append(time.time())
+        return True
+
+
+def _run(name: str, check, users: int, rounds: int):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for user_id in range(users):
+            check(user_id)
+    elapsed = time.perf_counter() - start
+    calls = users * rounds
+    print(f"{name:<28} {calls:>9} calls  {elapsed * 1e9 / calls:>9.0f} ns/call")
+
+
+def main():
+    users = 1000
+    rounds = 90
+    per_minute, per_hour = 60, 100
+    
+    print("🧪 Rate limiter benchmark")
+    print(f"   {users} users × {rounds} requests, limits {per_minute}/min, {per_hour}/hour\n")
+    
+    legacy_list = LegacyListLimiter(per_minute, per_hour)
+    _run("legacy list[datetime]", legacy_list.check_rate_limit, users, rounds)
+    
+    legacy_deque = LegacyDequeLimiter()
+    _run("legacy deque", lambda u: legacy_deque.check_rate_limit(u, per_minute, 60), users, rounds)
+    
+    gcra = RateLimiter(per_minute, per_hour)
+    _run("GCRA (minute + hour)", lambda u: gcra.check(u, "minute", "hour"), users, rounds)
+    
+    # سیل شناسه‌های یکتا: حافظه باید زیر سقف بماند
+    flood = RateLimiter(per_minute, per_hour, max_keys=10_000)
+    _run("GCRA flood (unique users)", lambda u: flood.check(u, "minute", "hour"), 500_000, 1)
+    print(f"\nflood state: {flood.get_memory_stats()}")
+
+
+if __name__ == "__main__":
+    main()
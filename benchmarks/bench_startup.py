@@ -0,0 +1,177 @@
+"""
+اندازه‌گیری زمان import و راه‌اندازی ربات
+
+اجرا:
+    python benchmarks/bench_startup.py [--top 15] [--runs 3]
+
+- سهم ماژول‌ها از زمان import با `python -X importtime`
+- زمان از شروع پروسه تا پردازش اولین آپدیت: import، ساخت ShopBot و
+  راه‌اندازی Application (initialize/start، اتصال httpx، polling)؛ یک بار با
+  دیتابیس خالی (ساخت schema) و چند بار با دیتابیس موجود (مثل restart هنگام deploy)
+
+اتصالی به تلگرام برقرار نمی‌شود: ربات به یک FakeBotAPI محلی (utils.webhook)
+وصل می‌شود که در getUpdates یک /start برمی‌گرداند؛ اگر BOT_TOKEN تنظیم نشده
+باشد یک توکن ساختگی استفاده می‌شود.
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_IMPORT_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( +)(\S+)')
+_STARTUP_LINE = re.compile(r'@@STARTUP (\S+) (\S+) (\S+)')
+
+# اسکریپت پروسه فرزند: import، ساخت ShopBot و polling تا dispatch اولین آپدیت
+_CHILD = """
+import time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+bot = main.ShopBot()
+ready = time.perf_counter()
+
+from telegram import Update
+from telegram.ext import TypeHandler
+
+first_update = []
+
+async def _on_first_update(update, context):
+    if not first_update:
+        first_update.append(time.perf_counter())
+        context.application.stop_running()
+
+# قبل از gate (گروه -1) تا زمان dispatch بدون کار handler ها ثبت شود
+bot.app.add_handler(TypeHandler(Update, _on_first_update), group=-100)
+bot.run()
+
+# کنسول روی thread صف لاگ نوشته می‌شود؛ قبل از چاپ نتیجه خالی و بسته شود
+# تا خط لاگی وسط خط نتیجه نیفتد
+main.shutdown_event_store()
+main.shutdown_logging()
+
+print(f"@@STARTUP {(imported - started) * 1000:.1f} {(ready - imported) * 1000:.1f} "
+      f"{(first_update[0] - ready) * 1000:.1f}")
+"""
+
+
+class _FakeApiThread:
+    """FakeBotAPI روی event loop یک thread پس‌زمینه (پروسه benchmark همگام است)"""
+    
+    def __init__(self):
+        from utils.webhook import FakeBotAPI
+        
+        self.api = FakeBotAPI()
+        self.loop = asyncio.new_event_loop()
+        self.update_id = 0
+        
+        threading.Thread(target=self.loop.run_forever, name='fake-bot-api', daemon=True).start()
+        self.url = asyncio.run_coroutine_threadsafe(self.api.start(), self.loop).result()
+    
+    def push_start(self):
+        """یک /start تازه برای اجرای بعدی"""
+        self.update_id += 1
+        update = self.api.command_update(self.update_id)
+        self.loop.call_soon_threadsafe(self.api.push_update, update)
+
+
+def _env(data_dir: str, api_url: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault('BOT_TOKEN', '123456789:' + 'A' * 35)
+    env.setdefault('ADMIN_IDS', '1')
+    env['DATABASE_PATH'] = os.path.join(data_dir, 'shop.db')
+    env['STATE_DB_PATH'] = os.path.join(data_dir, 'state.db')
+    env['ERROR_STATS_PATH'] = os.path.join(data_dir, 'error_stats.json')
+    env['UPDATE_MODE'] = 'polling'
+    env['BOT_API_BASE_URL'] = api_url
+    env['PYTHONPATH'] = ROOT + os.pathsep + env.get('PYTHONPATH', '')
+    return env
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    """خروجی -X importtime: [(module, self_us, cumulative_us, depth)]"""
+    rows = []
+    for line in stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows
+
+
+def measure_imports(env: Dict[str, str], top: int):
+    """نمایش سنگین‌ترین import ها"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import main'],
+        cwd=ROOT, env=env, capture_output=True, text=True
+    )
+    rows = parse_importtime(result.stderr)
+    if not rows:
+        print(result.stderr[-2000:])
+        raise SystemExit("❌ خروجی importtime خالی است")
+    
+    total = sum(cumulative for _, _, cumulative, depth in rows if depth == 0)
+    print(f"📦 import main: {total / 1000:.1f} ms ({len(rows)} ماژول)\n")
+    
+    print(f"{'module':<48} {'self ms':>9} {'cum ms':>9}")
+    for module, self_us, cumulative_us, depth in sorted(rows, key=lambda r: r[2], reverse=True)[:top]:
+        print(f"{'  ' * depth + module:<48} {self_us / 1000:>9.1f} {cumulative_us / 1000:>9.1f}")
+
+
+def measure_startup(env: Dict[str, str], api: _FakeApiThread) -> Tuple[float, float, float, float]:
+    """(کل زمان پروسه, import, ساخت ShopBot, تا اولین آپدیت) بر حسب میلی‌ثانیه"""
+    api.push_start()
+    
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', _CHILD],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=120
+    )
+    wall = (time.perf_counter() - started) * 1000
+    
+    match = _STARTUP_LINE.search(result.stdout)
+    if match:
+        imported, ready, first_update = (float(value) for value in match.groups())
+        return wall, imported, ready, first_update
+    
+    print(result.stdout[-2000:], result.stderr[-2000:])
+    raise SystemExit("❌ راه‌اندازی ربات ناموفق بود")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup benchmark")
+    parser.add_argument('--top', type=int, default=15, help="تعداد ماژول‌های نمایش داده شده")
+    parser.add_argument('--runs', type=int, default=3, help="تعداد اجرا با دیتابیس موجود")
+    args = parser.parse_args()
+    
+    data_dir = tempfile.mkdtemp(prefix='bench_startup_')
+    api = _FakeApiThread()
+    env = _env(data_dir, api.url)
+    
+    print("🧪 Startup benchmark\n")
+    measure_imports(env, args.top)
+    
+    print(f"\n{'run':<16} {'process ms':>11} {'import ms':>10} {'init ms':>9} {'serve ms':>9} {'1st update ms':>14}")
+    
+    def _row(label: str, wall: float, imported: float, ready: float, first_update: float):
+        total = imported + ready + first_update
+        print(f"{label:<16} {wall:>11.0f} {imported:>10.0f} {ready:>9.0f} {first_update:>9.0f} {total:>14.0f}")
+    
+    _row('cold (new db)', *measure_startup(env, api))
+    
+    for i in range(args.runs):
+        _row(f'warm #{i + 1}', *measure_startup(env, api))
+    
+    print("\nserve: initialize/start Application، getMe و polling تا dispatch اولین آپدیت")
+
+if __name__ == "__main__":
+    main()
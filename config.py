@@ -5,12 +5,10 @@
 """
 
 import os
+import re
+import secrets
 from dataclasses import dataclass
-from typing import List
-
-# بارگذاری .env
-from dotenv import load_dotenv
-load_dotenv()
+from typing import List, Optional, Tuple
 
 
 @dataclass
@@ -28,6 +26,35 @@ class BotConfig:
     # تنظیمات Rate Limiting
     max_requests_per_minute: int = 20
     max_requests_per_hour: int = 100
+    rate_limit_max_keys: int = 100000
+    
+    # سقف همه آپدیت‌های هر کاربر در gate (بزرگ‌تر از سقف بالا که فقط برای
+    # /start، راهنما، لیست محصولات و افزودن به سبد است)
+    gate_max_per_minute: int = 60
+    gate_max_per_hour: int = 1000
+    
+    # محل ذخیره وضعیت مشترک (rate limit و سبد خرید): memory یا sqlite
+    state_backend: str = "memory"
+    state_db_path: str = "data/state.db"
+    
+    # تنظیمات تشخیص پرترافیک‌ها (Count-Min Sketch)
+    heavy_hitter_window_seconds: int = 60
+    heavy_hitter_threshold: int = 120
+    temp_block_seconds: int = 900
+    
+    # تنظیمات رندر نمودارها (پروسه‌های جدا)
+    chart_workers: int = 2
+    max_concurrent_charts: int = 2
+    
+    # گزارش‌های شبانه (ساعت به وقت timezone)
+    nightly_report_time: str = "04:00"
+    timezone: str = "Asia/Tehran"
+    report_snapshot_max_age_hours: int = 12
+    
+    # پیش‌بینی موجودی: زمان رسیدن سفارش، دوره پوشش بعد از آن و آستانه هشدار (روز)
+    restock_lead_time_days: int = 7
+    restock_cover_days: int = 14
+    low_stock_alert_days: int = 7
     
     # تنظیمات محصولات
     min_price: int = 10000
@@ -42,6 +69,42 @@ class BotConfig:
     # تنظیمات امنیتی
     enable_logging: bool = True
     enable_error_notifications: bool = True
+    error_digest_seconds: int = 60   # فاصله ارسال خلاصه خطاها به ادمین
+    error_stats_path: str = "data/error_stats.json"   # آمار گزارش روزانه خطاها
+    
+    # endpoint متریک‌های Prometheus (فقط محلی)
+    metrics_enabled: bool = False
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9108
+    
+    # دریافت آپدیت‌ها: polling یا webhook (پشت reverse proxy با HTTPS)
+    update_mode: str = "polling"
+    webhook_base_url: str = ""   # آدرس عمومی، مثلاً https://shop.example.com
+    webhook_path: str = "telegram"
+    webhook_listen: str = "127.0.0.1"
+    webhook_port: int = 8443
+    webhook_secret_token: str = ""   # خالی = تولید تصادفی در هر اجرا
+    webhook_max_connections: int = 40
+    bot_api_base_url: str = ""   # Bot API محلی یا fake برای تست (خالی = api.telegram.org)
+    
+    # کاهش بار بر اساس تأخیر event loop (میلی‌ثانیه، EWMA)
+    load_shedding_enabled: bool = True
+    lag_elevated_ms: int = 100
+    lag_overloaded_ms: int = 500
+    
+    # لاگ ساختاریافته رویدادها (JSON lines)
+    event_log_enabled: bool = False
+    event_log_path: str = "logs/events.jsonl"
+    event_log_sample_rates: str = ""   # مثال: "user_action=0.1,security=1"
+    event_log_max_mb: int = 20
+    event_log_backups: int = 10
+    event_log_max_age_days: int = 14
+    event_log_replace_text: bool = False
+    
+    # رویدادهای کاربران در جدول events (قیف تبدیل /funnel)
+    event_store_enabled: bool = True
+    event_store_flush_seconds: float = 2.0
+    event_retention_days: int = 90
     
     def __post_init__(self):
         """بررسی و اعتبارسنجی بعد از ساخت شیء"""
@@ -67,10 +130,62 @@ class BotConfig:
         else:
             logger.info(f"✅ کانال: {self.channel_id}")
         
-        os.makedirs(os.path.dirname(self.database_path), exist_ok=True)
         logger.info(f"✅ مسیر دیتابیس: {self.database_path}")
         
+        if self.state_backend not in ('memory', 'sqlite'):
+            logger.error(f"❌ STATE_BACKEND نامعتبر: {self.state_backend}")
+            raise ValueError("STATE_BACKEND باید memory یا sqlite باشد")
+        
+        logger.info(f"🗂  State backend: {self.state_backend}")
+        
+        try:
+            self.nightly_report_hour_minute
+        except ValueError:
+            logger.error(f"❌ NIGHTLY_REPORT_TIME نامعتبر: {self.nightly_report_time}")
+            raise ValueError("NIGHTLY_REPORT_TIME باید به شکل HH:MM باشد")
+        
+        if self.event_log_enabled:
+            logger.info(f"🧾 Event log: {self.event_log_path}")
+        
+        if self.metrics_enabled:
+            logger.info(f"📈 متریک‌ها: {self.metrics_host}:{self.metrics_port}")
+        
+        if self.update_mode not in ('polling', 'webhook'):
+            logger.error(f"❌ UPDATE_MODE نامعتبر: {self.update_mode}")
+            raise ValueError("UPDATE_MODE باید polling یا webhook باشد")
+        
+        if self.update_mode == 'webhook':
+            if not self.webhook_base_url.startswith(('https://', 'http://')):
+                logger.error(f"❌ WEBHOOK_BASE_URL نامعتبر: {self.webhook_base_url!r}")
+                raise ValueError("در حالت webhook، WEBHOOK_BASE_URL (مثلاً https://shop.example.com) لازم است")
+            
+            if not self.webhook_base_url.startswith('https://'):
+                logger.warning("⚠️  تلگرام فقط webhook با HTTPS را می‌پذیرد (http فقط برای Bot API محلی)")
+            
+            if not self.webhook_secret_token:
+                # هر اجرا setWebhook را دوباره صدا می‌زند، پس توکن تصادفی کافی است
+                self.webhook_secret_token = secrets.token_urlsafe(32)
+                logger.info("🔑 WEBHOOK_SECRET_TOKEN تعریف نشده؛ توکن تصادفی ساخته شد")
+            elif not re.fullmatch(r'[A-Za-z0-9_-]{1,256}', self.webhook_secret_token):
+                logger.error("❌ WEBHOOK_SECRET_TOKEN نامعتبر است")
+                raise ValueError("WEBHOOK_SECRET_TOKEN باید 1 تا 256 کاراکتر از A-Z، a-z، 0-9، _ و - باشد")
+            
+            if not 1 <= self.webhook_max_connections <= 100:
+                logger.error(f"❌ WEBHOOK_MAX_CONNECTIONS نامعتبر: {self.webhook_max_connections}")
+                raise ValueError("WEBHOOK_MAX_CONNECTIONS باید بین 1 و 100 باشد")
+            
+            logger.info(f"🌐 Webhook: {self.webhook_url} -> {self.webhook_listen}:{self.webhook_port}")
+        
+        if self.bot_api_base_url:
+            logger.info(f"🔌 Bot API: {self.bot_api_base_url}")
+        
+        if not 0 < self.lag_elevated_ms < self.lag_overloaded_ms:
+            logger.error(f"❌ آستانه‌های lag نامعتبر: {self.lag_elevated_ms}/{self.lag_overloaded_ms}")
+            raise ValueError("باید 0 < LAG_ELEVATED_MS < LAG_OVERLOADED_MS باشد")
+        
+        logger.info(f"🌙 گزارش شبانه: {self.nightly_report_time} ({self.timezone})")
         logger.info(f"⏱️  Rate Limit: {self.max_requests_per_minute}/دقیقه، {self.max_requests_per_hour}/ساعت")
+        logger.info(f"🚪 Rate Limit دروازه: {self.gate_max_per_minute}/دقیقه، {self.gate_max_per_hour}/ساعت")
         logger.info(f"💰 محدوده قیمت: {self.min_price:,} - {self.max_price:,} تومان")
         logger.info(f"📦 محدوده موجودی: {self.min_stock} - {self.max_stock}")
         logger.info(f"🛒 حداکثر آیتم در سبد: {self.max_cart_items}")
@@ -79,6 +194,19 @@ class BotConfig:
         logger.info("✅ تمام تنظیمات با موفقیت بارگذاری شد")
         log_event("تنظیمات ربات بارگذاری شد", "تمام مقادیر معتبر هستند")
     
+    @property
+    def webhook_url(self) -> str:
+        """آدرس کامل webhook برای setWebhook"""
+        return f"{self.webhook_base_url.rstrip('/')}/{self.webhook_path.strip('/')}"
+    
+    @property
+    def nightly_report_hour_minute(self) -> Tuple[int, int]:
+        """ساعت و دقیقه گزارش شبانه"""
+        hour, minute = (int(x) for x in self.nightly_report_time.split(':'))
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError(self.nightly_report_time)
+        return hour, minute
+    
     def is_admin(self, user_id: int) -> bool:
         """بررسی ادمین بودن کاربر"""
         return user_id in self.admin_ids
@@ -98,6 +226,10 @@ def load_config() -> BotConfig:
     print("=" * 60)
     print("🔧 شروع بارگذاری تنظیمات...")
     
+    # بارگذاری .env
+    from dotenv import load_dotenv
+    load_dotenv()
+    
     try:
         bot_token = os.getenv('BOT_TOKEN', '')
         
@@ -116,32 +248,95 @@ def load_config() -> BotConfig:
             print(f"✅ Channel ID پارس شد: {channel_id}")
         
         database_path = os.getenv('DATABASE_PATH', 'data/shop.db')
+        state_backend = os.getenv('STATE_BACKEND', 'memory').strip().lower()
+        state_db_path = os.getenv('STATE_DB_PATH', 'data/state.db')
+        nightly_report_time = os.getenv('NIGHTLY_REPORT_TIME', '04:00').strip()
+        timezone = os.getenv('TIMEZONE', 'Asia/Tehran').strip()
+        event_log_enabled = os.getenv('EVENT_LOG_ENABLED', 'false').strip().lower() in ('1', 'true', 'yes')
+        event_log_replace_text = os.getenv('EVENT_LOG_REPLACE_TEXT', 'false').strip().lower() in ('1', 'true', 'yes')
+        event_store_enabled = os.getenv('EVENT_STORE_ENABLED', 'true').strip().lower() in ('1', 'true', 'yes')
+        metrics_enabled = os.getenv('METRICS_ENABLED', 'false').strip().lower() in ('1', 'true', 'yes')
+        update_mode = os.getenv('UPDATE_MODE', 'polling').strip().lower()
+        load_shedding_enabled = os.getenv('LOAD_SHEDDING_ENABLED', 'true').strip().lower() in ('1', 'true', 'yes')
         
         config = BotConfig(
             bot_token=bot_token,
             admin_ids=admin_ids,
             channel_id=channel_id,
-            database_path=database_path
+            database_path=database_path,
+            state_backend=state_backend,
+            state_db_path=state_db_path,
+            gate_max_per_minute=int(os.getenv('GATE_MAX_PER_MINUTE', '60')),
+            gate_max_per_hour=int(os.getenv('GATE_MAX_PER_HOUR', '1000')),
+            nightly_report_time=nightly_report_time,
+            timezone=timezone,
+            event_log_enabled=event_log_enabled,
+            event_log_path=os.getenv('EVENT_LOG_PATH', 'logs/events.jsonl'),
+            event_log_sample_rates=os.getenv('EVENT_LOG_SAMPLE_RATES', ''),
+            event_log_replace_text=event_log_replace_text,
+            event_store_enabled=event_store_enabled,
+            event_retention_days=int(os.getenv('EVENT_RETENTION_DAYS', '90')),
+            error_digest_seconds=int(os.getenv('ERROR_DIGEST_SECONDS', '60')),
+            error_stats_path=os.getenv('ERROR_STATS_PATH', 'data/error_stats.json'),
+            metrics_enabled=metrics_enabled,
+            metrics_host=os.getenv('METRICS_HOST', '127.0.0.1'),
+            metrics_port=int(os.getenv('METRICS_PORT', '9108')),
+            update_mode=update_mode,
+            webhook_base_url=os.getenv('WEBHOOK_BASE_URL', '').strip(),
+            webhook_path=os.getenv('WEBHOOK_PATH', 'telegram').strip(),
+            webhook_listen=os.getenv('WEBHOOK_LISTEN', '127.0.0.1').strip(),
+            webhook_port=int(os.getenv('WEBHOOK_PORT', '8443')),
+            webhook_secret_token=os.getenv('WEBHOOK_SECRET_TOKEN', '').strip(),
+            webhook_max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40')),
+            bot_api_base_url=os.getenv('BOT_API_BASE_URL', '').strip().rstrip('/'),
+            load_shedding_enabled=load_shedding_enabled,
+            lag_elevated_ms=int(os.getenv('LAG_ELEVATED_MS', '100')),
+            lag_overloaded_ms=int(os.getenv('LAG_OVERLOADED_MS', '500'))
         )
         
+        os.makedirs(os.path.dirname(config.database_path) or '.', exist_ok=True)
+        os.makedirs(os.path.dirname(config.error_stats_path) or '.', exist_ok=True)
+        
         print("✅ تنظیمات بارگذاری شد")
         print("=" * 60)
         
         return config
-        
+    
     except Exception as e:
         print(f"❌ خطا در بارگذاری تنظیمات: {e}")
         raise
 
 
-# بارگذاری تنظیمات
-config: BotConfig = load_config()
+# تنظیمات بارگذاری شده (در اولین دسترسی ساخته می‌شود)
+_config: Optional[BotConfig] = None
+
+
+def get_config() -> BotConfig:
+    """دریافت تنظیمات (بارگذاری فقط یک بار، در اولین فراخوانی)"""
+    global _config
+    if _config is None:
+        _config = load_config()
+    return _config
+
+
+def __getattr__(name: str):
+    """
+    بارگذاری تنبل `config`
+    
+    import کردن این ماژول (مثلاً برای BotConfig) دیگر .env نمی‌خواند و
+    لاگ نمی‌نویسد؛ `from config import config` همچنان کار می‌کند.
+    """
+    if name == 'config':
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
     # تست
     print("🧪 تست تنظیمات...\n")
     
+    config = get_config()
+    
     print(f"توکن: {config.bot_token[:20]}...")
     print(f"تعداد ادمین‌ها: {len(config.admin_ids)}")
     print(f"کانال: {config.channel_id}")
@@ -4,12 +4,16 @@
 این ماژول مسئول تمام عملیات دیتابیس است
 """
 
+import logging
 import sqlite3
-from typing import List, Optional, Dict, Any, Tuple
+import sys
+import time
+from typing import List, Optional, Dict, Any, Tuple, Iterator
 from datetime import datetime
 from contextlib import contextmanager
 
 from utils.logger import get_logger, log_db, log_error
+from utils import metrics, query_counter
 
 # Logger این ماژول
 logger = get_logger('database')
@@ -18,50 +22,90 @@ logger = get_logger('database')
 class Database:
     """کلاس مدیریت دیتابیس"""
     
+    # نسخه schema (در PRAGMA user_version ذخیره می‌شود)
+    # با هر تغییر در جداول، ایندکس‌ها یا trigger ها یکی اضافه شود
+    SCHEMA_VERSION = 4
+    
+    # تغییراتی که نتیجه گزارش‌های تحلیلی را عوض می‌کنند: (نام trigger, رویداد)
+    DATA_VERSION_TRIGGERS = (
+        ('orders_insert', 'INSERT ON orders'),
+        ('orders_update', 'UPDATE ON orders'),
+        ('orders_delete', 'DELETE ON orders'),
+        ('items_insert', 'INSERT ON order_items'),
+        ('items_update', 'UPDATE ON order_items'),
+        ('items_delete', 'DELETE ON order_items'),
+        ('products_name', 'UPDATE OF name ON products'),
+        ('users_insert', 'INSERT ON users'),
+        ('users_delete', 'DELETE ON users'),
+    )
+    
     def __init__(self, db_path: str):
         """
         Args:
             db_path: مسیر فایل دیتابیس
         """
         self.db_path = db_path
-        logger.info(f"🗄️  در حال اتصال به دیتابیس: {db_path}")
+        logger.info("🗄️  در حال اتصال به دیتابیس: %s", db_path)
         
         try:
             self._init_database()
             logger.info("✅ دیتابیس با موفقیت راه‌اندازی شد")
         except Exception as e:
-            logger.critical(f"❌ خطای بحرانی در راه‌اندازی دیتابیس: {e}")
+            logger.critical("❌ خطای بحرانی در راه‌اندازی دیتابیس: %s", e)
             raise
     
     @contextmanager
     def _get_connection(self):
         """Context manager برای مدیریت اتصال دیتابیس"""
+        # یک بار بررسی برای هر سه لاگ این مسیر پرتکرار
+        debug = logger.isEnabledFor(logging.DEBUG)
+        
+        # زمان‌سنجی و شمارش به تفکیک متد فراخواننده (فریم 2: متد <- __enter__ <- این generator)
+        started = None
+        count = query_counter.current()
+        if metrics.metrics is not None or count is not None:
+            op = sys._getframe(2).f_code.co_name
+            if count is not None:
+                count.add(op)
+            if metrics.metrics is not None:
+                started = time.perf_counter()
+        
         conn = None
         try:
             conn = sqlite3.connect(self.db_path)
             conn.row_factory = sqlite3.Row
-            logger.debug("اتصال به دیتابیس برقرار شد")
+            if debug:
+                logger.debug("اتصال به دیتابیس برقرار شد")
             yield conn
             conn.commit()
-            logger.debug("تغییرات commit شد")
+            if debug:
+                logger.debug("تغییرات commit شد")
         except Exception as e:
             if conn:
                 conn.rollback()
                 logger.warning("تغییرات rollback شد")
-            logger.error(f"خطا در عملیات دیتابیس: {e}")
+            logger.error("خطا در عملیات دیتابیس: %s", e)
             raise
         finally:
             if conn:
                 conn.close()
-                logger.debug("اتصال بسته شد")
+                if debug:
+                    logger.debug("اتصال بسته شد")
+            if started is not None:
+                metrics.observe('bot_db_query_duration_seconds', time.perf_counter() - started, op=op)
     
     def _init_database(self):
-        """ایجاد جداول دیتابیس"""
-        logger.info("در حال ایجاد جداول دیتابیس...")
-        
+        """ایجاد جداول دیتابیس (اگر نسخه schema ذخیره شده قدیمی باشد)"""
         with self._get_connection() as conn:
             cursor = conn.cursor()
             
+            cursor.execute("PRAGMA user_version")
+            if cursor.fetchone()[0] == self.SCHEMA_VERSION:
+                logger.info("✅ schema دیتابیس به‌روز است (نسخه %s)", self.SCHEMA_VERSION)
+                return
+            
+            logger.info("در حال ایجاد جداول دیتابیس...")
+            
             # جدول کاربران
             logger.debug("ایجاد جدول users...")
             cursor.execute("""
@@ -130,7 +174,95 @@ class Database:
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_user_id ON orders(user_id)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_status ON orders(status)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order_id ON order_items(order_id)")
+            # خروجی بازه زمانی سفارش‌ها و کاربران
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_orders_created_at ON orders(created_at)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_created_at ON users(created_at)")
             log_db("CREATE INDEX", "performance indexes")
+            
+            # نسخه داده برای کش گزارش‌ها: با هر تغییر مؤثر در گزارش‌ها یکی زیاد می‌شود
+            logger.debug("ایجاد جدول meta و trigger های data_version...")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            cursor.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('data_version', 0)")
+            
+            for name, event in self.DATA_VERSION_TRIGGERS:
+                cursor.execute(f"""
+                    CREATE TRIGGER IF NOT EXISTS trg_data_version_{name}
+                    AFTER {event}
+                    BEGIN
+                        UPDATE meta SET value = value + 1 WHERE key = 'data_version';
+                    END
+                """)
+            log_db("CREATE TRIGGER", "data_version")
+            
+            # جداول تجمیعی گزارش‌ها (با تأیید هر سفارش به‌روز می‌شوند)
+            logger.debug("ایجاد جداول rollup...")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS daily_sales (
+                    day TEXT PRIMARY KEY,
+                    order_count INTEGER NOT NULL DEFAULT 0,
+                    total_sales INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS hourly_orders (
+                    day TEXT NOT NULL,
+                    hour TEXT NOT NULL,
+                    order_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, hour)
+                )
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS product_daily_sales (
+                    day TEXT NOT NULL,
+                    product_id INTEGER NOT NULL,
+                    quantity INTEGER NOT NULL DEFAULT 0,
+                    revenue INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, product_id)
+                )
+            """)
+            log_db("CREATE TABLE", "rollups")
+            
+            # محصولات هم‌خرید (هر شب از روی سفارشات بازسازی می‌شود)
+            logger.debug("ایجاد جدول product_neighbors...")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS product_neighbors (
+                    product_id INTEGER NOT NULL,
+                    rank INTEGER NOT NULL,
+                    neighbor_id INTEGER NOT NULL,
+                    score REAL NOT NULL,
+                    PRIMARY KEY (product_id, rank)
+                ) WITHOUT ROWID
+            """)
+            log_db("CREATE TABLE", "product_neighbors")
+            
+            # رویدادهای کاربران برای قیف تبدیل (دسته‌ای از utils.event_store نوشته می‌شود)
+            logger.debug("ایجاد جدول events...")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    event_id INTEGER PRIMARY KEY,
+                    ts REAL NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    event TEXT NOT NULL,
+                    handler TEXT
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_event_ts ON events(event, ts)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_user_event_ts ON events(user_id, event, ts)")
+            log_db("CREATE TABLE", "events")
+            
+            # اولین بار روی دیتابیس قدیمی: ساخت rollup ها از سفارشات موجود
+            cursor.execute("SELECT value FROM meta WHERE key = 'rollups_built'")
+            if cursor.fetchone() is None:
+                self._rebuild_rollups(cursor)
+                cursor.execute("INSERT INTO meta (key, value) VALUES ('rollups_built', 1)")
+            
+            # PRAGMA پارامتر نمی‌پذیرد؛ مقدار یک ثابت عددی است
+            cursor.execute(f"PRAGMA user_version = {int(self.SCHEMA_VERSION)}")
         
         logger.info("✅ جداول با موفقیت ایجاد شدند")
     
@@ -144,7 +276,7 @@ class Database:
         last_name: Optional[str] = None
     ):
         """افزودن یا به‌روزرسانی کاربر"""
-        logger.debug(f"افزودن/به‌روزرسانی کاربر {user_id}")
+        logger.debug("افزودن/به‌روزرسانی کاربر %s", user_id)
         
         try:
             with self._get_connection() as conn:
@@ -160,16 +292,16 @@ class Database:
                         last_seen = CURRENT_TIMESTAMP
                 """, (user_id, username, first_name, last_name, username, first_name, last_name))
                 
-                log_db("UPSERT", f"user {user_id} (@{username})")
-                logger.info(f"✅ کاربر {user_id} ثبت/به‌روزرسانی شد")
-                
+                log_db("UPSERT", "user %s (@%s)", user_id, username)
+                logger.info("✅ کاربر %s ثبت/به‌روزرسانی شد", user_id)
+        
         except Exception as e:
             log_error(e, "add_or_update_user", user_id)
             raise
     
     def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
         """دریافت اطلاعات کاربر"""
-        logger.debug(f"دریافت اطلاعات کاربر {user_id}")
+        logger.debug("دریافت اطلاعات کاربر %s", user_id)
         
         try:
             with self._get_connection() as conn:
@@ -179,19 +311,19 @@ class Database:
                 
                 if row:
                     result = dict(row)
-                    log_db("SELECT", f"user {user_id} found")
+                    log_db("SELECT", "user %s found", user_id)
                     return result
                 
-                log_db("SELECT", f"user {user_id} not found")
+                log_db("SELECT", "user %s not found", user_id)
                 return None
-                
+        
         except Exception as e:
             log_error(e, "get_user", user_id)
             raise
     
     def is_user_blocked(self, user_id: int) -> bool:
         """بررسی بلاک بودن کاربر"""
-        logger.debug(f"بررسی بلاک کاربر {user_id}")
+        logger.debug("بررسی بلاک کاربر %s", user_id)
         
         try:
             with self._get_connection() as conn:
@@ -201,15 +333,52 @@ class Database:
                 
                 if row:
                     is_blocked = bool(row['is_blocked'])
-                    log_db("SELECT", f"user {user_id} blocked={is_blocked}")
+                    log_db("SELECT", "user %s blocked=%s", user_id, is_blocked)
                     return is_blocked
                 
                 return False
-                
+        
         except Exception as e:
             log_error(e, "is_user_blocked", user_id)
             return False
     
+    def get_blocked_user_ids(self) -> List[int]:
+        """دریافت شناسه تمام کاربران بلاک شده"""
+        logger.debug("دریافت لیست کاربران بلاک شده")
+        
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT user_id FROM users WHERE is_blocked = 1")
+                result = [row['user_id'] for row in cursor.fetchall()]
+                
+                log_db("SELECT", "found %s blocked users", len(result))
+                return result
+        
+        except Exception as e:
+            log_error(e, "get_blocked_user_ids")
+            raise
+    
+    def set_user_blocked(self, user_id: int, blocked: bool = True):
+        """بلاک یا آنبلاک کردن کاربر"""
+        logger.debug("تغییر وضعیت بلاک کاربر %s به %s", user_id, blocked)
+        
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO users (user_id, is_blocked)
+                    VALUES (?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET is_blocked = ?
+                """, (user_id, int(blocked), int(blocked)))
+                
+                log_db("UPDATE", "user %s blocked=%s", user_id, blocked)
+                logger.info("✅ وضعیت بلاک کاربر %s: %s", user_id, blocked)
+        
+        except Exception as e:
+            log_error(e, "set_user_blocked", user_id)
+            raise
+    
     def get_all_users(self) -> List[Dict[str, Any]]:
         """دریافت لیست تمام کاربران"""
         logger.debug("دریافت لیست کاربران")
@@ -221,11 +390,11 @@ class Database:
                 rows = cursor.fetchall()
                 
                 result = [dict(row) for row in rows]
-                log_db("SELECT", f"found {len(result)} users")
-                logger.info(f"📊 تعداد کاربران: {len(result)}")
+                log_db("SELECT", "found %s users", len(result))
+                logger.info("📊 تعداد کاربران: %s", len(result))
                 
                 return result
-                
+        
         except Exception as e:
             log_error(e, "get_all_users")
             raise
@@ -241,7 +410,7 @@ class Database:
         image_file_id: Optional[str] = None
     ) -> int:
         """افزودن محصول جدید"""
-        logger.debug(f"افزودن محصول: {name}")
+        logger.debug("افزودن محصول: %s", name)
         
         try:
             with self._get_connection() as conn:
@@ -254,18 +423,18 @@ class Database:
                 
                 product_id = cursor.lastrowid
                 
-                log_db("INSERT", f"product '{name}' (ID: {product_id})")
-                logger.info(f"✅ محصول '{name}' با ID {product_id} اضافه شد")
+                log_db("INSERT", "product '%s' (ID: %s)", name, product_id)
+                logger.info("✅ محصول '%s' با ID %s اضافه شد", name, product_id)
                 
                 return product_id
-                
+        
         except Exception as e:
             log_error(e, f"add_product: {name}")
             raise
     
     def get_product(self, product_id: int) -> Optional[Dict[str, Any]]:
         """دریافت اطلاعات محصول"""
-        logger.debug(f"دریافت محصول {product_id}")
+        logger.debug("دریافت محصول %s", product_id)
         
         try:
             with self._get_connection() as conn:
@@ -275,19 +444,49 @@ class Database:
                 
                 if row:
                     result = dict(row)
-                    log_db("SELECT", f"product {product_id} found: {result['name']}")
+                    log_db("SELECT", "product %s found: %s", product_id, result['name'])
                     return result
                 
-                log_db("SELECT", f"product {product_id} not found")
+                log_db("SELECT", "product %s not found", product_id)
                 return None
-                
+        
         except Exception as e:
             log_error(e, f"get_product: {product_id}")
             raise
     
+    def get_products(self, product_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """
+        دریافت چند محصول با یک کوئری: {product_id: محصول}
+        
+        برای سبد خرید و ثبت سفارش به جای یک get_product برای هر قلم (N+1).
+        محصولات ناموجود در خروجی نیستند.
+        """
+        ids = list(dict.fromkeys(product_ids))
+        if not ids:
+            return {}
+        
+        try:
+            with self._get_connection() as conn:
+                products = {}
+                # سقف پارامترهای SQLite (999 در نسخه‌های قدیمی)
+                for i in range(0, len(ids), 900):
+                    chunk = ids[i:i + 900]
+                    placeholders = ",".join("?" * len(chunk))
+                    cursor = conn.execute(
+                        f"SELECT * FROM products WHERE product_id IN ({placeholders})", chunk
+                    )
+                    products.update((row['product_id'], dict(row)) for row in cursor)
+                
+                log_db("SELECT", "%s/%s products found", len(products), len(ids))
+                return products
+        
+        except Exception as e:
+            log_error(e, f"get_products: {len(ids)} ids")
+            raise
+    
     def get_all_products(self, active_only: bool = True) -> List[Dict[str, Any]]:
         """دریافت لیست محصولات"""
-        logger.debug(f"دریافت محصولات (فعال فقط: {active_only})")
+        logger.debug("دریافت محصولات (فعال فقط: %s)", active_only)
         
         try:
             with self._get_connection() as conn:
@@ -305,11 +504,11 @@ class Database:
                 rows = cursor.fetchall()
                 result = [dict(row) for row in rows]
                 
-                log_db("SELECT", f"found {len(result)} products")
-                logger.info(f"📦 تعداد محصولات: {len(result)}")
+                log_db("SELECT", "found %s products", len(result))
+                logger.info("📦 تعداد محصولات: %s", len(result))
                 
                 return result
-                
+        
         except Exception as e:
             log_error(e, "get_all_products")
             raise
@@ -325,7 +524,7 @@ class Database:
         is_active: Optional[bool] = None
     ):
         """به‌روزرسانی محصول"""
-        logger.debug(f"به‌روزرسانی محصول {product_id}")
+        logger.debug("به‌روزرسانی محصول %s", product_id)
         
         try:
             with self._get_connection() as conn:
@@ -359,7 +558,7 @@ class Database:
                     values.append(1 if is_active else 0)
                 
                 if not updates:
-                    logger.warning(f"هیچ فیلدی برای به‌روزرسانی محصول {product_id} وجود ندارد")
+                    logger.warning("هیچ فیلدی برای به‌روزرسانی محصول %s وجود ندارد", product_id)
                     return
                 
                 updates.append("updated_at = CURRENT_TIMESTAMP")
@@ -368,16 +567,16 @@ class Database:
                 query = f"UPDATE products SET {', '.join(updates)} WHERE product_id = ?"
                 cursor.execute(query, values)
                 
-                log_db("UPDATE", f"product {product_id} - {len(updates)} fields")
-                logger.info(f"✅ محصول {product_id} به‌روزرسانی شد")
-                
+                log_db("UPDATE", "product %s - %s fields", product_id, len(updates))
+                logger.info("✅ محصول %s به‌روزرسانی شد", product_id)
+        
         except Exception as e:
             log_error(e, f"update_product: {product_id}")
             raise
     
     def update_product_channel_message(self, product_id: int, message_id: int):
         """به‌روزرسانی شناسه پیام کانال"""
-        logger.debug(f"به‌روزرسانی message_id محصول {product_id}")
+        logger.debug("به‌روزرسانی message_id محصول %s", product_id)
         
         try:
             with self._get_connection() as conn:
@@ -388,21 +587,21 @@ class Database:
                     WHERE product_id = ?
                 """, (message_id, product_id))
                 
-                log_db("UPDATE", f"product {product_id} channel_message_id = {message_id}")
-                logger.info(f"✅ message_id محصول {product_id} به‌روزرسانی شد")
-                
+                log_db("UPDATE", "product %s channel_message_id = %s", product_id, message_id)
+                logger.info("✅ message_id محصول %s به‌روزرسانی شد", product_id)
+        
         except Exception as e:
             log_error(e, f"update_product_channel_message: {product_id}")
             raise
     
     def delete_product(self, product_id: int):
         """حذف محصول (غیرفعال کردن)"""
-        logger.debug(f"غیرفعال کردن محصول {product_id}")
+        logger.debug("غیرفعال کردن محصول %s", product_id)
         
         try:
             self.update_product(product_id, is_active=False)
-            logger.info(f"✅ محصول {product_id} غیرفعال شد")
-            
+            logger.info("✅ محصول %s غیرفعال شد", product_id)
+        
         except Exception as e:
             log_error(e, f"delete_product: {product_id}")
             raise
@@ -411,7 +610,7 @@ class Database:
     
     def create_order(self, user_id: int, notes: Optional[str] = None) -> int:
         """ایجاد سفارش جدید"""
-        logger.debug(f"ایجاد سفارش برای کاربر {user_id}")
+        logger.debug("ایجاد سفارش برای کاربر %s", user_id)
         
         try:
             with self._get_connection() as conn:
@@ -424,11 +623,11 @@ class Database:
                 
                 order_id = cursor.lastrowid
                 
-                log_db("INSERT", f"order {order_id} for user {user_id}")
-                logger.info(f"✅ سفارش {order_id} برای کاربر {user_id} ایجاد شد")
+                log_db("INSERT", "order %s for user %s", order_id, user_id)
+                logger.info("✅ سفارش %s برای کاربر %s ایجاد شد", order_id, user_id)
                 
                 return order_id
-                
+        
         except Exception as e:
             log_error(e, f"create_order for user {user_id}")
             raise
@@ -441,7 +640,7 @@ class Database:
         price_at_order: int
     ):
         """افزودن آیتم به سفارش"""
-        logger.debug(f"افزودن آیتم به سفارش {order_id}")
+        logger.debug("افزودن آیتم به سفارش %s", order_id)
         
         try:
             with self._get_connection() as conn:
@@ -452,16 +651,45 @@ class Database:
                     VALUES (?, ?, ?, ?)
                 """, (order_id, product_id, quantity, price_at_order))
                 
-                log_db("INSERT", f"order_item: order={order_id}, product={product_id}, qty={quantity}")
-                logger.info(f"✅ آیتم به سفارش {order_id} اضافه شد")
-                
+                log_db("INSERT", "order_item: order=%s, product=%s, qty=%s", order_id, product_id, quantity)
+                logger.info("✅ آیتم به سفارش %s اضافه شد", order_id)
+        
         except Exception as e:
             log_error(e, f"add_order_item: order {order_id}")
             raise
     
+    def add_order_items(self, order_id: int, items: List[Tuple[int, int, int]]):
+        """
+        افزودن همه آیتم‌های سفارش و کم کردن موجودی در یک تراکنش
+        
+        Args:
+            items: [(product_id, quantity, price_at_order)]
+        """
+        logger.debug("افزودن %s آیتم به سفارش %s", len(items), order_id)
+        
+        try:
+            with self._get_connection() as conn:
+                conn.executemany("""
+                    INSERT INTO order_items (order_id, product_id, quantity, price_at_order)
+                    VALUES (?, ?, ?, ?)
+                """, [(order_id, product_id, quantity, price) for product_id, quantity, price in items])
+                
+                conn.executemany("""
+                    UPDATE products
+                    SET stock = stock - ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE product_id = ?
+                """, [(quantity, product_id) for product_id, quantity, _ in items])
+                
+                log_db("INSERT", "%s order_items for order %s", len(items), order_id)
+                logger.info("✅ %s آیتم به سفارش %s اضافه شد", len(items), order_id)
+        
+        except Exception as e:
+            log_error(e, f"add_order_items: order {order_id}")
+            raise
+    
     def get_order(self, order_id: int) -> Optional[Dict[str, Any]]:
         """دریافت اطلاعات سفارش"""
-        logger.debug(f"دریافت سفارش {order_id}")
+        logger.debug("دریافت سفارش %s", order_id)
         
         try:
             with self._get_connection() as conn:
@@ -471,19 +699,19 @@ class Database:
                 
                 if row:
                     result = dict(row)
-                    log_db("SELECT", f"order {order_id} found")
+                    log_db("SELECT", "order %s found", order_id)
                     return result
                 
-                log_db("SELECT", f"order {order_id} not found")
+                log_db("SELECT", "order %s not found", order_id)
                 return None
-                
+        
         except Exception as e:
             log_error(e, f"get_order: {order_id}")
             raise
     
     def get_order_items(self, order_id: int) -> List[Dict[str, Any]]:
         """دریافت آیتم‌های سفارش"""
-        logger.debug(f"دریافت آیتم‌های سفارش {order_id}")
+        logger.debug("دریافت آیتم‌های سفارش %s", order_id)
         
         try:
             with self._get_connection() as conn:
@@ -498,36 +726,58 @@ class Database:
                 rows = cursor.fetchall()
                 result = [dict(row) for row in rows]
                 
-                log_db("SELECT", f"found {len(result)} items for order {order_id}")
+                log_db("SELECT", "found %s items for order %s", len(result), order_id)
                 return result
-                
+        
         except Exception as e:
             log_error(e, f"get_order_items: {order_id}")
             raise
     
     def update_order_status(self, order_id: int, status: str):
         """به‌روزرسانی وضعیت سفارش"""
-        logger.debug(f"به‌روزرسانی وضعیت سفارش {order_id} به {status}")
+        logger.debug("به‌روزرسانی وضعیت سفارش %s به %s", order_id, status)
         
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("""
-                    UPDATE orders 
-                    SET status = ? 
-                    WHERE order_id = ?
-                """, (status, order_id))
-                
-                log_db("UPDATE", f"order {order_id} status = {status}")
-                logger.info(f"✅ وضعیت سفارش {order_id} به {status} تغییر کرد")
                 
+                # تغییر وضعیت فقط اگر از زمان خواندن عوض نشده باشد؛ در غیر این صورت
+                # نویسنده دیگری (پروسه یا thread دیگر) زودتر نوشته و rollup آن
+                # تغییر را اعمال کرده است، پس با وضعیت جدید دوباره تلاش می‌شود
+                while True:
+                    cursor.execute("SELECT status FROM orders WHERE order_id = ?", (order_id,))
+                    row = cursor.fetchone()
+                    if row is None:
+                        break
+                    
+                    old_status = row['status']
+                    cursor.execute("""
+                        UPDATE orders 
+                        SET status = ? 
+                        WHERE order_id = ? AND status IS ?
+                    """, (status, order_id, old_status))
+                    
+                    if cursor.rowcount == 1:
+                        break
+                
+                # به‌روزرسانی rollup ها فقط هنگام ورود/خروج از وضعیت فروش (در همان
+                # تراکنشی که UPDATE قفل نوشتن را گرفته است)
+                if row is not None:
+                    was_sale = old_status in self.SALE_STATUSES
+                    is_sale = status in self.SALE_STATUSES
+                    if was_sale != is_sale:
+                        self._apply_order_rollup(cursor, order_id, 1 if is_sale else -1)
+                
+                log_db("UPDATE", "order %s status = %s", order_id, status)
+                logger.info("✅ وضعیت سفارش %s به %s تغییر کرد", order_id, status)
+        
         except Exception as e:
             log_error(e, f"update_order_status: {order_id}")
             raise
     
     def get_user_orders(self, user_id: int) -> List[Dict[str, Any]]:
         """دریافت سفارشات کاربر"""
-        logger.debug(f"دریافت سفارشات کاربر {user_id}")
+        logger.debug("دریافت سفارشات کاربر %s", user_id)
         
         try:
             with self._get_connection() as conn:
@@ -541,16 +791,16 @@ class Database:
                 rows = cursor.fetchall()
                 result = [dict(row) for row in rows]
                 
-                log_db("SELECT", f"found {len(result)} orders for user {user_id}")
+                log_db("SELECT", "found %s orders for user %s", len(result), user_id)
                 return result
-                
+        
         except Exception as e:
             log_error(e, f"get_user_orders: {user_id}")
             raise
     
     def get_all_orders(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
         """دریافت لیست سفارشات"""
-        logger.debug(f"دریافت سفارشات (وضعیت: {status or 'همه'})")
+        logger.debug("دریافت سفارشات (وضعیت: %s)", status or 'همه')
         
         try:
             with self._get_connection() as conn:
@@ -568,11 +818,11 @@ class Database:
                 rows = cursor.fetchall()
                 result = [dict(row) for row in rows]
                 
-                log_db("SELECT", f"found {len(result)} orders")
-                logger.info(f"📋 تعداد سفارشات: {len(result)}")
+                log_db("SELECT", "found %s orders", len(result))
+                logger.info("📋 تعداد سفارشات: %s", len(result))
                 
                 return result
-                
+        
         except Exception as e:
             log_error(e, "get_all_orders")
             raise
@@ -610,15 +860,563 @@ class Database:
                     'pending_orders': pending_orders
                 }
                 
-                log_db("SELECT", f"stats retrieved")
-                logger.info(f"📊 آمار: {stats}")
+                log_db("SELECT", "stats retrieved")
+                logger.info("📊 آمار: %s", stats)
                 
                 return stats
-                
+        
         except Exception as e:
             log_error(e, "get_stats")
             raise
-
+    
+    
+    # ========== گزارش‌های تحلیلی ==========
+    
+    # وضعیت‌هایی که فروش قطعی حساب می‌شوند
+    SALE_STATUSES = ('confirmed', 'completed')
+    
+    def get_data_version(self) -> int:
+        """نسخه فعلی داده‌های گزارش (برای کلید کش)"""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT value FROM meta WHERE key = 'data_version'")
+                row = cursor.fetchone()
+                return row['value'] if row else 0
+        
+        except Exception as e:
+            log_error(e, "get_data_version")
+            raise
+    
+    def _apply_order_rollup(self, cursor: sqlite3.Cursor, order_id: int, sign: int):
+        """
+        افزودن (sign=1) یا کم کردن (sign=-1) یک سفارش از جداول rollup
+        
+        روز و ساعت بر اساس زمان ثبت سفارش است (مثل گزارش‌های قبلی).
+        """
+        cursor.execute("""
+            INSERT INTO daily_sales (day, order_count, total_sales)
+            SELECT DATE(o.created_at), ?, ? * COALESCE(SUM(oi.quantity * oi.price_at_order), 0)
+            FROM orders o
+            LEFT JOIN order_items oi ON oi.order_id = o.order_id
+            WHERE o.order_id = ?
+            GROUP BY o.order_id
+            ON CONFLICT(day) DO UPDATE SET
+                order_count = order_count + excluded.order_count,
+                total_sales = total_sales + excluded.total_sales
+        """, (sign, sign, order_id))
+        
+        cursor.execute("""
+            INSERT INTO hourly_orders (day, hour, order_count)
+            SELECT DATE(created_at), strftime('%H', created_at), ?
+            FROM orders
+            WHERE order_id = ?
+            ON CONFLICT(day, hour) DO UPDATE SET
+                order_count = order_count + excluded.order_count
+        """, (sign, order_id))
+        
+        cursor.execute("""
+            INSERT INTO product_daily_sales (day, product_id, quantity, revenue)
+            SELECT DATE(o.created_at), oi.product_id,
+                   ? * SUM(oi.quantity), ? * SUM(oi.quantity * oi.price_at_order)
+            FROM order_items oi
+            JOIN orders o ON o.order_id = oi.order_id
+            WHERE oi.order_id = ?
+            GROUP BY oi.product_id
+            ON CONFLICT(day, product_id) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                revenue = revenue + excluded.revenue
+        """, (sign, sign, order_id))
+        
+        log_db("UPSERT", "rollups for order %s (%+d)", order_id, sign)
+    
+    def _rebuild_rollups(self, cursor: sqlite3.Cursor) -> Dict[str, int]:
+        """ساخت کامل جداول rollup از روی سفارشات"""
+        statuses = self.SALE_STATUSES
+        
+        cursor.execute("DELETE FROM daily_sales")
+        cursor.execute("DELETE FROM hourly_orders")
+        cursor.execute("DELETE FROM product_daily_sales")
+        
+        cursor.execute("""
+            INSERT INTO daily_sales (day, order_count, total_sales)
+            SELECT DATE(o.created_at),
+                   COUNT(DISTINCT o.order_id),
+                   COALESCE(SUM(oi.quantity * oi.price_at_order), 0)
+            FROM orders o
+            LEFT JOIN order_items oi ON oi.order_id = o.order_id
+            WHERE o.status IN (?, ?)
+            GROUP BY DATE(o.created_at)
+        """, statuses)
+        
+        cursor.execute("""
+            INSERT INTO hourly_orders (day, hour, order_count)
+            SELECT DATE(created_at), strftime('%H', created_at), COUNT(*)
+            FROM orders
+            WHERE status IN (?, ?)
+            GROUP BY DATE(created_at), strftime('%H', created_at)
+        """, statuses)
+        
+        cursor.execute("""
+            INSERT INTO product_daily_sales (day, product_id, quantity, revenue)
+            SELECT DATE(o.created_at), oi.product_id,
+                   SUM(oi.quantity), SUM(oi.quantity * oi.price_at_order)
+            FROM order_items oi
+            JOIN orders o ON o.order_id = oi.order_id
+            WHERE o.status IN (?, ?)
+            GROUP BY DATE(o.created_at), oi.product_id
+        """, statuses)
+        
+        counts = {}
+        for table in ('daily_sales', 'hourly_orders', 'product_daily_sales'):
+            cursor.execute(f"SELECT COUNT(*) AS count FROM {table}")
+            counts[table] = cursor.fetchone()['count']
+        
+        log_db("REBUILD", "rollups: %s", counts)
+        logger.info("✅ جداول rollup بازسازی شدند: %s", counts)
+        return counts
+    
+    def rebuild_rollups(self) -> Dict[str, int]:
+        """بازسازی جداول rollup (backfill داده‌های قدیمی)"""
+        logger.info("در حال بازسازی جداول rollup...")
+        
+        try:
+            with self._get_connection() as conn:
+                return self._rebuild_rollups(conn.cursor())
+        
+        except Exception as e:
+            log_error(e, "rebuild_rollups")
+            raise
+    
+    def get_sales_by_day(self, days: int = 30) -> List[Tuple[str, int, int]]:
+        """فروش روزانه: [(date, order_count, total_sales)]"""
+        logger.debug("دریافت فروش روزانه (%s روز)", days)
+        
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT day, order_count, total_sales
+                    FROM daily_sales
+                    WHERE day >= DATE('now', ?) AND order_count > 0
+                    ORDER BY day
+                """, (f'-{days} days',))
+                
+                result = [tuple(row) for row in cursor.fetchall()]
+                log_db("SELECT", "sales by day: %s rows", len(result))
+                return result
+        
+        except Exception as e:
+            log_error(e, "get_sales_by_day")
+            raise
+    
+    def get_revenue_by_day(self, days: int = 30) -> List[Tuple[str, int, int, int]]:
+        """درآمد روزانه: [(date, gross, discount, net)]"""
+        logger.debug("دریافت درآمد روزانه (%s روز)", days)
+        
+        # تخفیف در جدول سفارشات ثبت نمی‌شود؛ درآمد خالص = ناخالص
+        return [
+            (date, total_sales, 0, total_sales)
+            for date, _, total_sales in self.get_sales_by_day(days)
+        ]
+    
+    def get_popular_products(self, limit: int = 10) -> List[Tuple[str, int]]:
+        """محبوب‌ترین محصولات: [(name, quantity)]"""
+        logger.debug("دریافت %s محصول محبوب", limit)
+        
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT p.name AS name, s.quantity AS quantity
+                    FROM (
+                        SELECT product_id, SUM(quantity) AS quantity
+                        FROM product_daily_sales
+                        GROUP BY product_id
+                    ) s
+                    JOIN products p ON p.product_id = s.product_id
+                    WHERE s.quantity > 0
+                    ORDER BY s.quantity DESC
+                    LIMIT ?
+                """, (limit,))
+                
+                result = [tuple(row) for row in cursor.fetchall()]
+                log_db("SELECT", "popular products: %s rows", len(result))
+                return result
+        
+        except Exception as e:
+            log_error(e, "get_popular_products")
+            raise
+    
+    def get_hourly_order_counts(self, days: int = 30) -> List[Tuple[str, int]]:
+        """تعداد سفارش (فروش قطعی) در هر ساعت روز: [('HH', count)]"""
+        logger.debug("دریافت سفارشات ساعتی (%s روز)", days)
+        
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT hour, SUM(order_count) AS count
+                    FROM hourly_orders
+                    WHERE day >= DATE('now', ?)
+                    GROUP BY hour
+                    HAVING count > 0
+                    ORDER BY hour
+                """, (f'-{days} days',))
+                
+                result = [tuple(row) for row in cursor.fetchall()]
+                log_db("SELECT", "hourly orders: %s rows", len(result))
+                return result
+        
+        except Exception as e:
+            log_error(e, "get_hourly_order_counts")
+            raise
+    
+    def get_product_daily_quantities(self, days: int = 56) -> List[Tuple[int, int, int]]:
+        """
+        فروش روزانه هر محصول در روزهای کامل اخیر: [(product_id, age, quantity)]
+        
+        age تعداد روز قبل از امروز است (1 = دیروز)؛ امروز که هنوز کامل نشده حذف می‌شود.
+        """
+        logger.debug("دریافت فروش روزانه محصولات (%s روز)", days)
+        
+        try:
+            with self._get_connection() as conn:
+                conn.row_factory = None
+                cursor = conn.execute("""
+                    SELECT product_id,
+                           CAST(julianday(DATE('now')) - julianday(day) AS INTEGER) AS age,
+                           quantity
+                    FROM product_daily_sales
+                    WHERE day >= DATE('now', ?) AND day < DATE('now') AND quantity > 0
+                """, (f'-{days} days',))
+                
+                result = cursor.fetchall()
+                log_db("SELECT", "product daily quantities: %s rows", len(result))
+                return result
+        
+        except Exception as e:
+            log_error(e, "get_product_daily_quantities")
+            raise
+    
+    def get_stock_levels(self) -> List[Tuple[int, str, int]]:
+        """موجودی محصولات فعال: [(product_id, name, stock)]"""
+        logger.debug("دریافت موجودی محصولات")
+        
+        try:
+            with self._get_connection() as conn:
+                conn.row_factory = None
+                cursor = conn.execute("""
+                    SELECT product_id, name, COALESCE(stock, 0)
+                    FROM products
+                    WHERE is_active = 1
+                    ORDER BY product_id
+                """)
+                
+                result = cursor.fetchall()
+                log_db("SELECT", "stock levels: %s products", len(result))
+                return result
+        
+        except Exception as e:
+            log_error(e, "get_stock_levels")
+            raise
+    
+    def stream_sale_orders(self, chunk_size: int = 50000) -> Iterator[List[Tuple[int, int, int]]]:
+        """
+        خواندن تکه‌تکه سفارشات فروش: chunk هایی از (user_id, created_ts, amount)
+        
+        برای تحلیل‌های NumPy؛ کل نتیجه هیچ‌وقت به شکل لیست dict ساخته نمی‌شود.
+        """
+        logger.debug("stream سفارشات فروش (chunk=%s)", chunk_size)
+        
+        try:
+            with self._get_connection() as conn:
+                conn.row_factory = None
+                cursor = conn.execute("""
+                    SELECT o.user_id,
+                           CAST(strftime('%s', o.created_at) AS INTEGER),
+                           COALESCE(SUM(oi.quantity * oi.price_at_order), 0)
+                    FROM orders o
+                    LEFT JOIN order_items oi ON oi.order_id = o.order_id
+                    WHERE o.status IN (?, ?)
+                    GROUP BY o.order_id
+                """, self.SALE_STATUSES)
+                
+                total = 0
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    total += len(rows)
+                    yield rows
+                
+                log_db("SELECT", "streamed %s sale orders", total)
+        
+        except Exception as e:
+            log_error(e, "stream_sale_orders")
+            raise
+    
+    def get_conversion_stats(self) -> Dict[str, Any]:
+        """نرخ تبدیل کاربران به خریدار"""
+        logger.debug("دریافت نرخ تبدیل")
+        
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("SELECT COUNT(*) AS count FROM users")
+                total_users = cursor.fetchone()['count']
+                
+                cursor.execute("SELECT COALESCE(SUM(order_count), 0) AS orders FROM daily_sales")
+                orders = cursor.fetchone()['orders']
+                
+                # تعداد خریداران یکتا از rollup قابل محاسبه نیست
+                cursor.execute("""
+                    SELECT COUNT(DISTINCT user_id) AS buyers
+                    FROM orders
+                    WHERE status IN (?, ?)
+                """, self.SALE_STATUSES)
+                buyers = cursor.fetchone()['buyers']
+                
+                log_db("SELECT", "conversion stats retrieved")
+                
+                return {
+                    'total_users': total_users,
+                    'buyers': buyers,
+                    'non_buyers': max(total_users - buyers, 0),
+                    'conversion_rate': (buyers / total_users * 100) if total_users > 0 else 0,
+                    'total_orders': orders,
+                    'repeat_rate': (orders / buyers) if buyers > 0 else 0
+                }
+        
+        except Exception as e:
+            log_error(e, "get_conversion_stats")
+            raise
+    
+    # ========== محصولات هم‌خرید ==========
+    
+    def stream_order_baskets(self, chunk_size: int = 100000) -> Iterator[List[Tuple[int, int]]]:
+        """
+        سبدهای سفارشات فروش: chunk هایی از (order_id, product_id) مرتب بر اساس order_id
+        
+        هر محصول در هر سفارش یک بار می‌آید؛ یک سفارش ممکن است بین دو chunk تقسیم شود.
+        """
+        logger.debug("stream سبدهای سفارش (chunk=%s)", chunk_size)
+        
+        return self._stream_query("""
+            SELECT DISTINCT oi.order_id, oi.product_id
+            FROM order_items oi
+            JOIN orders o ON o.order_id = oi.order_id
+            WHERE o.status IN (?, ?)
+            ORDER BY oi.order_id
+        """, self.SALE_STATUSES, chunk_size, "order baskets")
+    
+    def replace_product_neighbors(self, rows: List[Tuple[int, int, int, float]]) -> int:
+        """جایگزینی کامل جدول هم‌خریدها با [(product_id, rank, neighbor_id, score)]"""
+        logger.debug("جایگزینی %s ردیف product_neighbors", len(rows))
+        
+        try:
+            with self._get_connection() as conn:
+                conn.execute("DELETE FROM product_neighbors")
+                conn.executemany("""
+                    INSERT INTO product_neighbors (product_id, rank, neighbor_id, score)
+                    VALUES (?, ?, ?, ?)
+                """, rows)
+                
+                log_db("REPLACE", "product_neighbors: %s rows", len(rows))
+                return len(rows)
+        
+        except Exception as e:
+            log_error(e, "replace_product_neighbors")
+            raise
+    
+    def has_product_neighbors(self) -> bool:
+        """آیا جدول هم‌خریدها تا به حال ساخته شده است؟"""
+        with self._get_connection() as conn:
+            return conn.execute("SELECT 1 FROM product_neighbors LIMIT 1").fetchone() is not None
+    
+    def get_product_neighbors(
+        self,
+        product_ids: List[int],
+        limit: int = 3
+    ) -> List[Tuple[int, str]]:
+        """
+        محصولات موجودی که همراه این محصولات خریده شده‌اند: [(product_id, name)]
+        
+        برای یک محصول یک range scan روی کلید اصلی است؛ برای سبد خرید
+        امتیاز همسایه‌های همه محصولات جمع می‌شود.
+        """
+        if not product_ids:
+            return []
+        
+        placeholders = ",".join("?" * len(product_ids))
+        
+        try:
+            with self._get_connection() as conn:
+                conn.row_factory = None
+                cursor = conn.execute(f"""
+                    SELECT p.product_id, p.name
+                    FROM product_neighbors n
+                    JOIN products p ON p.product_id = n.neighbor_id
+                    WHERE n.product_id IN ({placeholders})
+                      AND n.neighbor_id NOT IN ({placeholders})
+                      AND p.is_active = 1 AND p.stock > 0
+                    GROUP BY p.product_id
+                    ORDER BY SUM(n.score) DESC
+                    LIMIT ?
+                """, (*product_ids, *product_ids, limit))
+                
+                return cursor.fetchall()
+        
+        except Exception as e:
+            log_error(e, "get_product_neighbors")
+            raise
+    
+    # ========== رویدادهای کاربران ==========
+    
+    def insert_events(self, rows: List[Tuple[float, int, str, Optional[str]]]) -> int:
+        """درج دسته‌ای رویدادها: [(ts, user_id, event, handler)]"""
+        try:
+            with self._get_connection() as conn:
+                conn.executemany(
+                    "INSERT INTO events (ts, user_id, event, handler) VALUES (?, ?, ?, ?)",
+                    rows
+                )
+                
+                log_db("INSERT", "events: %s rows", len(rows))
+                return len(rows)
+        
+        except Exception as e:
+            log_error(e, "insert_events")
+            raise
+    
+    def get_funnel(self, steps: List[str], since: float, until: float) -> List[int]:
+        """
+        قیف تبدیل: تعداد کاربران یکتایی که به ترتیب به هر مرحله رسیده‌اند
+        
+        مرحله اول: کاربرانی که رویداد اول را در بازه داشته‌اند. هر مرحله بعدی
+        فقط وقتی حساب می‌شود که بعد از اولین رسیدن همان کاربر به مرحله قبل باشد.
+        
+        Args:
+            steps: نام رویدادها به ترتیب (مثلاً FUNNEL_STEPS)
+            since, until: بازه زمانی (unix timestamp)
+        
+        Returns:
+            تعداد کاربران هر مرحله
+        """
+        if not steps:
+            return []
+        
+        # یک CTE برای هر مرحله: اولین زمان رسیدن هر کاربر
+        ctes = ["""s0 AS (
+            SELECT user_id, MIN(ts) AS ts FROM events
+            WHERE event = ? AND ts >= ? AND ts < ?
+            GROUP BY user_id
+        )"""]
+        params: List[Any] = [steps[0], since, until]
+        
+        for i in range(1, len(steps)):
+            ctes.append(f"""s{i} AS (
+                SELECT e.user_id, MIN(e.ts) AS ts
+                FROM s{i - 1} p
+                JOIN events e ON e.user_id = p.user_id AND e.ts >= p.ts AND e.ts < ?
+                WHERE e.event = ?
+                GROUP BY e.user_id
+            )""")
+            params.extend([until, steps[i]])
+        
+        counts = ", ".join(f"(SELECT COUNT(*) FROM s{i})" for i in range(len(steps)))
+        
+        try:
+            with self._get_connection() as conn:
+                conn.row_factory = None
+                row = conn.execute(f"WITH {', '.join(ctes)} SELECT {counts}", params).fetchone()
+                
+                log_db("SELECT", "funnel: %s", row)
+                return list(row)
+        
+        except Exception as e:
+            log_error(e, "get_funnel")
+            raise
+    
+    def purge_events(self, before: float) -> int:
+        """حذف رویدادهای قدیمی‌تر از before (unix timestamp)"""
+        try:
+            with self._get_connection() as conn:
+                deleted = conn.execute("DELETE FROM events WHERE ts < ?", (before,)).rowcount
+                
+                log_db("DELETE", "events: %s old rows", deleted)
+                return deleted
+        
+        except Exception as e:
+            log_error(e, "purge_events")
+            raise
+    
+    # ========== خروجی (export) ==========
+    
+    EXPORT_ORDER_COLUMNS = (
+        'order_id', 'created_at', 'status', 'user_id', 'username',
+        'product_id', 'product_name', 'quantity', 'price_at_order', 'line_total'
+    )
+    EXPORT_USER_COLUMNS = (
+        'user_id', 'username', 'first_name', 'last_name',
+        'created_at', 'last_seen', 'is_blocked', 'orders'
+    )
+    
+    def _stream_query(self, query: str, params: tuple, chunk_size: int, label: str) -> Iterator[List[tuple]]:
+        """اجرای کوئری و خواندن تکه‌تکه نتیجه به شکل tuple"""
+        try:
+            with self._get_connection() as conn:
+                conn.row_factory = None
+                cursor = conn.execute(query, params)
+                
+                total = 0
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    total += len(rows)
+                    yield rows
+                
+                log_db("SELECT", "streamed %s %s", total, label)
+        
+        except Exception as e:
+            log_error(e, f"stream {label}")
+            raise
+    
+    def stream_orders_export(self, start: str, end: str, chunk_size: int = 5000) -> Iterator[List[tuple]]:
+        """
+        آیتم‌های سفارش‌های ثبت شده در بازه [start, end) به ترتیب EXPORT_ORDER_COLUMNS
+        
+        Args:
+            start, end: تاریخ/زمان به شکل 'YYYY-MM-DD' یا 'YYYY-MM-DD HH:MM:SS'
+        """
+        logger.debug("stream خروجی سفارشات %s تا %s", start, end)
+        
+        return self._stream_query("""
+            SELECT o.order_id, o.created_at, o.status, o.user_id, u.username,
+                   oi.product_id, p.name, oi.quantity, oi.price_at_order,
+                   oi.quantity * oi.price_at_order
+            FROM orders o
+            LEFT JOIN users u ON u.user_id = o.user_id
+            LEFT JOIN order_items oi ON oi.order_id = o.order_id
+            LEFT JOIN products p ON p.product_id = oi.product_id
+            WHERE o.created_at >= ? AND o.created_at < ?
+            ORDER BY o.order_id, oi.id
+        """, (start, end), chunk_size, "export orders")
+    
+    def stream_users_export(self, start: str, end: str, chunk_size: int = 5000) -> Iterator[List[tuple]]:
+        """کاربران عضو شده در بازه [start, end) به ترتیب EXPORT_USER_COLUMNS"""
+        logger.debug("stream خروجی کاربران %s تا %s", start, end)
+        
+        return self._stream_query("""
+            SELECT u.user_id, u.username, u.first_name, u.last_name,
+                   u.created_at, u.last_seen, u.is_blocked,
+                   (SELECT COUNT(*) FROM orders o WHERE o.user_id = u.user_id)
+            FROM users u
+            WHERE u.created_at >= ? AND u.created_at < ?
+            ORDER BY u.user_id
+        """, (start, end), chunk_size, "export users")
 
 if __name__ == "__main__":
     # تست
@@ -7,9 +7,17 @@
 from .admin import AdminHandler
 from .user import UserHandler
 from .order import OrderHandler
+from .gate import GateHandler
+from .analytics import AnalyticsHandler
+from .export import ExportHandler
+from .profiler import ProfilerHandler
 
 __all__ = [
     'AdminHandler',
     'UserHandler',
     'OrderHandler',
+    'GateHandler',
+    'AnalyticsHandler',
+    'ExportHandler',
+    'ProfilerHandler',
 ]
@@ -36,7 +36,7 @@ class AdminHandler:
         is_admin_user = self.config.is_admin(user_id)
         
         if not is_admin_user:
-            logger.warning(f"تلاش برای دسترسی غیرمجاز: کاربر {user_id}")
+            logger.warning("تلاش برای دسترسی غیرمجاز: کاربر %s", user_id)
         
         return is_admin_user
     
@@ -45,7 +45,7 @@ class AdminHandler:
         user_id = update.effective_user.id
         username = update.effective_user.username
         
-        logger.info(f"درخواست پنل ادمین از {user_id} (@{username})")
+        logger.info("درخواست پنل ادمین از %s (@%s)", user_id, username)
         
         # بررسی دسترسی
         if not self.is_admin(user_id):
@@ -88,7 +88,7 @@ class AdminHandler:
             log_admin(user_id, username, "باز کردن پنل ادمین", f"آمار: {stats}")
             
         except Exception as e:
-            logger.error(f"خطا در نمایش پنل ادمین: {e}", exc_info=True)
+            logger.error("خطا در نمایش پنل ادمین: %s", e, exc_info=True)
             await update.message.reply_text("❌ خطا در نمایش پنل")
             await notify_error(e, "high", "admin_panel", user_id)
     
@@ -100,7 +100,7 @@ class AdminHandler:
         user_id = update.effective_user.id
         username = update.effective_user.username
         
-        logger.info(f"شروع افزودن محصول توسط {user_id}")
+        logger.info("شروع افزودن محصول توسط %s", user_id)
         
         if not self.is_admin(user_id):
             await query.edit_message_text("⛔️ شما دسترسی ندارید.")
@@ -126,7 +126,7 @@ class AdminHandler:
         if not context.user_data.get('adding_product'):
             return
         
-        logger.debug(f"دریافت ورودی محصول از {user_id}")
+        logger.debug("دریافت ورودی محصول از %s", user_id)
         
         product_data = context.user_data['product_data']
         message_text = update.message.text
@@ -209,7 +209,7 @@ class AdminHandler:
                 return
             
         except Exception as e:
-            logger.error(f"خطا در مدیریت ورودی محصول: {e}", exc_info=True)
+            logger.error("خطا در مدیریت ورودی محصول: %s", e, exc_info=True)
             await update.message.reply_text("❌ خطا در پردازش")
             await notify_error(e, "normal", "handle_product_input", user_id)
     
@@ -221,7 +221,7 @@ class AdminHandler:
         if not context.user_data.get('adding_product'):
             return
         
-        logger.debug(f"دریافت عکس محصول از {user_id}")
+        logger.debug("دریافت عکس محصول از %s", user_id)
         
         product_data = context.user_data['product_data']
         
@@ -282,7 +282,7 @@ class AdminHandler:
             log_event("محصول جدید", f"ID {product_id} توسط ادمین {user_id}")
             
         except Exception as e:
-            logger.error(f"خطا در ذخیره محصول: {e}", exc_info=True)
+            logger.error("خطا در ذخیره محصول: %s", e, exc_info=True)
             await update.message.reply_text("❌ خطا در ذخیره محصول")
             await notify_error(e, "high", "handle_product_photo", user_id, f"product: {product_data.get('name')}")
     
@@ -294,7 +294,7 @@ class AdminHandler:
         user_id = update.effective_user.id
         username = update.effective_user.username
         
-        logger.info(f"درخواست لیست محصولات از {user_id}")
+        logger.info("درخواست لیست محصولات از %s", user_id)
         
         if not self.is_admin(user_id):
             await query.edit_message_text("⛔️ شما دسترسی ندارید.")
@@ -334,7 +334,7 @@ class AdminHandler:
             log_admin(user_id, username, "مشاهده لیست محصولات", f"{len(products)} محصول")
             
         except Exception as e:
-            logger.error(f"خطا در نمایش لیست: {e}", exc_info=True)
+            logger.error("خطا در نمایش لیست: %s", e, exc_info=True)
             await query.edit_message_text("❌ خطا در نمایش لیست")
             await notify_error(e, "normal", "list_products", user_id)
     
@@ -346,7 +346,7 @@ class AdminHandler:
         user_id = update.effective_user.id
         username = update.effective_user.username
         
-        logger.info(f"درخواست لیست سفارشات از {user_id}")
+        logger.info("درخواست لیست سفارشات از %s", user_id)
         
         if not self.is_admin(user_id):
             await query.edit_message_text("⛔️ شما دسترسی ندارید.")
@@ -393,7 +393,7 @@ class AdminHandler:
             log_admin(user_id, username, "مشاهده لیست سفارشات", f"{len(orders)} سفارش")
             
         except Exception as e:
-            logger.error(f"خطا در نمایش سفارشات: {e}", exc_info=True)
+            logger.error("خطا در نمایش سفارشات: %s", e, exc_info=True)
             await query.edit_message_text("❌ خطا در نمایش سفارشات")
             await notify_error(e, "normal", "list_orders", user_id)
     
@@ -405,7 +405,7 @@ class AdminHandler:
         user_id = update.effective_user.id
         username = update.effective_user.username
         
-        logger.info(f"درخواست لیست کاربران از {user_id}")
+        logger.info("درخواست لیست کاربران از %s", user_id)
         
         if not self.is_admin(user_id):
             await query.edit_message_text("⛔️ شما دسترسی ندارید.")
@@ -445,7 +445,7 @@ class AdminHandler:
             log_admin(user_id, username, "مشاهده لیست کاربران", f"{len(users)} کاربر")
             
         except Exception as e:
-            logger.error(f"خطا در نمایش کاربران: {e}", exc_info=True)
+            logger.error("خطا در نمایش کاربران: %s", e, exc_info=True)
             await query.edit_message_text("❌ خطا در نمایش کاربران")
             await notify_error(e, "normal", "list_users", user_id)
     
@@ -457,7 +457,7 @@ class AdminHandler:
         user_id = update.effective_user.id
         username = update.effective_user.username
         
-        logger.info(f"درخواست آمار کامل از {user_id}")
+        logger.info("درخواست آمار کامل از %s", user_id)
         
         if not self.is_admin(user_id):
             await query.edit_message_text("⛔️ شما دسترسی ندارید.")
@@ -492,7 +492,7 @@ class AdminHandler:
             log_admin(user_id, username, "مشاهده آمار کامل", str(stats))
             
         except Exception as e:
-            logger.error(f"خطا در نمایش آمار: {e}", exc_info=True)
+            logger.error("خطا در نمایش آمار: %s", e, exc_info=True)
             await query.edit_message_text("❌ خطا در نمایش آمار")
             await notify_error(e, "normal", "full_stats", user_id)
 
@@ -1,422 +1,550 @@
 """
 سیستم گزارش‌های گرافیکی و تحلیلی
+
+داده‌ها از جداول rollup در Database خوانده و نمودارها در pool پروسه‌های ChartRenderer
+رندر می‌شوند تا event loop برای بقیه کاربران آزاد بماند.
+نتیجه هر گزارش تا تغییر بعدی داده‌ها کش می‌شود و با file_id دوباره ارسال می‌شود.
+گزارش‌های استاندارد هر شب از پیش ساخته و به‌صورت خلاصه برای ادمین‌ها ارسال می‌شوند.
+پیش‌بینی اتمام موجودی (/restock) هم هر شب اجرا و محصولات رو به اتمام اطلاع داده می‌شوند.
 """
-import io
-import json
-from datetime import datetime, timedelta
-from telegram import Update
+
+import asyncio
+import time
+from datetime import date, datetime, timedelta
+from telegram import Update, InputMediaPhoto
 from telegram.ext import ContextTypes
-from config import ADMIN_ID
-import matplotlib
-matplotlib.use('Agg')  # برای استفاده در محیط بدون GUI
-import matplotlib.pyplot as plt
-from matplotlib import font_manager
-import matplotlib.dates as mdates
-from collections import defaultdict, Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
-# تنظیم فونت فارسی
-plt.rcParams['font.family'] = 'DejaVu Sans'
-plt.rcParams['axes.unicode_minus'] = False
+from database import Database
+from config import BotConfig
+from keyboards import analytics_menu_keyboard
+from utils.logger import get_logger, log_admin
+from utils.error_notifier import notify_error
+from utils.event_log import track
+from utils.event_store import funnel_report
+from utils.load_shedder import shedding, wait_for_capacity
+from utils.rate_limiter import RateLimiter
+from utils.chart_renderer import ChartRenderer, get_chart_renderer
+from utils.report_cache import CachedReport, ReportCache
 
+# Logger این ماژول
+logger = get_logger('analytics')
 
-class Analytics:
-    """کلاس تحلیل و گزارش‌گیری"""
-    
-    def __init__(self, db):
-        self.db = db
-    
-    def get_sales_data(self, days=30):
-        """دریافت داده‌های فروش"""
-        query = """
-            SELECT DATE(created_at) as date, 
-                   COUNT(*) as order_count,
-                   SUM(final_price) as total_sales
-            FROM orders 
-            WHERE status IN ('confirmed', 'payment_confirmed')
-              AND created_at >= DATE('now', '-{} days')
-            GROUP BY DATE(created_at)
-            ORDER BY date
-        """.format(days)
-        
-        self.db.cursor.execute(query)
-        return self.db.cursor.fetchall()
-    
-    def get_popular_products(self, limit=10):
-        """محبوب‌ترین محصولات"""
-        query = """
-            SELECT items FROM orders 
-            WHERE status IN ('confirmed', 'payment_confirmed')
-        """
-        
-        self.db.cursor.execute(query)
-        orders = self.db.cursor.fetchall()
-        
-        product_counter = Counter()
-        
-        for order in orders:
-            items = json.loads(order[0])
-            for item in items:
-                product_name = item.get('product', 'Unknown')
-                quantity = item.get('quantity', 0)
-                product_counter[product_name] += quantity
-        
-        return product_counter.most_common(limit)
-    
-    def get_hourly_orders(self):
-        """ساعات شلوغی سفارش"""
-        query = """
-            SELECT strftime('%H', created_at) as hour,
-                   COUNT(*) as count
-            FROM orders
-            WHERE created_at >= DATE('now', '-30 days')
-            GROUP BY hour
-            ORDER BY hour
-        """
-        
-        self.db.cursor.execute(query)
-        return self.db.cursor.fetchall()
-    
-    def get_conversion_rate(self):
-        """نرخ تبدیل"""
-        # تعداد کل کاربران
-        self.db.cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = self.db.cursor.fetchone()[0]
-        
-        # تعداد کاربران خریدار
-        self.db.cursor.execute("""
-            SELECT COUNT(DISTINCT user_id) FROM orders
-            WHERE status IN ('confirmed', 'payment_confirmed')
-        """)
-        buyers = self.db.cursor.fetchone()[0]
-        
-        # تعداد سفارشات
-        self.db.cursor.execute("""
-            SELECT COUNT(*) FROM orders
-            WHERE status IN ('confirmed', 'payment_confirmed')
-        """)
-        orders = self.db.cursor.fetchone()[0]
-        
-        conversion_rate = (buyers / total_users * 100) if total_users > 0 else 0
-        repeat_rate = (orders / buyers) if buyers > 0 else 0
-        
-        return {
-            'total_users': total_users,
-            'buyers': buyers,
-            'non_buyers': total_users - buyers,
-            'conversion_rate': conversion_rate,
-            'total_orders': orders,
-            'repeat_rate': repeat_rate
-        }
-    
-    def get_revenue_data(self, days=30):
-        """داده‌های درآمد"""
-        query = """
-            SELECT DATE(created_at) as date,
-                   SUM(total_price) as gross_revenue,
-                   SUM(discount_amount) as total_discount,
-                   SUM(final_price) as net_revenue
-            FROM orders
-            WHERE status IN ('confirmed', 'payment_confirmed')
-              AND created_at >= DATE('now', '-{} days')
-            GROUP BY DATE(created_at)
-            ORDER BY date
-        """.format(days)
-        
-        self.db.cursor.execute(query)
-        return self.db.cursor.fetchall()
+# report_type -> (کپشن, نوع نمودار, تابع دریافت داده)
+REPORTS: Dict[str, Tuple[str, str, Callable[[Database], Tuple[Any, ...]]]] = {
+    'sales_daily': (
+        "📊 **گزارش فروش روزانه** (7 روز اخیر)",
+        'sales', lambda db: (db.get_sales_by_day(7), 'daily')
+    ),
+    'sales_weekly': (
+        "📊 **گزارش فروش هفتگی** (30 روز اخیر)",
+        'sales', lambda db: (db.get_sales_by_day(30), 'weekly')
+    ),
+    'sales_monthly': (
+        "📊 **گزارش فروش ماهانه** (90 روز اخیر)",
+        'sales', lambda db: (db.get_sales_by_day(90), 'monthly')
+    ),
+    'popular': (
+        "🏆 **محبوب‌ترین محصولات** (بر اساس تعداد فروش)",
+        'popular', lambda db: (db.get_popular_products(10),)
+    ),
+    'hourly': (
+        "⏰ **ساعات شلوغی سفارش‌گذاری** (30 روز اخیر)",
+        'hourly', lambda db: (db.get_hourly_order_counts(30),)
+    ),
+    'revenue': (
+        "💰 **تحلیل درآمد** (90 روز اخیر)\n\n"
+        "🔵 درآمد ناخالص | 🟢 درآمد خالص | 🔴 تخفیفات",
+        'revenue', lambda db: (db.get_revenue_by_day(90),)
+    ),
+    'conversion': (
+        "📈 **نرخ تبدیل و آمار کاربران**",
+        'conversion', lambda db: (db.get_conversion_stats(),)
+    ),
+    'cohort': (
+        "👥 **ماندگاری کوهورت** (بر اساس ماه اولین خرید)\n\n"
+        "هر خانه: درصد مشتریان کوهورت که در آن ماه دوباره خرید کرده‌اند",
+        'cohort', lambda db: (_customer_analytics().cohort_report(db),)
+    ),
+    'rfm': (
+        "🎯 **بخش‌بندی مشتریان (RFM)**\n\n"
+        "تازگی، تکرار و مبلغ خرید هر مشتری",
+        'rfm', lambda db: (_customer_analytics().rfm_report(db),)
+    ),
+}
 
 
-def create_sales_chart(analytics, period='weekly'):
-    """نمودار فروش"""
-    days_map = {'daily': 7, 'weekly': 30, 'monthly': 90}
-    days = days_map.get(period, 30)
-    
-    data = analytics.get_sales_data(days)
-    
-    if not data:
-        return None
-    
-    dates = [datetime.strptime(row[0], '%Y-%m-%d') for row in data]
-    order_counts = [row[1] for row in data]
-    sales = [row[2]/1000000 for row in data]  # تبدیل به میلیون تومان
-    
-    fig, ax1 = plt.subplots(figsize=(12, 6))
-    
-    # نمودار تعداد سفارشات
-    color1 = '#3498db'
-    ax1.set_xlabel('Date', fontsize=12)
-    ax1.set_ylabel('Order Count', color=color1, fontsize=12)
-    ax1.plot(dates, order_counts, color=color1, marker='o', linewidth=2, label='Orders')
-    ax1.tick_params(axis='y', labelcolor=color1)
-    ax1.grid(True, alpha=0.3)
-    
-    # نمودار فروش
-    ax2 = ax1.twinx()
-    color2 = '#2ecc71'
-    ax2.set_ylabel('Sales (Million Toman)', color=color2, fontsize=12)
-    ax2.plot(dates, sales, color=color2, marker='s', linewidth=2, label='Sales')
-    ax2.tick_params(axis='y', labelcolor=color2)
-    
-    # فرمت تاریخ
-    if period == 'daily':
-        ax1.xaxis.set_major_formatter(mdates.DateFormatter('%m/%d'))
-    else:
-        ax1.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-    
-    plt.setp(ax1.xaxis.get_majorticklabels(), rotation=45, ha='right')
-    
-    # عنوان
-    period_title = {'daily': 'Daily', 'weekly': 'Weekly', 'monthly': 'Monthly'}
-    plt.title(f'{period_title[period]} Sales Report', fontsize=16, fontweight='bold', pad=20)
-    
-    fig.tight_layout()
-    
-    # ذخیره در بافر
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
-    buf.seek(0)
-    plt.close()
-    
-    return buf
+def _customer_analytics():
+    """import تنبل NumPy فقط هنگام درخواست گزارش‌های مشتری"""
+    from utils import customer_analytics
+    return customer_analytics
 
 
-def create_popular_products_chart(analytics):
-    """نمودار محبوب‌ترین محصولات"""
-    products = analytics.get_popular_products(10)
-    
-    if not products:
-        return None
-    
-    names = [p[0][:20] + '...' if len(p[0]) > 20 else p[0] for p in products]
-    counts = [p[1] for p in products]
-    
-    fig, ax = plt.subplots(figsize=(12, 8))
-    
-    colors = plt.cm.viridis([i/len(names) for i in range(len(names))])
-    bars = ax.barh(names, counts, color=colors, edgecolor='black', linewidth=1.5)
-    
-    ax.set_xlabel('Quantity Sold', fontsize=12, fontweight='bold')
-    ax.set_title('Top 10 Popular Products', fontsize=16, fontweight='bold', pad=20)
-    ax.grid(axis='x', alpha=0.3, linestyle='--')
-    
-    # اضافه کردن مقادیر روی میله‌ها
-    for i, (bar, count) in enumerate(zip(bars, counts)):
-        ax.text(count + max(counts)*0.01, bar.get_y() + bar.get_height()/2, 
-                f'{count}', va='center', fontsize=10, fontweight='bold')
-    
-    plt.tight_layout()
-    
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
-    buf.seek(0)
-    plt.close()
-    
-    return buf
-
-
-def create_hourly_orders_chart(analytics):
-    """نمودار ساعات شلوغی"""
-    data = analytics.get_hourly_orders()
-    
-    if not data:
-        return None
-    
-    # ایجاد لیست کامل 24 ساعته
-    hours_dict = {str(i).zfill(2): 0 for i in range(24)}
-    for hour, count in data:
-        hours_dict[hour] = count
-    
-    hours = list(range(24))
-    counts = [hours_dict[str(h).zfill(2)] for h in hours]
-    
-    fig, ax = plt.subplots(figsize=(14, 6))
-    
-    colors = ['#e74c3c' if c == max(counts) else '#3498db' for c in counts]
-    bars = ax.bar(hours, counts, color=colors, edgecolor='black', linewidth=1.5, alpha=0.8)
-    
-    ax.set_xlabel('Hour of Day', fontsize=12, fontweight='bold')
-    ax.set_ylabel('Number of Orders', fontsize=12, fontweight='bold')
-    ax.set_title('Peak Hours for Orders (Last 30 Days)', fontsize=16, fontweight='bold', pad=20)
-    ax.set_xticks(hours)
-    ax.set_xticklabels([f'{h:02d}:00' for h in hours], rotation=45, ha='right')
-    ax.grid(axis='y', alpha=0.3, linestyle='--')
-    
-    # خط میانگین
-    avg = sum(counts) / len(counts)
-    ax.axhline(y=avg, color='orange', linestyle='--', linewidth=2, label=f'Average: {avg:.1f}')
-    ax.legend()
-    
-    # اضافه کردن مقادیر روی میله‌ها
-    for bar, count in zip(bars, counts):
-        if count > 0:
-            ax.text(bar.get_x() + bar.get_width()/2, bar.get_height() + max(counts)*0.01,
-                   f'{int(count)}', ha='center', va='bottom', fontsize=9, fontweight='bold')
-    
-    plt.tight_layout()
-    
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
-    buf.seek(0)
-    plt.close()
-    
-    return buf
+def _forecasting():
+    """import تنبل NumPy فقط هنگام پیش‌بینی موجودی"""
+    from utils import forecasting
+    return forecasting
 
 
-def create_revenue_chart(analytics, period='monthly'):
-    """نمودار درآمد"""
-    days_map = {'weekly': 30, 'monthly': 90}
-    days = days_map.get(period, 30)
-    
-    data = analytics.get_revenue_data(days)
-    
-    if not data:
-        return None
-    
-    dates = [datetime.strptime(row[0], '%Y-%m-%d') for row in data]
-    gross = [row[1]/1000000 for row in data]
-    discounts = [row[2]/1000000 for row in data]
-    net = [row[3]/1000000 for row in data]
-    
-    fig, ax = plt.subplots(figsize=(14, 7))
-    
-    ax.plot(dates, gross, marker='o', linewidth=2, label='Gross Revenue', color='#3498db')
-    ax.plot(dates, net, marker='s', linewidth=2, label='Net Revenue', color='#2ecc71')
-    ax.fill_between(dates, gross, net, alpha=0.2, color='#e74c3c', label='Discounts')
-    
-    ax.set_xlabel('Date', fontsize=12, fontweight='bold')
-    ax.set_ylabel('Revenue (Million Toman)', fontsize=12, fontweight='bold')
-    ax.set_title('Revenue Analysis', fontsize=16, fontweight='bold', pad=20)
-    ax.legend(loc='upper left', fontsize=11)
-    ax.grid(True, alpha=0.3, linestyle='--')
-    
-    ax.xaxis.set_major_formatter(mdates.DateFormatter('%Y-%m-%d'))
-    plt.setp(ax.xaxis.get_majorticklabels(), rotation=45, ha='right')
-    
-    plt.tight_layout()
-    
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
-    buf.seek(0)
-    plt.close()
-    
-    return buf
-
-
-def create_conversion_chart(analytics):
-    """نمودار نرخ تبدیل"""
-    data = analytics.get_conversion_rate()
-    
-    fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(14, 6))
-    
-    # نمودار دایره‌ای - کاربران
-    labels1 = ['Buyers', 'Non-Buyers']
-    sizes1 = [data['buyers'], data['non_buyers']]
-    colors1 = ['#2ecc71', '#e74c3c']
-    explode1 = (0.1, 0)
-    
-    ax1.pie(sizes1, explode=explode1, labels=labels1, colors=colors1,
-            autopct='%1.1f%%', shadow=True, startangle=90, textprops={'fontsize': 12, 'fontweight': 'bold'})
-    ax1.set_title(f'User Conversion Rate\n{data["conversion_rate"]:.1f}% converted', 
-                  fontsize=14, fontweight='bold', pad=20)
-    
-    # نمودار میله‌ای - آمار
-    categories = ['Total\nUsers', 'Buyers', 'Total\nOrders']
-    values = [data['total_users'], data['buyers'], data['total_orders']]
-    colors2 = ['#3498db', '#2ecc71', '#f39c12']
-    
-    bars = ax2.bar(categories, values, color=colors2, edgecolor='black', linewidth=2, alpha=0.8)
-    ax2.set_ylabel('Count', fontsize=12, fontweight='bold')
-    ax2.set_title(f'Statistics Overview\nRepeat Rate: {data["repeat_rate"]:.2f} orders/buyer', 
-                  fontsize=14, fontweight='bold', pad=20)
-    ax2.grid(axis='y', alpha=0.3, linestyle='--')
-    
-    # اضافه کردن مقادیر
-    for bar, value in zip(bars, values):
-        ax2.text(bar.get_x() + bar.get_width()/2, bar.get_height() + max(values)*0.02,
-                f'{int(value)}', ha='center', va='bottom', fontsize=12, fontweight='bold')
-    
-    plt.tight_layout()
-    
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
-    buf.seek(0)
-    plt.close()
+class AnalyticsHandler:
+    """کلاس مدیریت گزارش‌های تحلیلی"""
+    
+    # نمودارهایی که همراه خلاصه شبانه ارسال می‌شوند
+    DIGEST_REPORTS = ('sales_daily', 'sales_weekly', 'sales_monthly', 'popular', 'revenue')
+    
+    # حداکثر انتظار برای کاهش بار (ثانیه): گزارش درخواستی و کارهای شبانه
+    DEFER_TIMEOUT = 120
+    NIGHTLY_DEFER_TIMEOUT = 1800
+    
+    def __init__(
+        self,
+        db: Database,
+        config: BotConfig,
+        rate_limiter: RateLimiter,
+        renderer: Optional[ChartRenderer] = None
+    ):
+        self.db = db
+        self.config = config
+        self.rate_limiter = rate_limiter
+        self.renderer = renderer or get_chart_renderer()
+        self.report_cache = ReportCache()
+        
+        # نسخه‌های آماده‌شده شبانه: {report_type: (زمان ساخت, نسخه داده, گزارش)}
+        self.snapshots: Dict[str, Tuple[datetime, int, CachedReport]] = {}
+        self.snapshot_max_age = timedelta(hours=config.report_snapshot_max_age_hours)
+        
+        logger.info("✅ AnalyticsHandler راه‌اندازی شد")
     
-    return buf
-
-
-async def send_analytics_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """منوی گزارش‌های تحلیلی"""
-    if update.effective_user.id != ADMIN_ID:
-        return
+    async def send_analytics_menu(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """منوی گزارش‌های تحلیلی"""
+        if not self.config.is_admin(update.effective_user.id):
+            return
+        
+        await update.message.reply_text(
+            "📊 **گزارش‌های تحلیلی**\n\n"
+            "کدام گزارش را می‌خواهید مشاهده کنید؟",
+            parse_mode='Markdown',
+            reply_markup=analytics_menu_keyboard()
+        )
+    
+    async def handle_analytics_report(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """مدیریت درخواست گزارش"""
+        query = update.callback_query
+        await query.answer()
+        
+        admin_id = update.effective_user.id
+        username = update.effective_user.username
+        
+        if not self.config.is_admin(admin_id):
+            return
+        
+        report_type = query.data.split(":")[1]
+        report = REPORTS.get(report_type)
+        
+        if report is None:
+            await query.message.reply_text("❌ نوع گزارش نامعتبر است!")
+            return
+        
+        started = time.perf_counter()
+        
+        try:
+            # بازه گزارش‌ها نسبت به امروز است، پس روز هم جزء کلید است
+            version = await asyncio.to_thread(self.db.get_data_version)
+            cache_key = (report_type, date.today().isoformat(), version)
+            
+            cached = self.report_cache.get(cache_key)
+            if cached is not None:
+                await self._send_report(query, cache_key, cached.photo, cached.caption)
+                log_admin(admin_id, username, "گزارش تحلیلی (کش)", report_type)
+                track('report', user_id=admin_id, report=report_type, source='cache',
+                      latency_ms=(time.perf_counter() - started) * 1000)
+                return
+            
+            # نسخه شبانه تا وقتی داده‌ها تغییر نکرده‌اند (و تا سقف عمر مجاز)،
+            # به جای ساخت دوباره در ساعات شلوغ
+            snapshot = self._get_snapshot(report_type, version)
+            if snapshot is not None:
+                built_at, stored = snapshot
+                await self._send_snapshot(query, report_type, built_at, stored)
+                log_admin(admin_id, username, "گزارش تحلیلی (شبانه)", report_type)
+                track('report', user_id=admin_id, report=report_type, source='snapshot',
+                      latency_ms=(time.perf_counter() - started) * 1000)
+                return
+            
+            if shedding('analytics_report'):
+                # ساخت گزارش تا کاهش بار عقب می‌افتد؛ آپدیت‌ها ترتیبی پردازش می‌شوند،
+                # پس انتظار باید در task جدا باشد نه در همین handler
+                await query.message.reply_text(
+                    "⏳ سرور در حال حاضر شلوغ است؛ گزارش بعد از کاهش بار ارسال می‌شود."
+                )
+                context.application.create_task(
+                    self._render_report(query, admin_id, username, report_type, cache_key, started, deferred=True)
+                )
+                return
+        
+        except Exception as e:
+            logger.error("خطا در تولید گزارش %s: %s", report_type, e, exc_info=True)
+            await query.message.reply_text(f"❌ خطا در تولید گزارش:\n`{str(e)}`", parse_mode='Markdown')
+            await notify_error(e, "low", "analytics_report", admin_id)
+            return
+        
+        await self._render_report(query, admin_id, username, report_type, cache_key, started)
+    
+    async def _render_report(
+        self,
+        query,
+        admin_id: int,
+        username: Optional[str],
+        report_type: str,
+        cache_key,
+        started: float,
+        deferred: bool = False
+    ):
+        """ساخت، کش و ارسال گزارش (deferred: ابتدا صبر تا کاهش بار)"""
+        caption = REPORTS[report_type][0]
+        
+        try:
+            if deferred:
+                await wait_for_capacity(self.DEFER_TIMEOUT)
+            else:
+                await query.message.reply_text("⏳ در حال تولید گزارش...\nلطفاً صبر کنید...")
+            
+            chart = await self._build_chart(report_type)
+            
+            if chart is None:
+                await query.message.reply_text("❌ داده‌ای برای نمایش وجود ندارد!")
+                return
+            
+            self.report_cache.put(cache_key, caption, png=chart)
+            await self._send_report(query, cache_key, chart, caption)
+            
+            log_admin(admin_id, username, "گزارش تحلیلی", report_type)
+            track('report', user_id=admin_id, report=report_type,
+                  source='deferred' if deferred else 'render',
+                  latency_ms=(time.perf_counter() - started) * 1000)
+        
+        except Exception as e:
+            logger.error("خطا در تولید گزارش %s: %s", report_type, e, exc_info=True)
+            await query.message.reply_text(f"❌ خطا در تولید گزارش:\n`{str(e)}`", parse_mode='Markdown')
+            await notify_error(e, "low", "analytics_report", admin_id)
+    
+    async def _build_chart(self, report_type: str) -> Optional[bytes]:
+        """ساخت تصویر یک گزارش (None اگر داده‌ای نباشد)"""
+        _, kind, fetch = REPORTS[report_type]
+        
+        # کوئری در thread و رندر در پروسه جدا؛ event loop آزاد می‌ماند
+        args = await asyncio.to_thread(fetch, self.db)
+        
+        if not args[0]:
+            return None
+        
+        return await self.renderer.render(kind, *args)
     
-    from keyboards import analytics_menu_keyboard
+    # ========== گزارش‌های شبانه ==========
     
-    await update.message.reply_text(
-        "📊 **گزارش‌های تحلیلی**\n\n"
-        "کدام گزارش را می‌خواهید مشاهده کنید؟",
-        parse_mode='Markdown',
-        reply_markup=analytics_menu_keyboard()
-    )
-
-
-async def handle_analytics_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """مدیریت درخواست گزارش"""
-    query = update.callback_query
-    await query.answer()
+    def _get_snapshot(self, report_type: str, version: int) -> Optional[Tuple[datetime, CachedReport]]:
+        """نسخه شبانه گزارش اگر هنوز معتبر باشد (همان نسخه داده و در سقف عمر)"""
+        snapshot = self.snapshots.get(report_type)
+        
+        if snapshot is None:
+            return None
+        
+        built_at, built_version, stored = snapshot
+        if built_version != version or datetime.now() - built_at > self.snapshot_max_age:
+            return None
+        
+        return built_at, stored
+    
+    async def _send_snapshot(self, query, report_type: str, built_at: datetime, stored: CachedReport):
+        """ارسال نسخه شبانه و ثبت file_id آن"""
+        message = await query.message.reply_photo(
+            photo=stored.photo,
+            caption=f"{stored.caption}\n\n🕓 آماده‌شده در {built_at.strftime('%H:%M')}",
+            parse_mode='Markdown'
+        )
+        
+        if stored.file_id is None and message.photo:
+            stored.file_id = message.photo[-1].file_id
+            stored.png = None
     
-    if update.effective_user.id != ADMIN_ID:
-        return
+    async def build_snapshots(self) -> List[str]:
+        """ساخت همه گزارش‌های استاندارد (پشت سر هم تا pool رندر اشغال نشود)"""
+        built = []
+        
+        # نسخه قبل از خواندن داده‌ها؛ سفارشی که وسط ساخت ثبت شود نسخه را جلو
+        # می‌برد و نسخه شبانه همان لحظه کهنه حساب می‌شود
+        version = await asyncio.to_thread(self.db.get_data_version)
+        
+        for report_type in REPORTS:
+            try:
+                chart = await self._build_chart(report_type)
+            except Exception as e:
+                logger.error("خطا در ساخت گزارش شبانه %s: %s", report_type, e, exc_info=True)
+                continue
+            
+            if chart is None:
+                self.snapshots.pop(report_type, None)
+                continue
+            
+            self.snapshots[report_type] = (datetime.now(), version, CachedReport(REPORTS[report_type][0], png=chart))
+            built.append(report_type)
+        
+        logger.info("✅ %s گزارش شبانه ساخته شد", len(built))
+        return built
     
-    report_type = query.data.split(":")[1]
+    async def _digest_text(self) -> str:
+        """متن خلاصه روزانه برای ادمین‌ها"""
+        days = dict((day, (orders, sales)) for day, orders, sales in await asyncio.to_thread(self.db.get_sales_by_day, 8))
+        
+        yesterday = (date.today() - timedelta(days=1)).isoformat()
+        before = (date.today() - timedelta(days=2)).isoformat()
+        y_orders, y_sales = days.get(yesterday, (0, 0))
+        b_orders, b_sales = days.get(before, (0, 0))
+        week_orders = sum(orders for day, (orders, _) in days.items() if day < date.today().isoformat())
+        week_sales = sum(sales for day, (_, sales) in days.items() if day < date.today().isoformat())
+        
+        change = f" ({(y_sales - b_sales) / b_sales * 100:+.0f}%)" if b_sales else ""
+        
+        return (
+            f"🌙 **خلاصه روزانه** ({yesterday})\n\n"
+            f"🛒 سفارش‌های دیروز: {y_orders} (پریروز: {b_orders})\n"
+            f"💰 فروش دیروز: {y_sales:,} تومان{change}\n"
+            f"📅 ۷ روز اخیر: {week_orders} سفارش، {week_sales:,} تومان\n\n"
+            f"📊 گزارش‌های امروز آماده هستند: /analytics"
+        )
+    
+    async def nightly_reports(self, context: ContextTypes.DEFAULT_TYPE):
+        """job شبانه: ساخت گزارش‌ها و ارسال خلاصه برای ادمین‌ها"""
+        if not await wait_for_capacity(self.NIGHTLY_DEFER_TIMEOUT):
+            logger.warning("⚠️  بار event loop هنوز بالاست؛ گزارش‌های شبانه بدون انتظار بیشتر ساخته می‌شوند")
+        
+        logger.info("🌙 شروع ساخت گزارش‌های شبانه...")
+        
+        try:
+            built = await self.build_snapshots()
+            await self.send_digest(context.bot, built)
+            await self.send_low_stock_digest(context.bot)
+            
+            before = time.time() - self.config.event_retention_days * 86400
+            await asyncio.to_thread(self.db.purge_events, before)
+        except Exception as e:
+            logger.error("خطا در گزارش شبانه: %s", e, exc_info=True)
+            await notify_error(e, "normal", "nightly_reports")
+    
+    async def send_digest(self, bot, report_types: List[str]):
+        """
+        ارسال خلاصه و نمودارها برای همه ادمین‌ها
+        
+        تصاویر فقط یک بار آپلود می‌شوند؛ برای بقیه ادمین‌ها و
+        درخواست‌های صبح از file_id استفاده می‌شود.
+        """
+        text = await self._digest_text()
+        digest_types = [t for t in report_types if t in self.DIGEST_REPORTS]
+        
+        for admin_id in self.config.admin_ids:
+            try:
+                await bot.send_message(admin_id, text, parse_mode='Markdown')
+                
+                if not digest_types:
+                    continue
+                
+                media = [
+                    InputMediaPhoto(
+                        self.snapshots[t][2].photo,
+                        caption=self.snapshots[t][2].caption,
+                        parse_mode='Markdown'
+                    )
+                    for t in digest_types
+                ]
+                messages = await bot.send_media_group(admin_id, media)
+                
+                for report_type, message in zip(digest_types, messages):
+                    stored = self.snapshots[report_type][2]
+                    if stored.file_id is None and message.photo:
+                        stored.file_id = message.photo[-1].file_id
+                        stored.png = None
+            
+            except Exception as e:
+                logger.warning("⚠️  ارسال خلاصه برای ادمین %s ناموفق بود: %s", admin_id, e)
+        
+        logger.info("✅ خلاصه روزانه برای %s ادمین ارسال شد", len(self.config.admin_ids))
+    
+    # ========== پیش‌بینی موجودی ==========
+    
+    async def _restock_rows(self) -> List[Dict[str, Any]]:
+        """پیش‌بینی موجودی همه محصولات (در thread)"""
+        return await asyncio.to_thread(
+            _forecasting().restock_report,
+            self.db,
+            self.config.restock_lead_time_days,
+            self.config.restock_cover_days
+        )
+    
+    @staticmethod
+    def _restock_text(title: str, rows: List[Dict[str, Any]], limit: int = 20) -> str:
+        """متن لیست محصولات با روز اتمام و مقدار پیشنهادی سفارش"""
+        lines = [title, ""]
+        
+        for row in rows[:limit]:
+            days_left = "تمام شده" if row['stock'] == 0 else (
+                f"{row['days_left']:.0f} روز" if row['days_left'] is not None else "بیش از ۹۰ روز"
+            )
+            lines.append(
+                f"• {row['name']} (#{row['product_id']})\n"
+                f"  موجودی {row['stock']} | {row['velocity']}/روز | اتمام: {days_left}"
+                + (f" | سفارش: {row['restock']}" if row['restock'] else "")
+            )
+        
+        if len(rows) > limit:
+            lines.append(f"\n... و {len(rows) - limit} محصول دیگر")
+        
+        return "\n".join(lines)
     
-    await query.message.reply_text("⏳ در حال تولید گزارش...\nلطفاً صبر کنید...")
+    async def restock_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """دستور /restock - پیش‌بینی اتمام موجودی و پیشنهاد سفارش"""
+        admin_id = update.effective_user.id
+        username = update.effective_user.username
+        
+        if not self.config.is_admin(admin_id):
+            return
+        
+        try:
+            rows = await self._restock_rows()
+            
+            if not rows:
+                await update.message.reply_text("❌ هیچ محصولی در ۸ هفته اخیر فروش نداشته است!")
+                return
+            
+            title = (
+                f"📦 پیش‌بینی موجودی (تأمین {self.config.restock_lead_time_days} روز، "
+                f"پوشش {self.config.restock_cover_days} روز)"
+            )
+            await update.message.reply_text(self._restock_text(title, rows))
+            log_admin(admin_id, username, "پیش‌بینی موجودی", f"{len(rows)} محصول")
+        
+        except Exception as e:
+            logger.error("خطا در پیش‌بینی موجودی: %s", e, exc_info=True)
+            await update.message.reply_text("❌ خطا در پیش‌بینی موجودی!")
+            await notify_error(e, "low", "restock", admin_id)
     
-    db = context.bot_data['db']
-    analytics = Analytics(db)
+    # ========== قیف تبدیل ==========
     
-    try:
-        if report_type == 'sales_daily':
-            chart = create_sales_chart(analytics, 'daily')
-            caption = "📊 **گزارش فروش روزانه** (7 روز اخیر)"
+    async def funnel_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """دستور /funnel [روز] - قیف مشاهده → سبد → سفارش از جدول events"""
+        admin_id = update.effective_user.id
+        username = update.effective_user.username
         
-        elif report_type == 'sales_weekly':
-            chart = create_sales_chart(analytics, 'weekly')
-            caption = "📊 **گزارش فروش هفتگی** (30 روز اخیر)"
+        if not self.config.is_admin(admin_id):
+            return
         
-        elif report_type == 'sales_monthly':
-            chart = create_sales_chart(analytics, 'monthly')
-            caption = "📊 **گزارش فروش ماهانه** (90 روز اخیر)"
+        try:
+            days = int(context.args[0]) if context.args else 7
+        except ValueError:
+            await update.message.reply_text("❌ استفاده: /funnel [تعداد روز]")
+            return
         
-        elif report_type == 'popular':
-            chart = create_popular_products_chart(analytics)
-            caption = "🏆 **محبوب‌ترین محصولات** (بر اساس تعداد فروش)"
+        days = max(1, min(days, self.config.event_retention_days))
         
-        elif report_type == 'hourly':
-            chart = create_hourly_orders_chart(analytics)
-            caption = "⏰ **ساعات شلوغی سفارش‌گذاری** (30 روز اخیر)"
+        try:
+            started = time.perf_counter()
+            rows = await asyncio.to_thread(funnel_report, self.db, days)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            
+            if not rows or rows[0]['users'] == 0:
+                await update.message.reply_text(f"❌ در {days} روز اخیر رویدادی ثبت نشده است!")
+                return
+            
+            lines = [f"🔻 قیف خرید {days} روز اخیر (کاربر یکتا)", ""]
+            for i, row in enumerate(rows):
+                line = f"{row['label']}: {row['users']:,}"
+                if i > 0:
+                    line += f"  ({row['from_previous']:.1f}% از مرحله قبل)"
+                lines.append(line)
+            
+            lines.append("")
+            lines.append(f"📈 تبدیل کل: {rows[-1]['from_start']:.1f}%")
+            lines.append(f"⏱️ {elapsed_ms:.0f}ms")
+            
+            await update.message.reply_text("\n".join(lines))
+            log_admin(admin_id, username, "قیف تبدیل", f"{days} روز")
         
-        elif report_type == 'revenue':
-            chart = create_revenue_chart(analytics, 'monthly')
-            caption = "💰 **تحلیل درآمد** (90 روز اخیر)\n\n" \
-                     "🔵 درآمد ناخالص | 🟢 درآمد خالص | 🔴 تخفیفات"
+        except Exception as e:
+            logger.error("خطا در گزارش قیف: %s", e, exc_info=True)
+            await update.message.reply_text("❌ خطا در گزارش قیف!")
+            await notify_error(e, "low", "funnel", admin_id)
+    
+    async def send_low_stock_digest(self, bot):
+        """اطلاع محصولاتی که تا low_stock_alert_days روز آینده تمام می‌شوند"""
+        rows = await self._restock_rows()
         
-        elif report_type == 'conversion':
-            chart = create_conversion_chart(analytics)
-            caption = "📈 **نرخ تبدیل و آمار کاربران**"
+        alert_days = self.config.low_stock_alert_days
+        low = [r for r in rows if r['days_left'] is not None and r['days_left'] <= alert_days]
         
-        else:
-            await query.message.reply_text("❌ نوع گزارش نامعتبر است!")
+        if not low:
+            logger.info("✅ هیچ محصولی رو به اتمام نیست")
             return
         
-        if chart:
-            await query.message.reply_photo(
-                photo=chart,
-                caption=caption,
-                parse_mode='Markdown'
-            )
-        else:
-            await query.message.reply_text("❌ داده‌ای برای نمایش وجود ندارد!")
+        text = self._restock_text(f"⚠️ {len(low)} محصول تا {alert_days} روز آینده تمام می‌شوند", low)
+        
+        for admin_id in self.config.admin_ids:
+            try:
+                await bot.send_message(admin_id, text)
+            except Exception as e:
+                logger.warning("⚠️  ارسال هشدار موجودی برای ادمین %s ناموفق بود: %s", admin_id, e)
+        
+        logger.info("⚠️  هشدار موجودی: %s محصول", len(low))
     
-    except Exception as e:
-        await query.message.reply_text(f"❌ خطا در تولید گزارش:\n`{str(e)}`", parse_mode='Markdown')
\ No newline at end of file
+    async def digest_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """دستور /digest - اجرای دستی گزارش شبانه"""
+        admin_id = update.effective_user.id
+        username = update.effective_user.username
+        
+        if not self.config.is_admin(admin_id):
+            return
+        
+        await update.message.reply_text("⏳ در حال ساخت گزارش‌ها...")
+        await self.nightly_reports(context)
+        log_admin(admin_id, username, "اجرای دستی گزارش شبانه")
+    
+    async def rebuild_rollups(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """دستور /rebuild_rollups - بازسازی جداول تجمیعی از روی سفارشات"""
+        admin_id = update.effective_user.id
+        username = update.effective_user.username
+        
+        if not self.config.is_admin(admin_id):
+            return
+        
+        await update.message.reply_text("⏳ در حال بازسازی جداول گزارش...")
+        
+        try:
+            counts = await asyncio.to_thread(self.db.rebuild_rollups)
+            self.report_cache.clear()
+            self.snapshots.clear()
+            
+            await update.message.reply_text(
+                "✅ جداول گزارش بازسازی شدند\n\n"
+                f"📅 روزها: {counts['daily_sales']}\n"
+                f"⏰ ساعت‌ها: {counts['hourly_orders']}\n"
+                f"📦 محصول/روز: {counts['product_daily_sales']}"
+            )
+            log_admin(admin_id, username, "بازسازی rollup ها", str(counts))
+        
+        except Exception as e:
+            logger.error("خطا در بازسازی rollup ها: %s", e, exc_info=True)
+            await update.message.reply_text("❌ خطا در بازسازی جداول گزارش")
+            await notify_error(e, "normal", "rebuild_rollups", admin_id)
+    
+    async def _send_report(self, query, cache_key, photo, caption: str):
+        """ارسال تصویر گزارش و ثبت file_id آن در کش"""
+        message = await query.message.reply_photo(
+            photo=photo,
+            caption=caption,
+            parse_mode='Markdown'
+        )
+        
+        if isinstance(photo, bytes) and message.photo:
+            self.report_cache.set_file_id(cache_key, message.photo[-1].file_id)
+
+
+if __name__ == "__main__":
+    print("⚠️  این ماژول باید در main.py استفاده شود")
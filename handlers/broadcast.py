@@ -5,14 +5,18 @@
 import asyncio
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
-from config import ADMIN_ID
 from states import BROADCAST_MESSAGE
 from keyboards import cancel_keyboard, admin_main_keyboard, broadcast_confirm_keyboard
+from utils.metrics import set_gauge
+from utils.load_shedder import shedding, wait_for_capacity
+
+# حداکثر مکث ارسال برای هر پیام هنگام بار بالا (ثانیه)
+PAUSE_TIMEOUT = 60
 
 
 async def broadcast_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """شروع پیام همگانی"""
-    if update.effective_user.id != ADMIN_ID:
+    if not context.bot_data['config'].is_admin(update.effective_user.id):
         return ConversationHandler.END
     
     # 🆕 پاک کردن پیام قبلی اگه وجود داشته باشه
@@ -84,6 +88,11 @@ async def broadcast_message_received(update: Update, context: ContextTypes.DEFAU
 async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """تایید و ارسال پیام همگانی"""
     query = update.callback_query
+    
+    if not context.bot_data['config'].is_admin(update.effective_user.id):
+        await query.answer()
+        return
+    
     await query.answer()
     
     db = context.bot_data['db']
@@ -102,12 +111,40 @@ async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"لطفاً صبر کنید..."
     )
     
+    # پاک کردن داده‌های موقت
+    context.user_data.clear()
+    
+    # ارسال در پس‌زمینه: آپدیت‌های دیگر در طول ارسال (و مکث‌های آن) پردازش می‌شوند
+    context.application.create_task(
+        _send_broadcast(
+            context, users, query.message.chat_id,
+            broadcast_type, broadcast_content, broadcast_caption
+        ),
+        update=update
+    )
+
+
+async def _send_broadcast(
+    context: ContextTypes.DEFAULT_TYPE,
+    users: list,
+    report_chat_id: int,
+    broadcast_type: str,
+    broadcast_content: str,
+    broadcast_caption: str
+):
+    """حلقه ارسال پیام همگانی و گزارش نهایی به ادمین"""
     success_count = 0
     failed_count = 0
     blocked_count = 0
+    set_gauge('bot_broadcast_messages', len(users), state='total')
     
     for user in users:
-        user_id = user[0]
+        user_id = user['user_id']
+        
+        # در بار بالا ارسال مکث می‌کند تا پاسخ به کاربران فعال کند نشود؛
+        # اگر بار پایین نیامد بعد از PAUSE_TIMEOUT یک پیام دیگر ارسال می‌شود
+        if shedding('broadcast'):
+            await wait_for_capacity(PAUSE_TIMEOUT)
         
         try:
             if broadcast_type == 'text':
@@ -132,7 +169,7 @@ async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 )
             
             success_count += 1
-            
+        
         except Exception as e:
             error_msg = str(e).lower()
             if "bot was blocked" in error_msg or "user is deactivated" in error_msg or "chat not found" in error_msg:
@@ -140,6 +177,10 @@ async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
             else:
                 failed_count += 1
         
+        set_gauge('bot_broadcast_messages', success_count, state='sent')
+        set_gauge('bot_broadcast_messages', blocked_count, state='blocked')
+        set_gauge('bot_broadcast_messages', failed_count, state='failed')
+        
         # تاخیر کوچک برای جلوگیری از محدودیت تلگرام
         await asyncio.sleep(0.05)
     
@@ -150,19 +191,22 @@ async def confirm_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     report += f"❌ خطا: {failed_count}\n"
     report += f"📊 کل: {len(users)}"
     
-    await query.message.reply_text(
+    await context.bot.send_message(
+        report_chat_id,
         report,
         parse_mode='Markdown',
         reply_markup=admin_main_keyboard()
     )
-    
-    # پاک کردن داده‌های موقت
-    context.user_data.clear()
 
 
 async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """لغو ارسال پیام همگانی"""
     query = update.callback_query
+    
+    if not context.bot_data['config'].is_admin(update.effective_user.id):
+        await query.answer()
+        return
+    
     await query.answer("لغو شد")
     
     await query.edit_message_text("❌ ارسال پیام همگانی لغو شد.")
@@ -0,0 +1,157 @@
+"""
+خروجی CSV/XLSX سفارش‌ها و کاربران برای ادمین
+
+دستورها:
+    /export_orders [از] [تا] [csv|xlsx]
+    /export_users  [از] [تا] [csv|xlsx]
+
+تاریخ‌ها به شکل YYYY-MM-DD هستند (پیش‌فرض: ۳۰ روز اخیر، "تا" هم شامل می‌شود).
+فایل در یک worker thread از روی cursor تکه‌تکه روی فایل موقت ساخته می‌شود،
+پس مصرف حافظه به طول بازه بستگی ندارد.
+"""
+
+import asyncio
+import os
+from datetime import date, timedelta
+from telegram import Update
+from telegram.ext import ContextTypes
+from typing import List, Optional, Set, Tuple
+
+from database import Database
+from config import BotConfig
+from utils.logger import get_logger, log_admin
+from utils.error_notifier import notify_error
+from utils.rate_limiter import RateLimiter
+from utils.exporter import FORMATS, export_to_file, xlsx_available
+
+# Logger این ماژول
+logger = get_logger('export')
+
+
+class ExportHandler:
+    """کلاس مدیریت خروجی داده‌ها"""
+    
+    DEFAULT_DAYS = 30
+    
+    def __init__(self, db: Database, config: BotConfig, rate_limiter: RateLimiter):
+        self.db = db
+        self.config = config
+        self.rate_limiter = rate_limiter
+        
+        # ادمین‌هایی که خروجی در حال ساختشان است (هر ادمین یکی در هر لحظه)
+        self.running: Set[int] = set()
+        
+        # {نوع: (عنوان, ستون‌ها, متد stream)}
+        self.exports = {
+            'orders': ("سفارش‌ها", Database.EXPORT_ORDER_COLUMNS, db.stream_orders_export),
+            'users': ("کاربران", Database.EXPORT_USER_COLUMNS, db.stream_users_export),
+        }
+        
+        logger.info("✅ ExportHandler راه‌اندازی شد (xlsx: %s)", 'فعال' if xlsx_available() else 'غیرفعال')
+    
+    @classmethod
+    def parse_args(cls, args: List[str]) -> Tuple[date, date, str]:
+        """
+        پارس آرگومان‌های دستور
+        
+        Returns:
+            (از, تا (شامل), فرمت)
+        
+        Raises:
+            ValueError: تاریخ یا فرمت نامعتبر
+        """
+        fmt = 'csv'
+        dates = []
+        
+        for arg in args:
+            if arg.lower() in FORMATS:
+                fmt = arg.lower()
+            else:
+                dates.append(date.fromisoformat(arg))
+        
+        if len(dates) > 2:
+            raise ValueError("حداکثر دو تاریخ")
+        
+        end = dates[1] if len(dates) == 2 else date.today()
+        start = dates[0] if dates else end - timedelta(days=cls.DEFAULT_DAYS - 1)
+        
+        if start > end:
+            raise ValueError("تاریخ شروع بعد از تاریخ پایان است")
+        
+        return start, end, fmt
+    
+    async def export_orders(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """دستور /export_orders"""
+        await self._export(update, context, 'orders')
+    
+    async def export_users(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """دستور /export_users"""
+        await self._export(update, context, 'users')
+    
+    async def _export(self, update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str):
+        admin_id = update.effective_user.id
+        username = update.effective_user.username
+        
+        if not self.config.is_admin(admin_id):
+            return
+        
+        try:
+            start, end, fmt = self.parse_args(context.args or [])
+        except ValueError:
+            await update.message.reply_text(
+                f"❌ استفاده: /export_{kind} [YYYY-MM-DD] [YYYY-MM-DD] [csv|xlsx]"
+            )
+            return
+        
+        if fmt == 'xlsx' and not xlsx_available():
+            await update.message.reply_text("⚠️ openpyxl نصب نیست؛ خروجی CSV ساخته می‌شود.")
+            fmt = 'csv'
+        
+        if admin_id in self.running:
+            await update.message.reply_text("⏳ خروجی قبلی هنوز در حال ساخت است؛ کمی صبر کنید.")
+            return
+        
+        title, columns, stream = self.exports[kind]
+        await update.message.reply_text(f"⏳ در حال ساخت خروجی {title}...")
+        
+        self.running.add(admin_id)
+        path: Optional[str] = None
+        try:
+            # کوئری و نوشتن فایل هر دو در worker thread؛ event loop آزاد می‌ماند
+            path, rows = await asyncio.to_thread(
+                export_to_file,
+                fmt,
+                columns,
+                stream(start.isoformat(), (end + timedelta(days=1)).isoformat()),
+                f"{kind}_{start.isoformat()}_{end.isoformat()}"
+            )
+            
+            if rows == 0:
+                await update.message.reply_text("❌ در این بازه داده‌ای وجود ندارد!")
+                return
+            
+            with open(path, 'rb') as f:
+                await update.message.reply_document(
+                    document=f,
+                    filename=f"{kind}_{start.isoformat()}_{end.isoformat()}.{fmt}",
+                    caption=f"📄 {title}: {start.isoformat()} تا {end.isoformat()}\n{rows:,} ردیف"
+                )
+            
+            log_admin(admin_id, username, f"خروجی {title}", f"{start}..{end} {fmt} ({rows} ردیف)")
+        
+        except Exception as e:
+            logger.error("خطا در ساخت خروجی %s: %s", kind, e, exc_info=True)
+            await update.message.reply_text("❌ خطا در ساخت خروجی!")
+            await notify_error(e, "low", f"export_{kind}", admin_id)
+        
+        finally:
+            self.running.discard(admin_id)
+            if path and os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    # تست پارس آرگومان‌ها
+    print(ExportHandler.parse_args([]))
+    print(ExportHandler.parse_args(['2024-01-01', 'xlsx']))
+    print(ExportHandler.parse_args(['2024-01-01', '2024-01-31']))
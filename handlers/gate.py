@@ -0,0 +1,267 @@
+"""
+دروازه ورودی آپدیت‌ها (قبل از رسیدن به هر handler)
+
+شامل: بررسی لیست بلاک، بلاک موقت پرترافیک‌ها، rate limit کلی آپدیت‌ها
+(به‌جز سبد خرید و ثبت سفارش)
+و پاسخ «شلوغ است» به callback های کم‌اولویت هنگام بار بیش از حد event loop
+این handler به‌صورت TypeHandler در گروه -1 ثبت می‌شود تا قبل از
+مطابقت هر handler دیگری اجرا شود؛ آپدیت‌های رد شده با
+ApplicationHandlerStop متوقف می‌شوند و به دیتابیس یا handler ها نمی‌رسند.
+"""
+
+import asyncio
+import html
+import time
+from datetime import datetime
+from telegram import Update
+from telegram.ext import ContextTypes, ApplicationHandlerStop
+from typing import Optional, Set
+
+from database import Database
+from config import BotConfig
+from utils.logger import get_logger, log_admin, log_security
+from utils.rate_limiter import RateLimiter
+from utils.metrics import inc
+from utils.load_shedder import OVERLOADED, shedding
+from utils.heavy_hitters import HeavyHitterDetector, normalize_pattern
+
+# Logger این ماژول
+logger = get_logger('gate')
+
+
+class GateHandler:
+    """کلاس دروازه: rate limit و بلاک قبل از dispatch"""
+    
+    # گروه ثبت handler (قبل از گروه پیش‌فرض 0)
+    GROUP = -1
+    
+    # حداکثر یک پیام اخطار برای هر کاربر در این بازه
+    NOTICE_POLICY = 'gate_notice'
+    NOTICE_WINDOW = 60
+    
+    # سیاست‌های rate limit همه آپدیت‌ها (جدا از سقف سخت‌گیرانه handler ها)
+    RATE_POLICIES = ('gate_minute', 'gate_hour')
+    
+    # callback های مسیر خرید که شامل rate limit دروازه نمی‌شوند؛ افزودن به سبد
+    # سقف خودش را در handler دارد و پرترافیک‌ها همچنان بلاک می‌شوند
+    EXEMPT_CALLBACKS = ('add_to_cart_', 'user_cart', 'confirm_order')
+    
+    # callback هایی که در بار بیش از حد رد می‌شوند (مرور و راهنما)؛
+    # سبد خرید و ثبت سفارش هیچ‌وقت رد نمی‌شوند
+    LOW_PRIORITY_CALLBACKS = ('user_products', 'product_view_', 'user_help', 'user_orders', 'user_main_menu')
+    
+    # فاصله بازخوانی لیست بلاک از دیتابیس (ثانیه)؛ بلاک/آنبلاک در یک worker
+    # حداکثر بعد از این مدت در بقیه worker ها هم اعمال می‌شود
+    BLOCK_REFRESH_SECONDS = 5
+    
+    def __init__(self, db: Database, config: BotConfig, rate_limiter: RateLimiter):
+        self.db = db
+        self.config = config
+        self.rate_limiter = rate_limiter
+        
+        # لیست بلاک در حافظه؛ مرجع مشترک ستون users.is_blocked است و
+        # هر BLOCK_REFRESH_SECONDS دوباره خوانده می‌شود
+        self.blocked_users: Set[int] = set(self.db.get_blocked_user_ids())
+        self._blocked_loaded_at = time.monotonic()
+        
+        self.rate_limiter.add_policy(self.NOTICE_POLICY, 1, self.NOTICE_WINDOW)
+        self.rate_limiter.add_policy('gate_minute', config.gate_max_per_minute, 60)
+        self.rate_limiter.add_policy('gate_hour', config.gate_max_per_hour, 3600)
+        
+        # تشخیص پرترافیک‌ها با حافظه ثابت
+        self.heavy_hitters = HeavyHitterDetector(
+            window_seconds=config.heavy_hitter_window_seconds,
+            block_threshold=config.heavy_hitter_threshold,
+            block_seconds=config.temp_block_seconds
+        )
+        
+        logger.info("✅ GateHandler راه‌اندازی شد (%s کاربر بلاک)", len(self.blocked_users))
+    
+    async def check(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """بررسی هر آپدیت قبل از dispatch"""
+        inc('bot_updates_total')
+        user = update.effective_user
+        
+        if user is None:
+            return
+        
+        user_id = user.id
+        
+        if self.config.is_admin(user_id):
+            return
+        
+        await self._refresh_blocked_users()
+        
+        if user_id in self.blocked_users:
+            await self._reject(update, user_id, "⛔️ دسترسی شما محدود شده است.", 'blocked')
+            raise ApplicationHandlerStop
+        
+        # ثبت در sketch قبل از rate limit تا اسپم رد شده هم شمرده شود
+        self.heavy_hitters.record(user_id, self._update_pattern(update))
+        
+        if self.heavy_hitters.is_blocked(user_id):
+            await self._reject(update, user_id, "⛔️ به دلیل درخواست‌های زیاد موقتاً محدود شده‌اید.", 'heavy_hitter')
+            raise ApplicationHandlerStop
+        
+        query = update.callback_query
+        exempt = bool(query and query.data and query.data.startswith(self.EXEMPT_CALLBACKS))
+        
+        if not exempt:
+            allowed, retry_after = self.rate_limiter.check(user_id, *self.RATE_POLICIES)
+            if not allowed:
+                log_security("Gate rate limit hit", user_id, f"retry after {retry_after}s")
+                await self._reject(update, user_id, "⏳ لطفاً کمی صبر کنید و دوباره تلاش کنید.", 'rate_limit')
+                raise ApplicationHandlerStop
+        
+        if (
+            query and query.data
+            and query.data.startswith(self.LOW_PRIORITY_CALLBACKS)
+            and shedding('low_priority_callback', OVERLOADED)
+        ):
+            await self._reject(
+                update, user_id, "⏳ سرور شلوغ است، لطفاً چند لحظه دیگر دوباره تلاش کنید.", 'overload'
+            )
+            raise ApplicationHandlerStop
+    
+    async def _refresh_blocked_users(self):
+        """بازخوانی لیست بلاک تا /block در worker های دیگر هم اعمال شود"""
+        now = time.monotonic()
+        if now - self._blocked_loaded_at < self.BLOCK_REFRESH_SECONDS:
+            return
+        
+        self._blocked_loaded_at = now
+        try:
+            self.blocked_users = set(await asyncio.to_thread(self.db.get_blocked_user_ids))
+        except Exception as e:
+            # با خطای دیتابیس لیست قبلی معتبر می‌ماند
+            logger.warning("⚠️  بازخوانی لیست بلاک ناموفق بود: %s", e)
+    
+    @staticmethod
+    def _update_pattern(update: Update) -> Optional[str]:
+        """الگوی آپدیت برای شمارش (callback ها و دستورات)"""
+        if update.callback_query and update.callback_query.data:
+            return normalize_pattern(update.callback_query.data)
+        
+        message = update.effective_message
+        if message and message.text and message.text.startswith('/'):
+            return message.text.split()[0][:32]
+        
+        return None
+    
+    async def _reject(self, update: Update, user_id: int, text: str, reason: str):
+        """پاسخ کم‌هزینه به آپدیت رد شده"""
+        inc('bot_gate_rejections_total', reason=reason)
+        
+        try:
+            # callback query باید همیشه answer شود تا دکمه در حالت لودینگ نماند
+            if update.callback_query:
+                await update.callback_query.answer(text)
+                return
+            
+            # برای پیام‌ها فقط یک اخطار در هر بازه ارسال می‌شود
+            allowed, _ = self.rate_limiter.check(user_id, self.NOTICE_POLICY)
+            if allowed and update.effective_message:
+                await update.effective_message.reply_text(text)
+        
+        except Exception as e:
+            logger.debug("خطا در پاسخ به آپدیت رد شده از %s: %s", user_id, e)
+    
+    # ========== مدیریت لیست بلاک ==========
+    
+    def block_user(self, user_id: int):
+        """بلاک کردن کاربر (دیتابیس + حافظه)"""
+        self.db.set_user_blocked(user_id, True)
+        self.blocked_users.add(user_id)
+        self.rate_limiter.reset_user(user_id)
+        log_security("کاربر بلاک شد", user_id)
+    
+    def unblock_user(self, user_id: int):
+        """آنبلاک کردن کاربر (دیتابیس + حافظه)"""
+        self.db.set_user_blocked(user_id, False)
+        self.blocked_users.discard(user_id)
+        self.heavy_hitters.unblock(user_id)
+        log_security("کاربر آنبلاک شد", user_id)
+    
+    async def block_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """دستور /block <user_id>"""
+        await self._block_command(update, context, block=True)
+    
+    async def unblock_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """دستور /unblock <user_id>"""
+        await self._block_command(update, context, block=False)
+    
+    async def _block_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE, block: bool):
+        admin_id = update.effective_user.id
+        username = update.effective_user.username
+        
+        if not self.config.is_admin(admin_id):
+            return
+        
+        try:
+            target_id = int(context.args[0])
+        except (IndexError, ValueError, TypeError):
+            command = "/block" if block else "/unblock"
+            await update.message.reply_text(f"❌ استفاده: {command} <user_id>")
+            return
+        
+        if self.config.is_admin(target_id):
+            await update.message.reply_text("❌ ادمین را نمی‌توان بلاک کرد.")
+            return
+        
+        if block:
+            self.block_user(target_id)
+            await update.message.reply_text(f"⛔️ کاربر {target_id} بلاک شد.")
+            log_admin(admin_id, username, "بلاک کاربر", str(target_id))
+        else:
+            self.unblock_user(target_id)
+            await update.message.reply_text(f"✅ کاربر {target_id} آنبلاک شد.")
+            log_admin(admin_id, username, "آنبلاک کاربر", str(target_id))
+    
+    
+    async def top_talkers(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """دستور /top_talkers - گزارش پرترافیک‌ها از روی sketch"""
+        admin_id = update.effective_user.id
+        username = update.effective_user.username
+        
+        if not self.config.is_admin(admin_id):
+            return
+        
+        report = self.heavy_hitters.get_report(10)
+        
+        def _section(title: str, window: dict) -> str:
+            started = (
+                datetime.fromtimestamp(window['start']).strftime('%H:%M:%S')
+                if window['start'] else "-"
+            )
+            text = f"<b>{title}</b> (شروع {started}، کل: {window['total']})\n"
+            
+            if window['users']:
+                text += "👤 کاربران:\n"
+                text += "".join(f"  • <code>{uid}</code>: ~{count}\n" for uid, count in window['users'])
+            
+            if window['patterns']:
+                text += "🔘 الگوها:\n"
+                text += "".join(f"  • <code>{html.escape(pattern)}</code>: ~{count}\n" for pattern, count in window['patterns'])
+            
+            return text + "\n"
+        
+        text = f"📡 <b>پرترافیک‌ها</b> (بازه {report['window_seconds']} ثانیه)\n\n"
+        text += _section("بازه فعلی", report['current'])
+        text += _section("بازه قبلی", report['previous'])
+        
+        if report['blocked']:
+            text += "⛔️ <b>بلاک‌های موقت:</b>\n"
+            text += "".join(
+                f"  • <code>{uid}</code> ({remaining // 60} دقیقه مانده)\n"
+                for uid, remaining in report['blocked']
+            )
+        
+        text += f"\n🔢 کل بلاک‌های خودکار: {report['auto_block_count']}"
+        text += f"\n💾 حافظه sketch: {report['memory_bytes'] // 1024} KB"
+        
+        await update.message.reply_text(text, parse_mode='HTML')
+        log_admin(admin_id, username, "مشاهده پرترافیک‌ها")
+
+
+if __name__ == "__main__":
+    print("⚠️  این ماژول باید در main.py استفاده شود")
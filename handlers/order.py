@@ -6,13 +6,15 @@ Handler های مربوط به سفارشات و سبد خرید
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 from database import Database
 from config import BotConfig
 from utils.logger import get_logger, log_user, log_order, log_error, log_event
 from utils.error_notifier import notify_error
 from utils.rate_limiter import RateLimiter
+from utils.state_backend import MemoryBackend, SessionStore
+from handlers.user import also_bought_buttons
 
 # Logger این ماژول
 logger = get_logger('order_handler')
@@ -21,22 +23,31 @@ logger = get_logger('order_handler')
 class OrderHandler:
     """کلاس مدیریت handler های سفارش"""
     
-    def __init__(self, db: Database, config: BotConfig, rate_limiter: RateLimiter):
+    def __init__(
+        self,
+        db: Database,
+        config: BotConfig,
+        rate_limiter: RateLimiter,
+        sessions: Optional[SessionStore] = None
+    ):
         self.db = db
         self.config = config
         self.rate_limiter = rate_limiter
         
+        # سبد خرید در session store نگه‌داری می‌شود تا بین پروسه‌ها مشترک باشد
+        self.sessions = sessions or SessionStore(MemoryBackend())
+        
         logger.info("✅ OrderHandler راه‌اندازی شد")
     
-    def _get_cart(self, context: ContextTypes.DEFAULT_TYPE) -> Dict[int, int]:
-        """دریافت سبد خرید از context"""
-        if 'cart' not in context.user_data:
-            context.user_data['cart'] = {}
-        return context.user_data['cart']
+    def _get_cart(self, user_id: int) -> Dict[int, int]:
+        """دریافت سبد خرید (کپی فقط‌خواندنی)"""
+        cart = self.sessions.get(user_id, 'cart') or {}
+        # کلیدهای JSON رشته هستند
+        return {int(product_id): quantity for product_id, quantity in cart.items()}
     
-    def _clear_cart(self, context: ContextTypes.DEFAULT_TYPE):
+    def _clear_cart(self, user_id: int):
         """خالی کردن سبد خرید"""
-        context.user_data['cart'] = {}
+        self.sessions.set(user_id, 'cart', {})
     
     async def add_to_cart(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """افزودن محصول به سبد خرید"""
@@ -52,11 +63,11 @@ class OrderHandler:
             product_id = int(parts[3])
             quantity = int(parts[4])
         except (ValueError, IndexError):
-            logger.error(f"callback_data نامعتبر: {query.data}")
+            logger.error("callback_data نامعتبر: %s", query.data)
             await query.answer("❌ خطا در پردازش", show_alert=True)
             return
         
-        logger.info(f"افزودن به سبد: کاربر {user_id}, محصول {product_id}, تعداد {quantity}")
+        logger.info("افزودن به سبد: کاربر %s, محصول %s, تعداد %s", user_id, product_id, quantity)
         
         try:
             # بررسی rate limit
@@ -75,33 +86,43 @@ class OrderHandler:
                 await query.answer("❌ این محصول غیرفعال است", show_alert=True)
                 return
             
-            # دریافت سبد
-            cart = self._get_cart(context)
+            def _add(session: Dict[str, Any]):
+                """بررسی و افزودن به‌صورت اتمیک روی session"""
+                cart = session.setdefault('cart', {})
+                key = str(product_id)
+                
+                # محاسبه تعداد فعلی در سبد
+                current = cart.get(key, 0)
+                new = current + quantity
+                
+                # بررسی موجودی
+                if new > product['stock']:
+                    return 'stock', current
+                
+                # بررسی حداکثر تعداد در سبد
+                if sum(cart.values()) + quantity > self.config.max_cart_items:
+                    return 'limit', current
+                
+                # افزودن به سبد
+                cart[key] = new
+                return None, new
             
-            # محاسبه تعداد فعلی در سبد
-            current_quantity = cart.get(product_id, 0)
-            new_quantity = current_quantity + quantity
+            error, new_quantity = self.sessions.update(user_id, _add)
             
-            # بررسی موجودی
-            if new_quantity > product['stock']:
+            if error == 'stock':
                 await query.answer(
-                    f"❌ موجودی کافی نیست!\nموجود: {product['stock']}, در سبد: {current_quantity}",
+                    f"❌ موجودی کافی نیست!\nموجود: {product['stock']}, در سبد: {new_quantity}",
                     show_alert=True
                 )
                 return
             
-            # بررسی حداکثر تعداد در سبد
-            total_items = sum(cart.values()) + quantity
-            if total_items > self.config.max_cart_items:
+            if error == 'limit':
                 await query.answer(
                     f"❌ حداکثر {self.config.max_cart_items} محصول در سبد مجاز است",
                     show_alert=True
                 )
                 return
             
-            # افزودن به سبد
-            cart[product_id] = new_quantity
-            
             # پیام تأیید
             text = (
                 f"✅ <b>{product['name']}</b>\n\n"
@@ -128,9 +149,9 @@ class OrderHandler:
                 "افزودن به سبد",
                 f"محصول {product_id} ({product['name']}), تعداد {quantity}"
             )
-            
+        
         except Exception as e:
-            logger.error(f"خطا در افزودن به سبد: {e}", exc_info=True)
+            logger.error("خطا در افزودن به سبد: %s", e, exc_info=True)
             await query.answer("❌ خطا در افزودن به سبد", show_alert=True)
             await notify_error(e, "normal", "add_to_cart", user_id)
     
@@ -142,11 +163,11 @@ class OrderHandler:
         user_id = update.effective_user.id
         username = update.effective_user.username
         
-        logger.info(f"مشاهده سبد خرید: کاربر {user_id}")
+        logger.info("مشاهده سبد خرید: کاربر %s", user_id)
         
         try:
             # دریافت سبد
-            cart = self._get_cart(context)
+            cart = self._get_cart(user_id)
             
             if not cart:
                 text = "🛒 سبد خرید شما خالی است"
@@ -167,11 +188,13 @@ class OrderHandler:
             total_price = 0
             cart_items = []
             
+            products = self.db.get_products(list(cart))
+            
             for product_id, quantity in cart.items():
-                product = self.db.get_product(product_id)
+                product = products.get(product_id)
                 
                 if not product:
-                    logger.warning(f"محصول {product_id} در سبد یافت نشد")
+                    logger.warning("محصول %s در سبد یافت نشد", product_id)
                     continue
                 
                 if not product['is_active'] or product['stock'] < quantity:
@@ -204,7 +227,11 @@ class OrderHandler:
             else:
                 text += f"💰 <b>جمع کل: {total_price:,} تومان</b>"
                 
-                keyboard = [
+                keyboard = also_bought_buttons(self.db, list(cart))
+                if keyboard:
+                    text += "\n\n🤝 <b>پیشنهاد برای تکمیل خرید:</b>"
+                
+                keyboard += [
                     [
                         InlineKeyboardButton("✅ ثبت سفارش", callback_data="confirm_order"),
                         InlineKeyboardButton("🗑 خالی کردن سبد", callback_data="clear_cart")
@@ -227,9 +254,9 @@ class OrderHandler:
                 "مشاهده سبد خرید",
                 f"{len(cart_items)} آیتم, مبلغ {total_price:,}"
             )
-            
+        
         except Exception as e:
-            logger.error(f"خطا در نمایش سبد: {e}", exc_info=True)
+            logger.error("خطا در نمایش سبد: %s", e, exc_info=True)
             await query.edit_message_text("❌ خطا در نمایش سبد خرید")
             await notify_error(e, "normal", "view_cart", user_id)
     
@@ -241,10 +268,10 @@ class OrderHandler:
         user_id = update.effective_user.id
         username = update.effective_user.username
         
-        logger.info(f"خالی کردن سبد: کاربر {user_id}")
+        logger.info("خالی کردن سبد: کاربر %s", user_id)
         
         try:
-            self._clear_cart(context)
+            self._clear_cart(user_id)
             
             text = "🗑 سبد خرید شما خالی شد"
             keyboard = [
@@ -257,9 +284,9 @@ class OrderHandler:
             )
             
             log_user(user_id, username, "خالی کردن سبد")
-            
+        
         except Exception as e:
-            logger.error(f"خطا در خالی کردن سبد: {e}", exc_info=True)
+            logger.error("خطا در خالی کردن سبد: %s", e, exc_info=True)
             await notify_error(e, "low", "clear_cart", user_id)
     
     async def confirm_order(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -270,11 +297,11 @@ class OrderHandler:
         user_id = update.effective_user.id
         username = update.effective_user.username
         
-        logger.info(f"تأیید سفارش: کاربر {user_id}")
+        logger.info("تأیید سفارش: کاربر %s", user_id)
         
         try:
             # دریافت سبد
-            cart = self._get_cart(context)
+            cart = self._get_cart(user_id)
             
             if not cart:
                 await query.edit_message_text("❌ سبد خرید خالی است")
@@ -285,8 +312,10 @@ class OrderHandler:
             items_to_order = []
             errors = []
             
+            products = self.db.get_products(list(cart))
+            
             for product_id, quantity in cart.items():
-                product = self.db.get_product(product_id)
+                product = products.get(product_id)
                 
                 if not product:
                     errors.append(f"محصول {product_id} یافت نشد")
@@ -336,24 +365,17 @@ class OrderHandler:
             # ایجاد سفارش
             order_id = self.db.create_order(user_id)
             
-            # افزودن آیتم‌ها
-            for item in items_to_order:
-                self.db.add_order_item(
-                    order_id,
-                    item['product_id'],
-                    item['quantity'],
-                    item['product']['price']
-                )
-                
-                # کم کردن از موجودی
-                new_stock = item['product']['stock'] - item['quantity']
-                self.db.update_product(item['product_id'], stock=new_stock)
+            # افزودن آیتم‌ها و کم کردن از موجودی (یک تراکنش برای کل سبد)
+            self.db.add_order_items(order_id, [
+                (item['product_id'], item['quantity'], item['product']['price'])
+                for item in items_to_order
+            ])
             
             # به‌روزرسانی مبلغ سفارش
             self.db.update_order_status(order_id, 'pending')
             
             # خالی کردن سبد
-            self._clear_cart(context)
+            self._clear_cart(user_id)
             
             # پیام تأیید
             text = (
@@ -394,9 +416,9 @@ class OrderHandler:
             
             # ارسال نوتیفیکیشن به ادمین (اختیاری)
             # می‌تونیم این رو بعداً اضافه کنیم
-            
+        
         except Exception as e:
-            logger.error(f"خطا در ثبت سفارش: {e}", exc_info=True)
+            logger.error("خطا در ثبت سفارش: %s", e, exc_info=True)
             await query.edit_message_text("❌ خطا در ثبت سفارش")
             await notify_error(e, "high", "confirm_order", user_id)
     
@@ -408,7 +430,7 @@ class OrderHandler:
         user_id = update.effective_user.id
         username = update.effective_user.username
         
-        logger.info(f"مشاهده سفارشات: کاربر {user_id}")
+        logger.info("مشاهده سفارشات: کاربر %s", user_id)
         
         try:
             # دریافت سفارشات
@@ -470,12 +492,68 @@ class OrderHandler:
             )
             
             log_user(user_id, username, "مشاهده سفارشات", f"{len(orders)} سفارش")
-            
+        
         except Exception as e:
-            logger.error(f"خطا در نمایش سفارشات: {e}", exc_info=True)
+            logger.error("خطا در نمایش سفارشات: %s", e, exc_info=True)
             await query.edit_message_text("❌ خطا در نمایش سفارشات")
             await notify_error(e, "normal", "view_orders", user_id)
 
 
 if __name__ == "__main__":
-    print("⚠️  این ماژول باید در main.py استفاده شود")
+    # بررسی N+1: تعداد فراخوانی دیتابیس سبد 20 قلمی نباید با تعداد اقلام رشد کند
+    #   PYTHONPATH=. python handlers/order.py   (خروجی غیرصفر اگر از سقف بیشتر شود)
+    import asyncio
+    import os
+    import sys
+    import tempfile
+    from types import SimpleNamespace
+    from utils.query_counter import assert_max_queries
+    from utils.rate_limiter import init_rate_limiter
+    from utils.logger import shutdown_logging
+    
+    CART_LINES = 20
+    BUDGETS = {'view_cart': 2, 'confirm_order': 4}
+    
+    async def _check() -> bool:
+        db = Database(os.path.join(tempfile.mkdtemp(prefix='order_queries_'), 'shop.db'))
+        config = BotConfig(bot_token='123456789:' + 'A' * 35, admin_ids=[], channel_id=0)
+        handler = OrderHandler(db, config, init_rate_limiter())
+        
+        user_id = 42
+        product_ids = [db.add_product(f"محصول {i}", 100_000 + i, "", 10) for i in range(CART_LINES)]
+        handler.sessions.set(user_id, 'cart', {str(product_id): 2 for product_id in product_ids})
+        
+        replies = []
+        
+        async def answer(*args, **kwargs):
+            pass
+        
+        async def edit_message_text(text, **kwargs):
+            replies.append(text)
+        
+        update = SimpleNamespace(
+            effective_user=SimpleNamespace(id=user_id, username='test', first_name='Test'),
+            callback_query=SimpleNamespace(data='', answer=answer, edit_message_text=edit_message_text)
+        )
+        context = SimpleNamespace(bot=None, args=[])
+        
+        ok = True
+        for name, budget in BUDGETS.items():
+            try:
+                await assert_max_queries(getattr(handler, name), budget, update, context)
+                print(f"✅ {name}: حداکثر {budget} فراخوانی برای {CART_LINES} قلم")
+            except AssertionError as e:
+                print(f"❌ {e}")
+                ok = False
+        
+        # handler ها خطا را می‌گیرند و پیام خطا می‌دهند؛ کم بودن کوئری باید از مسیر موفق باشد
+        stock = db.get_product(product_ids[0])['stock']
+        if not (replies and 'سبد خرید شما' in replies[0] and 'ثبت شد' in replies[-1] and stock == 8):
+            print(f"❌ مسیر موفق اجرا نشد (موجودی {stock}): {[r[:40] for r in replies]}")
+            ok = False
+        
+        return ok
+    
+    passed = asyncio.run(_check())
+    shutdown_logging()
+    sys.exit(0 if passed else 1)
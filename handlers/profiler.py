@@ -0,0 +1,162 @@
+"""
+پروفایل‌گیری از ربات در حال اجرا برای ادمین
+
+دستور:
+    /profile [N][s|u]
+    
+    /profile 30     - پروفایل 30 ثانیه (پیش‌فرض)
+    /profile 500u   - پروفایل تا پردازش 500 آپدیت (حداکثر MAX_SECONDS ثانیه)
+
+دو فایل برای ادمین ارسال می‌شود: profile.prof (cProfile) و
+profile.collapsed.txt (stack های نمونه‌برداری شده برای flamegraph).
+شمارنده آپدیت فقط در طول پروفایل ثبت و بعد از آن حذف می‌شود.
+"""
+
+import asyncio
+import re
+from datetime import datetime
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+from typing import Optional, Tuple
+
+from database import Database
+from config import BotConfig
+from utils.logger import get_logger, log_admin
+from utils.error_notifier import notify_error
+from utils.rate_limiter import RateLimiter
+from utils.profiler import ProfileSession, remove_files
+
+# Logger این ماژول
+logger = get_logger('profiler_handler')
+
+
+class ProfilerHandler:
+    """کلاس مدیریت پروفایل‌گیری"""
+    
+    # گروه شمارنده آپدیت (قبل از gate در گروه -1 تا آپدیت‌های رد شده هم شمرده شوند)
+    GROUP = -2
+    
+    DEFAULT_SECONDS = 30
+    MAX_SECONDS = 300
+    MAX_UPDATES = 10000
+    
+    def __init__(self, db: Database, config: BotConfig, rate_limiter: RateLimiter):
+        self.db = db
+        self.config = config
+        self.rate_limiter = rate_limiter
+        
+        # پروفایل در جریان (در هر لحظه حداکثر یکی)
+        self.session: Optional[ProfileSession] = None
+        self._target_updates = 0
+        self._done = asyncio.Event()
+        self._counter = TypeHandler(Update, self._count_update)
+        
+        logger.info("✅ ProfilerHandler راه‌اندازی شد")
+    
+    @classmethod
+    def parse_args(cls, args) -> Tuple[int, str]:
+        """
+        Returns:
+            (تعداد, 's' یا 'u')
+        
+        Raises:
+            ValueError: آرگومان نامعتبر یا خارج از محدوده
+        """
+        if not args:
+            return cls.DEFAULT_SECONDS, 's'
+        
+        match = re.fullmatch(r'(\d+)\s*([su]?)', " ".join(args).strip().lower())
+        if match is None:
+            raise ValueError("آرگومان نامعتبر")
+        
+        count, unit = int(match.group(1)), match.group(2) or 's'
+        limit = cls.MAX_SECONDS if unit == 's' else cls.MAX_UPDATES
+        
+        if not 1 <= count <= limit:
+            raise ValueError(f"باید بین 1 و {limit} باشد")
+        
+        return count, unit
+    
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """دستور /profile"""
+        admin_id = update.effective_user.id
+        username = update.effective_user.username
+        
+        if not self.config.is_admin(admin_id):
+            return
+        
+        try:
+            count, unit = self.parse_args(context.args or [])
+        except ValueError as e:
+            await update.message.reply_text(
+                f"❌ {e}\nاستفاده: /profile [ثانیه] یا /profile [تعداد]u\n"
+                f"مثال: /profile 30 یا /profile 500u"
+            )
+            return
+        
+        if self.session is not None:
+            await update.message.reply_text("⏳ یک پروفایل دیگر در حال اجراست.")
+            return
+        
+        self.session = ProfileSession()
+        self._target_updates = count if unit == 'u' else 0
+        self._done.clear()
+        
+        context.application.add_handler(self._counter, group=self.GROUP)
+        self.session.start()
+        
+        what = f"{count} ثانیه" if unit == 's' else f"{count} آپدیت (حداکثر {self.MAX_SECONDS} ثانیه)"
+        await update.message.reply_text(f"🔬 پروفایل شروع شد: {what}")
+        log_admin(admin_id, username, "شروع پروفایل", what)
+        
+        timeout = count if unit == 's' else self.MAX_SECONDS
+        context.application.create_task(self._finish(context.application, admin_id, timeout))
+    
+    async def _count_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        session = self.session
+        if session is None:
+            return
+        
+        session.updates += 1
+        if self._target_updates and session.updates >= self._target_updates:
+            self._done.set()
+    
+    async def _finish(self, application: Application, admin_id: int, timeout: float):
+        """پایان پروفایل بعد از زمان/تعداد آپدیت و ارسال فایل‌ها"""
+        try:
+            await asyncio.wait_for(self._done.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        
+        session = self.session
+        session.stop()
+        application.remove_handler(self._counter, group=self.GROUP)
+        self.session = None
+        
+        prof_path = collapsed_path = None
+        try:
+            prefix = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            prof_path, collapsed_path = await asyncio.to_thread(session.write_files, prefix)
+            
+            caption = (
+                f"🔬 پروفایل {session.duration:.1f} ثانیه، {session.updates} آپدیت، "
+                f"{session.sampler.samples} نمونه stack"
+            )
+            
+            with open(prof_path, 'rb') as f:
+                await application.bot.send_document(
+                    admin_id, document=f, filename=f"{prefix}.prof",
+                    caption=f"{caption}\n(snakeviz / python -m pstats)"
+                )
+            with open(collapsed_path, 'rb') as f:
+                await application.bot.send_document(
+                    admin_id, document=f, filename=f"{prefix}.collapsed.txt",
+                    caption="🔥 collapsed stacks (flamegraph.pl / speedscope)"
+                )
+        
+        except Exception as e:
+            logger.error("خطا در ارسال نتیجه پروفایل: %s", e, exc_info=True)
+            await notify_error(e, "low", "profile", admin_id)
+        
+        finally:
+            await asyncio.to_thread(remove_files, prof_path, collapsed_path)
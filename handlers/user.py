@@ -1,9 +1,10 @@
 """
 Handler های مربوط به کاربران عادی
 
-شامل: start، help، مشاهده محصولات
+شامل: start، help، مشاهده محصولات و پیشنهاد محصولات هم‌خرید
 """
 
+import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from typing import List, Dict, Any
@@ -13,14 +14,33 @@ from config import BotConfig
 from utils.logger import get_logger, log_user, log_error, log_event
 from utils.error_notifier import notify_error
 from utils.rate_limiter import RateLimiter
+from utils.load_shedder import shedding, wait_for_capacity
 
 # Logger این ماژول
 logger = get_logger('user_handler')
 
 
+def also_bought_buttons(db: Database, product_ids: List[int], limit: int = 3) -> List[List[InlineKeyboardButton]]:
+    """ردیف دکمه‌های «این‌ها را هم خریده‌اند» (خالی اگر پیشنهادی نباشد)"""
+    try:
+        neighbors = db.get_product_neighbors(product_ids, limit)
+    except Exception as e:
+        # پیشنهادها اختیاری هستند؛ خطا نباید نمایش محصول یا سبد را خراب کند
+        logger.warning("⚠️  خطا در دریافت محصولات هم‌خرید: %s", e)
+        return []
+    
+    return [
+        [InlineKeyboardButton(f"🤝 {name}", callback_data=f"product_view_{neighbor_id}")]
+        for neighbor_id, name in neighbors
+    ]
+
+
 class UserHandler:
     """کلاس مدیریت handler های کاربران"""
     
+    # تعداد دکمه‌های «این‌ها را هم خریده‌اند»
+    ALSO_BOUGHT_LIMIT = 3
+    
     def __init__(self, db: Database, config: BotConfig, rate_limiter: RateLimiter):
         self.db = db
         self.config = config
@@ -36,12 +56,12 @@ class UserHandler:
         first_name = user.first_name
         last_name = user.last_name
         
-        logger.info(f"کاربر جدید/بازگشته: {user_id} (@{username})")
+        logger.info("کاربر جدید/بازگشته: %s (@%s)", user_id, username)
         
         try:
-            # بررسی rate limit
+            # بلاک و سقف کلی در GateHandler بررسی شده‌اند؛ این سقف سخت‌گیرانه‌تر
+            # فقط برای /start، راهنما، لیست محصولات و افزودن به سبد است
             if not self.rate_limiter.check_rate_limit(user_id):
-                logger.warning(f"Rate limit برای کاربر {user_id}")
                 await update.message.reply_text(
                     "⏳ لطفاً کمی صبر کنید و دوباره تلاش کنید."
                 )
@@ -50,13 +70,6 @@ class UserHandler:
             # ثبت/به‌روزرسانی کاربر
             self.db.add_or_update_user(user_id, username, first_name, last_name)
             
-            # بررسی بلاک
-            if self.db.is_user_blocked(user_id):
-                logger.warning(f"کاربر بلاک شده تلاش به استفاده: {user_id}")
-                await update.message.reply_text("⛔️ دسترسی شما محدود شده است.")
-                log_user(user_id, username, "تلاش استفاده با اکانت بلاک شده")
-                return
-            
             # پیام خوش‌آمدگویی
             text = (
                 f"👋 سلام {first_name} عزیز!\n\n"
@@ -81,9 +94,9 @@ class UserHandler:
             )
             
             log_user(user_id, username, "استفاده از /start")
-            
+        
         except Exception as e:
-            logger.error(f"خطا در start handler: {e}", exc_info=True)
+            logger.error("خطا در start handler: %s", e, exc_info=True)
             await update.message.reply_text("❌ خطا در پردازش درخواست")
             await notify_error(e, "normal", "start", user_id)
     
@@ -92,7 +105,7 @@ class UserHandler:
         user_id = update.effective_user.id
         username = update.effective_user.username
         
-        logger.info(f"درخواست راهنما از {user_id}")
+        logger.info("درخواست راهنما از %s", user_id)
         
         try:
             # بررسی rate limit
@@ -130,9 +143,9 @@ class UserHandler:
                 )
             
             log_user(user_id, username, "مشاهده راهنما")
-            
+        
         except Exception as e:
-            logger.error(f"خطا در help: {e}", exc_info=True)
+            logger.error("خطا در help: %s", e, exc_info=True)
             await notify_error(e, "low", "help", user_id)
     
     async def show_products(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -143,7 +156,7 @@ class UserHandler:
         user_id = update.effective_user.id
         username = update.effective_user.username
         
-        logger.info(f"درخواست محصولات از {user_id}")
+        logger.info("درخواست محصولات از %s", user_id)
         
         try:
             # بررسی rate limit
@@ -204,9 +217,9 @@ class UserHandler:
             )
             
             log_user(user_id, username, "مشاهده لیست محصولات", f"{len(available_products)} محصول")
-            
+        
         except Exception as e:
-            logger.error(f"خطا در نمایش محصولات: {e}", exc_info=True)
+            logger.error("خطا در نمایش محصولات: %s", e, exc_info=True)
             await query.edit_message_text("❌ خطا در نمایش محصولات")
             await notify_error(e, "normal", "show_products", user_id)
     
@@ -222,11 +235,11 @@ class UserHandler:
         try:
             product_id = int(query.data.split('_')[-1])
         except (ValueError, IndexError):
-            logger.error(f"callback_data نامعتبر: {query.data}")
+            logger.error("callback_data نامعتبر: %s", query.data)
             await query.edit_message_text("❌ خطا در پردازش")
             return
         
-        logger.info(f"درخواست مشاهده محصول {product_id} از {user_id}")
+        logger.info("درخواست مشاهده محصول %s از %s", product_id, user_id)
         
         try:
             # دریافت محصول
@@ -277,13 +290,19 @@ class UserHandler:
             else:
                 text += "\n\n❌ <b>ناموجود</b>"
             
+            # محصولاتی که خریداران این محصول هم خریده‌اند
+            also_bought = also_bought_buttons(self.db, [product_id], self.ALSO_BOUGHT_LIMIT)
+            if also_bought:
+                text += "\n\n🤝 <b>خریداران این محصول این‌ها را هم خریده‌اند:</b>"
+                keyboard.extend(also_bought)
+            
             # دکمه بازگشت
             keyboard.append([
                 InlineKeyboardButton("🔙 بازگشت", callback_data="user_products")
             ])
             
-            # ارسال با یا بدون عکس
-            if product['image_file_id']:
+            # ارسال با یا بدون عکس (در بار بالا بدون عکس: آپلود/ارسال عکس کند است)
+            if product['image_file_id'] and not shedding('product_photo'):
                 await query.message.reply_photo(
                     photo=product['image_file_id'],
                     caption=text,
@@ -291,6 +310,14 @@ class UserHandler:
                     parse_mode='HTML'
                 )
                 await query.message.delete()
+            elif query.message.photo:
+                # پیام قبلی عکس دارد (مثلاً از دکمه هم‌خرید)؛ متن آن قابل ویرایش نیست
+                await query.message.reply_text(
+                    text,
+                    reply_markup=InlineKeyboardMarkup(keyboard),
+                    parse_mode='HTML'
+                )
+                await query.message.delete()
             else:
                 await query.edit_message_text(
                     text,
@@ -299,9 +326,9 @@ class UserHandler:
                 )
             
             log_user(user_id, username, "مشاهده محصول", f"ID {product_id}: {product['name']}")
-            
+        
         except Exception as e:
-            logger.error(f"خطا در نمایش محصول: {e}", exc_info=True)
+            logger.error("خطا در نمایش محصول: %s", e, exc_info=True)
             await query.edit_message_text("❌ خطا در نمایش محصول")
             await notify_error(e, "normal", "view_product", user_id)
     
@@ -314,7 +341,7 @@ class UserHandler:
         username = update.effective_user.username
         first_name = update.effective_user.first_name
         
-        logger.debug(f"بازگشت به منوی اصلی: {user_id}")
+        logger.debug("بازگشت به منوی اصلی: %s", user_id)
         
         try:
             text = (
@@ -339,10 +366,25 @@ class UserHandler:
             )
             
             log_user(user_id, username, "بازگشت به منوی اصلی")
-            
+        
         except Exception as e:
-            logger.error(f"خطا در منوی اصلی: {e}", exc_info=True)
+            logger.error("خطا در منوی اصلی: %s", e, exc_info=True)
             await notify_error(e, "low", "main_menu", user_id)
+    
+    async def rebuild_recommendations(self, context: ContextTypes.DEFAULT_TYPE):
+        """job شبانه: بازسازی جدول محصولات هم‌خرید از روی سفارشات"""
+        # import تنبل: NumPy فقط برای این job لازم است
+        from utils.recommendations import build_neighbors
+        
+        # کار سنگین و غیرفوری: تا کاهش بار (حداکثر نیم ساعت) صبر می‌کند
+        await wait_for_capacity(1800)
+        
+        try:
+            stats = await asyncio.to_thread(build_neighbors, self.db)
+            log_event("بازسازی محصولات هم‌خرید", f"{stats['neighbors']} همسایه از {stats['baskets']} سبد")
+        except Exception as e:
+            logger.error("خطا در بازسازی محصولات هم‌خرید: %s", e, exc_info=True)
+            await notify_error(e, "low", "rebuild_recommendations")
 
 
 if __name__ == "__main__":
@@ -4,7 +4,7 @@
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
 from datetime import datetime
-from rate_limiter import action_limit
+from utils.rate_limiter import action_limit
 from states import ENTER_DISCOUNT_CODE
 from keyboards import cancel_keyboard, user_main_keyboard, cart_keyboard
 import json
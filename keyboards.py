@@ -259,6 +259,8 @@ def analytics_menu_keyboard():
         [InlineKeyboardButton("⏰ ساعات شلوغی", callback_data="analytics:hourly")],
         [InlineKeyboardButton("💰 تحلیل درآمد", callback_data="analytics:revenue")],
         [InlineKeyboardButton("📈 نرخ تبدیل", callback_data="analytics:conversion")],
+        [InlineKeyboardButton("👥 ماندگاری کوهورت", callback_data="analytics:cohort")],
+        [InlineKeyboardButton("🎯 بخش‌بندی RFM", callback_data="analytics:rfm")],
     ]
     return InlineKeyboardMarkup(keyboard)
 
@@ -4,7 +4,14 @@
 این فایل مسئول راه‌اندازی و اجرای ربات است
 """
 
+import time
+
+# زمان شروع پروسه برای اندازه‌گیری مدت راه‌اندازی
+_STARTED_AT = time.perf_counter()
+
 import asyncio
+from datetime import time as dtime
+from zoneinfo import ZoneInfo
 from telegram import Update
 from telegram.ext import (
     Application,
@@ -12,15 +19,21 @@ from telegram.ext import (
     CallbackQueryHandler,
     MessageHandler,
     ConversationHandler,
+    TypeHandler,
     filters,
     ContextTypes
 )
 
-from config import config
+from config import get_config
 from database import Database
 from handlers.admin import AdminHandler
 from handlers.user import UserHandler
 from handlers.order import OrderHandler
+from handlers.gate import GateHandler
+from handlers.analytics import AnalyticsHandler
+from handlers.export import ExportHandler
+from handlers.profiler import ProfilerHandler
+from handlers.broadcast import broadcast_start, broadcast_message_received, confirm_broadcast, cancel_broadcast
 
 # Import های اضافی برای handler های جدید
 from states import *
@@ -31,15 +44,26 @@ from utils.logger import (
     log_startup,
     log_shutdown,
     log_event,
-    log_error
+    log_error,
+    shutdown_logging,
+    get_logging_stats
 )
 from utils.error_notifier import (
     init_error_notifier,
     notify_startup,
     notify_shutdown,
-    notify_error
+    notify_error,
+    stop_error_notifier,
+    send_daily_report
 )
-from utils.rate_limiter import RateLimiter
+from utils.rate_limiter import init_rate_limiter
+from utils.state_backend import create_backend, SessionStore
+from utils.chart_renderer import init_chart_renderer
+from utils.event_log import init_event_log, parse_sample_rates
+from utils.event_store import init_event_store, shutdown_event_store
+from utils.metrics import init_metrics, instrument_handlers, MetricsServer, Metrics
+from utils.load_shedder import init_load_shedder
+from utils.webhook import allowed_update_types, webhooks_available
 
 # Logger اصلی
 logger = get_logger('main')
@@ -55,9 +79,34 @@ class ShopBot:
         logger.info("=" * 70)
         
         # بارگذاری تنظیمات
-        self.config = config
+        self.config = get_config()
         logger.info("✅ تنظیمات بارگذاری شد")
         
+        # متریک‌ها قبل از دیتابیس تا زمان‌سنجی کوئری‌ها از ابتدا فعال باشد
+        self.metrics_server = None
+        if self.config.metrics_enabled:
+            self.metrics_server = MetricsServer(
+                init_metrics(), self.config.metrics_host, self.config.metrics_port
+            )
+        
+        # مانیتور lag همیشه اجرا می‌شود؛ کاهش بار فقط اگر فعال باشد
+        self.load_shedder = init_load_shedder(
+            elevated_lag=self.config.lag_elevated_ms / 1000,
+            overloaded_lag=self.config.lag_overloaded_ms / 1000,
+            enabled=self.config.load_shedding_enabled
+        )
+        
+        # لاگ ساختاریافته رویدادها (اختیاری)
+        if self.config.event_log_enabled:
+            init_event_log(
+                replace_text=self.config.event_log_replace_text,
+                path=self.config.event_log_path,
+                sample_rates=parse_sample_rates(self.config.event_log_sample_rates),
+                max_bytes=self.config.event_log_max_mb * 1024 * 1024,
+                backup_count=self.config.event_log_backups,
+                max_age_days=self.config.event_log_max_age_days
+            )
+        
         # راه‌اندازی دیتابیس
         try:
             self.db = Database(self.config.database_path)
@@ -66,39 +115,84 @@ class ShopBot:
             logger.critical(f"❌ خطای بحرانی در دیتابیس: {e}")
             raise
         
+        # نوشتن دسته‌ای رویدادهای کاربران برای گزارش قیف
+        self.event_store = None
+        if self.config.event_store_enabled:
+            self.event_store = init_event_store(self.db, flush_interval=self.config.event_store_flush_seconds)
+        
+        # راه‌اندازی state backend (مشترک بین پروسه‌ها در حالت sqlite)
+        self.state_backend = create_backend(
+            self.config.state_backend,
+            self.config.state_db_path,
+            self.config.rate_limit_max_keys
+        )
+        self.sessions = SessionStore(self.state_backend)
+        
         # راه‌اندازی rate limiter
-        self.rate_limiter = RateLimiter(
+        self.rate_limiter = init_rate_limiter(
             max_per_minute=self.config.max_requests_per_minute,
-            max_per_hour=self.config.max_requests_per_hour
+            max_per_hour=self.config.max_requests_per_hour,
+            max_keys=self.config.rate_limit_max_keys,
+            backend=self.state_backend
         )
         logger.info("✅ Rate Limiter راه‌اندازی شد")
         
-        # راه‌اندازی error notifier
-        if self.config.enable_error_notifications and self.config.admin_ids:
-            try:
-                init_error_notifier(self.config.bot_token, self.config.admin_ids[0])
-                logger.info("✅ Error Notifier راه‌اندازی شد")
-            except Exception as e:
-                logger.warning(f"⚠️  Error Notifier راه‌اندازی نشد: {e}")
+        # راه‌اندازی pool رندر نمودار (قبل از شروع event loop)
+        self.chart_renderer = init_chart_renderer(
+            max_workers=self.config.chart_workers,
+            max_concurrent=self.config.max_concurrent_charts
+        )
         
         # راه‌اندازی handlers
         self.admin_handler = AdminHandler(self.db, self.config, self.rate_limiter)
         self.user_handler = UserHandler(self.db, self.config, self.rate_limiter)
-        self.order_handler = OrderHandler(self.db, self.config, self.rate_limiter)
+        self.order_handler = OrderHandler(self.db, self.config, self.rate_limiter, self.sessions)
+        self.gate_handler = GateHandler(self.db, self.config, self.rate_limiter)
+        self.analytics_handler = AnalyticsHandler(
+            self.db, self.config, self.rate_limiter, self.chart_renderer
+        )
+        self.export_handler = ExportHandler(self.db, self.config, self.rate_limiter)
+        self.profiler_handler = ProfilerHandler(self.db, self.config, self.rate_limiter)
         logger.info("✅ تمام Handler ها آماده هستند")
         
         # ساخت Application
-        self.app = Application.builder().token(self.config.bot_token).build()
+        builder = Application.builder().token(self.config.bot_token)
+        if self.config.bot_api_base_url:
+            builder.base_url(f"{self.config.bot_api_base_url}/bot")
+            builder.base_file_url(f"{self.config.bot_api_base_url}/file/bot")
+        self.app = builder.build()
         
         # 🔥 ذخیره database در bot_data
         self.app.bot_data['db'] = self.db
+        self.app.bot_data['config'] = self.config
         
         logger.info("✅ Application تلگرام ساخته شد")
         
+        # راه‌اندازی error notifier روی همان bot و connection pool برنامه
+        if self.config.enable_error_notifications and self.config.admin_ids:
+            try:
+                init_error_notifier(
+                    self.app.bot,
+                    self.config.admin_ids[0],
+                    flush_interval=self.config.error_digest_seconds,
+                    stats_path=self.config.error_stats_path
+                )
+                logger.info("✅ Error Notifier راه‌اندازی شد")
+            except Exception as e:
+                logger.warning(f"⚠️  Error Notifier راه‌اندازی نشد: {e}")
+        
         # ثبت handler ها
         self._register_handlers()
         logger.info("✅ Handler ها ثبت شدند")
         
+        # زمان‌سنجی همه handler ها با یک wrapper (بدون تغییر در خود handler ها)
+        if self.metrics_server is not None:
+            instrument_handlers(self.app)
+            self.metrics_server.registry.add_collector(self._collect_metrics)
+        
+        # ثبت job های زمان‌بندی شده
+        self._register_jobs()
+        
         logger.info("=" * 70)
         logger.info("✅ ربات با موفقیت راه‌اندازی شد و آماده دریافت پیام است!")
         logger.info("=" * 70)
@@ -107,10 +201,28 @@ class ShopBot:
         """ثبت تمام handler های ربات"""
         logger.info("در حال ثبت handler ها...")
         
+        # ============ دروازه (rate limit + بلاک) قبل از همه handler ها ============
+        self.app.add_handler(
+            TypeHandler(Update, self.gate_handler.check),
+            group=GateHandler.GROUP
+        )
+        logger.debug("✅ Gate handler ثبت شد")
+        
         # ============ Command handlers ============
         self.app.add_handler(CommandHandler("start", self.user_handler.start))
         self.app.add_handler(CommandHandler("help", self.user_handler.help_command))
         self.app.add_handler(CommandHandler("admin", self.admin_handler.admin_panel))
+        self.app.add_handler(CommandHandler("block", self.gate_handler.block_command))
+        self.app.add_handler(CommandHandler("unblock", self.gate_handler.unblock_command))
+        self.app.add_handler(CommandHandler("top_talkers", self.gate_handler.top_talkers))
+        self.app.add_handler(CommandHandler("analytics", self.analytics_handler.send_analytics_menu))
+        self.app.add_handler(CommandHandler("rebuild_rollups", self.analytics_handler.rebuild_rollups))
+        self.app.add_handler(CommandHandler("digest", self.analytics_handler.digest_command))
+        self.app.add_handler(CommandHandler("restock", self.analytics_handler.restock_command))
+        self.app.add_handler(CommandHandler("funnel", self.analytics_handler.funnel_command))
+        self.app.add_handler(CommandHandler("export_orders", self.export_handler.export_orders))
+        self.app.add_handler(CommandHandler("export_users", self.export_handler.export_users))
+        self.app.add_handler(CommandHandler("profile", self.profiler_handler.profile_command))
         logger.debug("✅ Command handlers ثبت شدند")
         
         # ============ Admin Callback handlers ============
@@ -134,8 +246,24 @@ class ShopBot:
             self.admin_handler.full_stats,
             pattern="^admin_full_stats$"
         ))
+        self.app.add_handler(CallbackQueryHandler(
+            self.analytics_handler.handle_analytics_report,
+            pattern="^analytics:"
+        ))
         logger.debug("✅ Admin callback handlers ثبت شدند")
         
+        # ============ پیام همگانی (قبل از message handler های افزودن محصول) ============
+        self.app.add_handler(ConversationHandler(
+            entry_points=[MessageHandler(filters.TEXT & filters.Regex("^📢 پیام همگانی$"), broadcast_start)],
+            states={
+                BROADCAST_MESSAGE: [MessageHandler(~filters.COMMAND, broadcast_message_received)],
+            },
+            fallbacks=[]
+        ))
+        self.app.add_handler(CallbackQueryHandler(confirm_broadcast, pattern="^confirm_broadcast$"))
+        self.app.add_handler(CallbackQueryHandler(cancel_broadcast, pattern="^cancel_broadcast$"))
+        logger.debug("✅ Broadcast handlers ثبت شدند")
+        
         # ============ User Callback handlers ============
         self.app.add_handler(CallbackQueryHandler(
             self.user_handler.show_products,
@@ -277,32 +405,106 @@ class ShopBot:
         except Exception as e:
             logger.error(f"خطا در ارسال پیام خطا به کاربر: {e}")
     
+    def _register_jobs(self):
+        """ثبت job های زمان‌بندی شده (نیازمند python-telegram-bot[job-queue])"""
+        if self.app.job_queue is None:
+            logger.warning("⚠️  JobQueue در دسترس نیست؛ گزارش‌های شبانه غیرفعال هستند")
+            return
+        
+        hour, minute = self.config.nightly_report_hour_minute
+        nightly = dtime(hour, minute, tzinfo=ZoneInfo(self.config.timezone))
+        
+        self.app.job_queue.run_daily(self.analytics_handler.nightly_reports, time=nightly, name="nightly_reports")
+        self.app.job_queue.run_daily(
+            self.user_handler.rebuild_recommendations, time=nightly, name="nightly_recommendations"
+        )
+        
+        # گزارش روزانه خطاها (آمار آن در فایل ذخیره می‌شود و با restart صفر نمی‌شود)
+        if self.config.enable_error_notifications:
+            self.app.job_queue.run_daily(self._send_error_report, time=nightly, name="daily_error_report")
+        
+        # اولین اجرا روی دیتابیس بدون جدول هم‌خرید، بدون انتظار تا شب
+        if not self.db.has_product_neighbors():
+            self.app.job_queue.run_once(self.user_handler.rebuild_recommendations, when=30)
+        
+        logger.info(f"✅ job های شبانه برای ساعت {self.config.nightly_report_time} زمان‌بندی شدند")
+    
+    async def _send_error_report(self, context: ContextTypes.DEFAULT_TYPE):
+        """job روزانه: گزارش خطاهای 24 ساعت گذشته"""
+        await send_daily_report()
+    
+    def _collect_metrics(self, registry: Metrics):
+        """مقادیری که فقط هنگام scrape خوانده می‌شوند"""
+        cache = self.analytics_handler.report_cache.get_stats()
+        registry.set_counter('bot_report_cache_hits_total', cache['hits'])
+        registry.set_counter('bot_report_cache_misses_total', cache['misses'])
+        
+        logging_stats = get_logging_stats()
+        registry.set_gauge('bot_log_queue_size', logging_stats['queued'])
+        registry.set_counter('bot_log_dropped_total', logging_stats['dropped'])
+        
+        if self.event_store is not None:
+            store = self.event_store.get_stats()
+            registry.set_gauge('bot_event_store_pending', store['pending'])
+            registry.set_counter('bot_event_store_dropped_total', store['dropped'])
+    
     async def post_init(self, app: Application):
         """عملیات بعد از راه‌اندازی"""
         logger.info("🎯 اجرای post_init...")
         
-        # ارسال نوتیفیکیشن راه‌اندازی
-        if self.config.enable_error_notifications:
+        self.load_shedder.start()
+        
+        if self.metrics_server is not None:
             try:
-                await notify_startup()
-                logger.info("✅ نوتیفیکیشن راه‌اندازی ارسال شد")
-            except Exception as e:
-                logger.warning(f"⚠️  خطا در ارسال نوتیفیکیشن راه‌اندازی: {e}")
+                await self.metrics_server.start()
+            except OSError as e:
+                logger.error(f"❌ endpoint متریک‌ها راه‌اندازی نشد: {e}")
+        
+        # ارسال نوتیفیکیشن راه‌اندازی در پس‌زمینه تا شروع polling منتظر آن نماند
+        if self.config.enable_error_notifications:
+            app.create_task(self._send_startup_notification())
         
         log_startup()
         log_event("ربات راه‌اندازی شد", f"PID: {asyncio.current_task().get_name()}")
+        
+        startup_ms = (time.perf_counter() - _STARTED_AT) * 1000
+        logger.info(f"⏱️  زمان راه‌اندازی تا آماده دریافت آپدیت: {startup_ms:.0f}ms")
+        log_event("زمان راه‌اندازی", f"{startup_ms:.0f}ms")
     
-    async def post_shutdown(self, app: Application):
-        """عملیات بعد از خاموش شدن"""
-        logger.info("🛑 اجرای post_shutdown...")
+    async def _send_startup_notification(self):
+        """ارسال نوتیفیکیشن راه‌اندازی"""
+        try:
+            await notify_startup()
+            logger.info("✅ نوتیفیکیشن راه‌اندازی ارسال شد")
+        except Exception as e:
+            logger.warning(f"⚠️  خطا در ارسال نوتیفیکیشن راه‌اندازی: {e}")
+    
+    async def post_stop(self, app: Application):
+        """عملیات بعد از توقف (bot هنوز باز است)"""
+        logger.info("🛑 اجرای post_stop...")
         
-        # ارسال نوتیفیکیشن خاموش شدن
+        # ارسال خطاهای باقی‌مانده و نوتیفیکیشن خاموش شدن؛ بعد از shutdown
+        # connection pool مشترک Application.bot بسته شده است
         if self.config.enable_error_notifications:
             try:
+                await stop_error_notifier()
                 await notify_shutdown()
                 logger.info("✅ نوتیفیکیشن خاموش شدن ارسال شد")
             except Exception as e:
                 logger.warning(f"⚠️  خطا در ارسال نوتیفیکیشن خاموش شدن: {e}")
+    
+    async def post_shutdown(self, app: Application):
+        """عملیات بعد از خاموش شدن"""
+        logger.info("🛑 اجرای post_shutdown...")
+        
+        await self.load_shedder.stop()
+        
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+        
+        self.chart_renderer.shutdown()
+        shutdown_event_store()
+        self.state_backend.close()
         
         log_shutdown()
         log_event("ربات خاموش شد")
@@ -310,18 +512,38 @@ class ShopBot:
     def run(self):
         """اجرای ربات"""
         try:
-            logger.info("▶️  شروع polling...")
-            
-            # اضافه کردن post_init و post_shutdown
+            # اضافه کردن post_init، post_stop و post_shutdown
             self.app.post_init = self.post_init
+            self.app.post_stop = self.post_stop
             self.app.post_shutdown = self.post_shutdown
             
-            # اجرا
-            self.app.run_polling(
-                allowed_updates=Update.ALL_TYPES,
-                drop_pending_updates=True
-            )
+            # فقط انواع آپدیتی که handler ها پردازش می‌کنند
+            allowed_updates = allowed_update_types(self.app)
+            logger.info(f"📨 انواع آپدیت: {', '.join(allowed_updates)}")
             
+            # اجرا
+            if self.config.update_mode == 'webhook':
+                if not webhooks_available():
+                    raise RuntimeError('حالت webhook به pip install "python-telegram-bot[webhooks]" نیاز دارد')
+                
+                logger.info(f"▶️  شروع webhook روی {self.config.webhook_listen}:{self.config.webhook_port}...")
+                self.app.run_webhook(
+                    listen=self.config.webhook_listen,
+                    port=self.config.webhook_port,
+                    url_path=self.config.webhook_path.strip('/'),
+                    webhook_url=self.config.webhook_url,
+                    secret_token=self.config.webhook_secret_token,
+                    max_connections=self.config.webhook_max_connections,
+                    allowed_updates=allowed_updates,
+                    drop_pending_updates=True
+                )
+            else:
+                logger.info("▶️  شروع polling...")
+                self.app.run_polling(
+                    allowed_updates=allowed_updates,
+                    drop_pending_updates=True
+                )
+        
         except KeyboardInterrupt:
             logger.info("⌨️  دریافت سیگنال توقف از کیبورد")
             log_event("ربات توسط کاربر متوقف شد", "KeyboardInterrupt")
@@ -341,13 +563,18 @@ def main():
         # ساخت و اجرای ربات
         bot = ShopBot()
         bot.run()
-        
+    
     except Exception as e:
         logger.critical("=" * 70)
         logger.critical("💥 خطای بحرانی!")
         logger.critical(f"خطا: {type(e).__name__}: {e}")
         logger.critical("=" * 70)
         raise
+    
+    finally:
+        # نوشتن رویدادها و لاگ‌های باقی‌مانده در صف قبل از خروج
+        shutdown_event_store()
+        shutdown_logging()
 
 
 if __name__ == "__main__":
@@ -14,19 +14,36 @@ from .logger import (
     log_event,
     log_security,
     log_startup,
-    log_shutdown
+    log_shutdown,
+    shutdown_logging,
+    get_logging_stats,
+    LogSampler
 )
 
 from .error_notifier import (
     init_error_notifier,
     notify_error,
+    stop_error_notifier,
     notify_startup,
     notify_shutdown,
     send_daily_report
 )
 
 from .validation import Validator
-from .rate_limiter import RateLimiter
+from .rate_limiter import (
+    RateLimiter,
+    RatePolicy,
+    init_rate_limiter,
+    rate_limit,
+    action_limit
+)
+from .state_backend import (
+    StateBackend,
+    MemoryBackend,
+    SQLiteBackend,
+    SessionStore,
+    create_backend
+)
 
 __all__ = [
     # Logger
@@ -40,10 +57,14 @@ __all__ = [
     'log_security',
     'log_startup',
     'log_shutdown',
+    'shutdown_logging',
+    'get_logging_stats',
+    'LogSampler',
     
     # Error Notifier
     'init_error_notifier',
     'notify_error',
+    'stop_error_notifier',
     'notify_startup',
     'notify_shutdown',
     'send_daily_report',
@@ -53,4 +74,15 @@ __all__ = [
     
     # Rate Limiter
     'RateLimiter',
+    'RatePolicy',
+    'init_rate_limiter',
+    'rate_limit',
+    'action_limit',
+    
+    # State Backend
+    'StateBackend',
+    'MemoryBackend',
+    'SQLiteBackend',
+    'SessionStore',
+    'create_backend',
 ]
@@ -0,0 +1,498 @@
+"""
+رندر نمودارها خارج از event loop
+
+ویژگی‌ها:
+- رندر matplotlib در ProcessPoolExecutor تا ربات برای بقیه کاربران قفل نشود
+- worker های گرم: matplotlib و فونت‌ها یک بار در هر پروسه بارگذاری می‌شوند
+- ورودی فقط داده ساده (لیست/دیکشنری) و خروجی بایت‌های PNG
+- سقف تعداد رندرهای همزمان با Semaphore
+"""
+
+import asyncio
+import io
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from utils.logger import get_logger
+
+logger = get_logger('chart_renderer')
+
+# ماژول‌های matplotlib داخل هر worker (در پروسه اصلی import نمی‌شوند)
+_plt = None
+_mdates = None
+
+
+def _init_worker():
+    """مقداردهی worker: import و گرم کردن matplotlib"""
+    global _plt, _mdates
+    
+    import matplotlib
+    matplotlib.use('Agg')  # برای استفاده در محیط بدون GUI
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+    
+    # تنظیم فونت
+    plt.rcParams['font.family'] = 'DejaVu Sans'
+    plt.rcParams['axes.unicode_minus'] = False
+    
+    # یک رندر کوچک تا کش فونت و backend ساخته شود
+    fig = plt.figure(figsize=(1, 1))
+    fig.savefig(io.BytesIO(), format='png')
+    plt.close(fig)
+    
+    _plt, _mdates = plt, mdates
+
+
+def _ping() -> int:
+    """برای گرم کردن pool: شناسه پروسه worker"""
+    return os.getpid()
+
+
+def _to_png(fig) -> bytes:
+    """ذخیره figure به PNG و آزاد کردن حافظه آن"""
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=150, bbox_inches='tight')
+    _plt.close(fig)
+    return buf.getvalue()
+
+
+# ==================== نمودارها (داخل worker اجرا می‌شوند) ====================
+
+def sales_chart(data: List[Tuple[str, int, int]], period: str = 'weekly') -> bytes:
+    """نمودار فروش - data: [(date, order_count, total_sales)]"""
+    dates = [datetime.strptime(row[0], '%Y-%m-%d') for row in data]
+    order_counts = [row[1] for row in data]
+    sales = [row[2] / 1000000 for row in data]  # تبدیل به میلیون تومان
+    
+    fig, ax1 = _plt.subplots(figsize=(12, 6))
+    
+    # نمودار تعداد سفارشات
+    color1 = '#3498db'
+    ax1.set_xlabel('Date', fontsize=12)
+    ax1.set_ylabel('Order Count', color=color1, fontsize=12)
+    ax1.plot(dates, order_counts, color=color1, marker='o', linewidth=2, label='Orders')
+    ax1.tick_params(axis='y', labelcolor=color1)
+    ax1.grid(True, alpha=0.3)
+    
+    # نمودار فروش
+    ax2 = ax1.twinx()
+    color2 = '#2ecc71'
+    ax2.set_ylabel('Sales (Million Toman)', color=color2, fontsize=12)
+    ax2.plot(dates, sales, color=color2, marker='s', linewidth=2, label='Sales')
+    ax2.tick_params(axis='y', labelcolor=color2)
+    
+    # فرمت تاریخ
+    date_format = '%m/%d' if period == 'daily' else '%Y-%m-%d'
+    ax1.xaxis.set_major_formatter(_mdates.DateFormatter(date_format))
+    _plt.setp(ax1.xaxis.get_majorticklabels(), rotation=45, ha='right')
+    
+    # عنوان
+    period_title = {'daily': 'Daily', 'weekly': 'Weekly', 'monthly': 'Monthly'}
+    ax1.set_title(f'{period_title.get(period, "")} Sales Report', fontsize=16, fontweight='bold', pad=20)
+    
+    fig.tight_layout()
+    return _to_png(fig)
+
+
+def popular_products_chart(products: List[Tuple[str, int]]) -> bytes:
+    """نمودار محبوب‌ترین محصولات - products: [(name, quantity)]"""
+    names = [p[0][:20] + '...' if len(p[0]) > 20 else p[0] for p in products]
+    counts = [p[1] for p in products]
+    
+    fig, ax = _plt.subplots(figsize=(12, 8))
+    
+    colors = _plt.cm.viridis([i / len(names) for i in range(len(names))])
+    bars = ax.barh(names, counts, color=colors, edgecolor='black', linewidth=1.5)
+    
+    ax.set_xlabel('Quantity Sold', fontsize=12, fontweight='bold')
+    ax.set_title('Top 10 Popular Products', fontsize=16, fontweight='bold', pad=20)
+    ax.grid(axis='x', alpha=0.3, linestyle='--')
+    
+    # اضافه کردن مقادیر روی میله‌ها
+    for bar, count in zip(bars, counts):
+        ax.text(count + max(counts) * 0.01, bar.get_y() + bar.get_height() / 2,
+                f'{count}', va='center', fontsize=10, fontweight='bold')
+    
+    fig.tight_layout()
+    return _to_png(fig)
+
+
+def hourly_orders_chart(data: List[Tuple[str, int]]) -> bytes:
+    """نمودار ساعات شلوغی - data: [(hour 'HH', count)]"""
+    # ایجاد لیست کامل 24 ساعته
+    hours_dict = {str(i).zfill(2): 0 for i in range(24)}
+    for hour, count in data:
+        hours_dict[hour] = count
+    
+    hours = list(range(24))
+    counts = [hours_dict[str(h).zfill(2)] for h in hours]
+    
+    fig, ax = _plt.subplots(figsize=(14, 6))
+    
+    colors = ['#e74c3c' if c == max(counts) else '#3498db' for c in counts]
+    bars = ax.bar(hours, counts, color=colors, edgecolor='black', linewidth=1.5, alpha=0.8)
+    
+    ax.set_xlabel('Hour of Day', fontsize=12, fontweight='bold')
+    ax.set_ylabel('Number of Orders', fontsize=12, fontweight='bold')
+    ax.set_title('Peak Hours for Orders (Last 30 Days)', fontsize=16, fontweight='bold', pad=20)
+    ax.set_xticks(hours)
+    ax.set_xticklabels([f'{h:02d}:00' for h in hours], rotation=45, ha='right')
+    ax.grid(axis='y', alpha=0.3, linestyle='--')
+    
+    # خط میانگین
+    avg = sum(counts) / len(counts)
+    ax.axhline(y=avg, color='orange', linestyle='--', linewidth=2, label=f'Average: {avg:.1f}')
+    ax.legend()
+    
+    # اضافه کردن مقادیر روی میله‌ها
+    for bar, count in zip(bars, counts):
+        if count > 0:
+            ax.text(bar.get_x() + bar.get_width() / 2, bar.get_height() + max(counts) * 0.01,
+                    f'{int(count)}', ha='center', va='bottom', fontsize=9, fontweight='bold')
+    
+    fig.tight_layout()
+    return _to_png(fig)
+
+
+def revenue_chart(data: List[Tuple[str, int, int, int]]) -> bytes:
+    """نمودار درآمد - data: [(date, gross, discount, net)]"""
+    dates = [datetime.strptime(row[0], '%Y-%m-%d') for row in data]
+    gross = [row[1] / 1000000 for row in data]
+    net = [row[3] / 1000000 for row in data]
+    
+    fig, ax = _plt.subplots(figsize=(14, 7))
+    
+    ax.plot(dates, gross, marker='o', linewidth=2, label='Gross Revenue', color='#3498db')
+    ax.plot(dates, net, marker='s', linewidth=2, label='Net Revenue', color='#2ecc71')
+    ax.fill_between(dates, gross, net, alpha=0.2, color='#e74c3c', label='Discounts')
+    
+    ax.set_xlabel('Date', fontsize=12, fontweight='bold')
+    ax.set_ylabel('Revenue (Million Toman)', fontsize=12, fontweight='bold')
+    ax.set_title('Revenue Analysis', fontsize=16, fontweight='bold', pad=20)
+    ax.legend(loc='upper left', fontsize=11)
+    ax.grid(True, alpha=0.3, linestyle='--')
+    
+    ax.xaxis.set_major_formatter(_mdates.DateFormatter('%Y-%m-%d'))
+    _plt.setp(ax.xaxis.get_majorticklabels(), rotation=45, ha='right')
+    
+    fig.tight_layout()
+    return _to_png(fig)
+
+
+def conversion_chart(data: Dict[str, Any]) -> bytes:
+    """نمودار نرخ تبدیل - data: خروجی Database.get_conversion_stats"""
+    fig, (ax1, ax2) = _plt.subplots(1, 2, figsize=(14, 6))
+    
+    # نمودار دایره‌ای - کاربران
+    ax1.pie(
+        [data['buyers'], data['non_buyers']],
+        explode=(0.1, 0),
+        labels=['Buyers', 'Non-Buyers'],
+        colors=['#2ecc71', '#e74c3c'],
+        autopct='%1.1f%%', shadow=True, startangle=90,
+        textprops={'fontsize': 12, 'fontweight': 'bold'}
+    )
+    ax1.set_title(f'User Conversion Rate\n{data["conversion_rate"]:.1f}% converted',
+                  fontsize=14, fontweight='bold', pad=20)
+    
+    # نمودار میله‌ای - آمار
+    categories = ['Total\nUsers', 'Buyers', 'Total\nOrders']
+    values = [data['total_users'], data['buyers'], data['total_orders']]
+    colors = ['#3498db', '#2ecc71', '#f39c12']
+    
+    bars = ax2.bar(categories, values, color=colors, edgecolor='black', linewidth=2, alpha=0.8)
+    ax2.set_ylabel('Count', fontsize=12, fontweight='bold')
+    ax2.set_title(f'Statistics Overview\nRepeat Rate: {data["repeat_rate"]:.2f} orders/buyer',
+                  fontsize=14, fontweight='bold', pad=20)
+    ax2.grid(axis='y', alpha=0.3, linestyle='--')
+    
+    # اضافه کردن مقادیر
+    for bar, value in zip(bars, values):
+        ax2.text(bar.get_x() + bar.get_width() / 2, bar.get_height() + max(values) * 0.02,
+                 f'{int(value)}', ha='center', va='bottom', fontsize=12, fontweight='bold')
+    
+    fig.tight_layout()
+    return _to_png(fig)
+
+
+def cohort_chart(data: Dict[str, Any]) -> bytes:
+    """نقشه حرارتی ماندگاری کوهورت - data: خروجی cohort_retention"""
+    import numpy as np
+    
+    cohorts = data['cohorts']
+    retention = np.array(
+        [[np.nan if v is None else v for v in row] for row in data['retention']],
+        dtype=float
+    )
+    
+    fig, ax = _plt.subplots(figsize=(14, max(4, len(cohorts) * 0.6 + 2)))
+    
+    image = ax.imshow(np.ma.masked_invalid(retention), cmap='YlGnBu', vmin=0, vmax=100, aspect='auto')
+    fig.colorbar(image, ax=ax, label='Retention %')
+    
+    ax.set_xticks(range(retention.shape[1]))
+    ax.set_xticklabels([f'M{i}' for i in range(retention.shape[1])])
+    ax.set_yticks(range(len(cohorts)))
+    ax.set_yticklabels([f'{c} ({n})' for c, n in zip(cohorts, data['sizes'])])
+    ax.set_xlabel('Months Since First Order', fontsize=12, fontweight='bold')
+    ax.set_ylabel('Cohort (customers)', fontsize=12, fontweight='bold')
+    ax.set_title('Cohort Retention', fontsize=16, fontweight='bold', pad=20)
+    
+    # مقدار هر خانه
+    for (i, j), value in np.ndenumerate(retention):
+        if not np.isnan(value):
+            ax.text(j, i, f'{value:.0f}', ha='center', va='center', fontsize=8,
+                    color='white' if value > 60 else 'black')
+    
+    fig.tight_layout()
+    return _to_png(fig)
+
+
+def rfm_chart(data: Dict[str, Any]) -> bytes:
+    """نمودار بخش‌های RFM - data: خروجی rfm_segments"""
+    segments = [s for s in data['segments'] if s['customers'] > 0]
+    names = [s['name'] for s in segments]
+    customers = [s['customers'] for s in segments]
+    revenue = [s['revenue'] / 1000000 for s in segments]
+    
+    fig, (ax1, ax2) = _plt.subplots(1, 2, figsize=(14, 6))
+    colors = _plt.cm.Set2(range(len(names)))
+    
+    ax1.barh(names, customers, color=colors, edgecolor='black')
+    ax1.invert_yaxis()
+    ax1.set_xlabel('Customers', fontsize=12, fontweight='bold')
+    ax1.set_title(f'Customers per Segment (total {data["customers"]})', fontsize=14, fontweight='bold')
+    ax1.grid(axis='x', alpha=0.3, linestyle='--')
+    ax1.margins(x=0.2)
+    
+    ax2.barh(names, revenue, color=colors, edgecolor='black')
+    ax2.invert_yaxis()
+    ax2.set_xlabel('Revenue (Million Toman)', fontsize=12, fontweight='bold')
+    ax2.set_title('Revenue per Segment', fontsize=14, fontweight='bold')
+    ax2.grid(axis='x', alpha=0.3, linestyle='--')
+    
+    # تازگی و تعداد سفارش میانگین کنار هر میله
+    for i, segment in enumerate(segments):
+        ax1.text(customers[i], i, f"  {segment['avg_recency_days']:.0f}d / {segment['avg_orders']:.1f}x",
+                 va='center', fontsize=9)
+    
+    fig.tight_layout()
+    return _to_png(fig)
+
+
+CHARTS: Dict[str, Callable[..., bytes]] = {
+    'sales': sales_chart,
+    'popular': popular_products_chart,
+    'hourly': hourly_orders_chart,
+    'revenue': revenue_chart,
+    'conversion': conversion_chart,
+    'cohort': cohort_chart,
+    'rfm': rfm_chart,
+}
+
+
+def _render(kind: str, *args) -> bytes:
+    """نقطه ورود worker: رندر یک نمودار"""
+    if _plt is None:
+        _init_worker()
+    return CHARTS[kind](*args)
+
+
+# ==================== Pool ====================
+
+class ChartRenderer:
+    """مدیریت pool پروسه‌های رندر نمودار"""
+    
+    def __init__(self, max_workers: int = 2, max_concurrent: int = 2, timeout: float = 60):
+        """
+        Args:
+            max_workers: تعداد پروسه‌های رندر
+            max_concurrent: حداکثر رندر همزمان (بقیه در صف منتظر می‌مانند)
+            timeout: حداکثر زمان یک رندر (ثانیه)
+        """
+        self.max_workers = max_workers
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        
+        self.render_count = 0
+        self.error_count = 0
+    
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # fork از پروسه‌ای که thread دارد (صف لاگ، event store، event loop) ممکن است
+        # قفل‌های در دست آن thread ها را به فرزند به ارث بدهد و worker قفل شود؛
+        # forkserver از یک پروسه تک‌thread و تمیز fork می‌کند (در غیر این صورت spawn)
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        return ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context(method),
+            initializer=_init_worker
+        )
+    
+    def _discard_executor(self, executor: ProcessPoolExecutor, terminate: bool = False):
+        """
+        کنار گذاشتن pool خراب/گیر کرده (pool بعدی در render بعدی ساخته می‌شود)
+        
+        Args:
+            terminate: کشتن worker ها؛ shutdown رندری را که در حال اجراست متوقف نمی‌کند
+        """
+        if self._executor is executor:
+            self._executor = None
+        
+        if terminate:
+            # ProcessPoolExecutor تا Python 3.14 راه عمومی برای این کار ندارد
+            for process in list((getattr(executor, '_processes', None) or {}).values()):
+                process.terminate()
+        
+        executor.shutdown(wait=False, cancel_futures=True)
+    
+    def start(self, wait: bool = False):
+        """
+        ساخت pool و گرم کردن worker ها
+        
+        worker ها با forkserver/spawn ساخته می‌شوند، پس صدا زدن از هر thread
+        (از جمله بازسازی pool از داخل render) امن است.
+        
+        Args:
+            wait: منتظر ماندن تا import شدن matplotlib در همه worker ها
+                  (پیش‌فرض خیر تا راه‌اندازی ربات معطل نشود)
+        """
+        if self._executor is not None:
+            return
+        
+        started = time.perf_counter()
+        self._executor = self._create_executor()
+        
+        futures = [self._executor.submit(_ping) for _ in range(self.max_workers)]
+        
+        if not wait:
+            logger.info(f"✅ Chart renderer: {self.max_workers} worker در حال گرم شدن")
+            return
+        
+        pids = {future.result() for future in futures}
+        logger.info(
+            f"✅ Chart renderer: {len(pids)} worker آماده "
+            f"({(time.perf_counter() - started) * 1000:.0f}ms)"
+        )
+    
+    async def render(self, kind: str, *args) -> bytes:
+        """
+        رندر نمودار در worker
+        
+        Args:
+            kind: نوع نمودار (کلید CHARTS)
+            args: داده ساده قابل pickle
+        
+        Returns:
+            بایت‌های PNG
+        """
+        if kind not in CHARTS:
+            raise ValueError(f"نوع نمودار نامعتبر: {kind}")
+        
+        async with self._semaphore:
+            if self._executor is None:
+                await asyncio.to_thread(self.start, True)
+            
+            executor = self._executor
+            loop = asyncio.get_running_loop()
+            started = time.perf_counter()
+            
+            try:
+                png = await asyncio.wait_for(
+                    loop.run_in_executor(executor, _render, kind, *args),
+                    self.timeout
+                )
+            except asyncio.TimeoutError:
+                # wait_for فقط future را لغو می‌کند و worker همچنان مشغول می‌ماند؛
+                # بدون کشتن آن چند رندر گیر کرده کل pool را برای همیشه اشغال می‌کنند
+                self.error_count += 1
+                logger.error(f"❌ رندر {kind} بیش از {self.timeout}s طول کشید، ساخت مجدد pool...")
+                self._discard_executor(executor, terminate=True)
+                raise
+            except BrokenProcessPool:
+                # یکی از worker ها مرده؛ pool بعدی از نو ساخته می‌شود
+                self.error_count += 1
+                logger.error("❌ pool رندر خراب شد، در حال ساخت مجدد...")
+                self._discard_executor(executor)
+                raise
+            except Exception:
+                self.error_count += 1
+                raise
+            
+            self.render_count += 1
+            logger.info(
+                f"📊 نمودار {kind} رندر شد: {len(png) // 1024} KB, "
+                f"{(time.perf_counter() - started) * 1000:.0f}ms"
+            )
+            return png
+    
+    def shutdown(self):
+        """بستن pool"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            logger.info("✅ Chart renderer بسته شد")
+
+
+# نمونه سراسری
+chart_renderer: Optional[ChartRenderer] = None
+
+
+def init_chart_renderer(max_workers: int = 2, max_concurrent: int = 2) -> ChartRenderer:
+    """مقداردهی اولیه و گرم کردن chart renderer سراسری"""
+    global chart_renderer
+    chart_renderer = ChartRenderer(max_workers, max_concurrent)
+    chart_renderer.start()
+    return chart_renderer
+
+
+def get_chart_renderer() -> ChartRenderer:
+    """دریافت renderer سراسری (در صورت نبود، با تنظیمات پیش‌فرض ساخته می‌شود)"""
+    global chart_renderer
+    if chart_renderer is None:
+        chart_renderer = ChartRenderer()
+    return chart_renderer
+
+
+if __name__ == "__main__":
+    # تست: چند رندر همزمان در حالی که event loop آزاد می‌ماند
+    async def _demo():
+        renderer = init_chart_renderer(max_workers=2, max_concurrent=2)
+        
+        data = [(f"2024-01-{day:02d}", day % 5 + 1, (day % 7 + 1) * 1_500_000) for day in range(1, 29)]
+        ticks = 0
+        
+        async def _ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+        
+        ticker = asyncio.create_task(_ticker())
+        started = time.perf_counter()
+        pngs = await asyncio.gather(*(renderer.render('sales', data, 'weekly') for _ in range(6)))
+        elapsed = time.perf_counter() - started
+        ticker.cancel()
+        
+        print(f"{len(pngs)} نمودار، {sum(map(len, pngs)) // 1024} KB در {elapsed:.2f}s")
+        print(f"tick های event loop در این مدت: {ticks} (انتظار ~{int(elapsed / 0.01)})")
+        
+        # timeout: worker گیر کرده کشته و pool از نو ساخته می‌شود
+        renderer.timeout = 0.001
+        try:
+            await renderer.render('sales', data, 'weekly')
+        except asyncio.TimeoutError:
+            print("⏱ timeout، pool کنار گذاشته شد")
+        renderer.timeout = 60
+        png = await renderer.render('sales', data, 'weekly')
+        print(f"بعد از timeout: {len(png) // 1024} KB (خطاها: {renderer.error_count})")
+        renderer.shutdown()
+    
+    asyncio.run(_demo())
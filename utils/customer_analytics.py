@@ -0,0 +1,217 @@
+"""
+تحلیل مشتریان با NumPy: ماندگاری کوهورت و بخش‌بندی RFM
+
+ویژگی‌ها:
+- داده سفارش‌ها با یک کوئری stream شده و مستقیماً به آرایه NumPy تبدیل می‌شود
+- همه گروه‌بندی‌ها برداری هستند (بدون حلقه پایتون روی سفارش‌ها)
+- خروجی فقط داده ساده (لیست/دیکشنری) برای رندر در ChartRenderer
+"""
+
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils.logger import get_logger
+
+logger = get_logger('customer_analytics')
+
+# ترتیب نمایش بخش‌های RFM
+RFM_SEGMENTS = (
+    'Champions',
+    'Loyal',
+    'Potential Loyalists',
+    'New Customers',
+    'At Risk',
+    'Hibernating',
+    'Others',
+)
+
+
+def load_order_arrays(chunks: Iterable[Sequence[Tuple[int, int, int]]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    تبدیل chunk های (user_id, created_ts, amount) به سه آرایه int64
+    
+    Returns:
+        (user_ids, timestamps, amounts)
+    """
+    parts = [np.asarray(chunk, dtype=np.int64).reshape(-1, 3) for chunk in chunks if chunk]
+    
+    if not parts:
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+    
+    data = np.concatenate(parts)
+    return data[:, 0], data[:, 1], data[:, 2]
+
+
+def _month_index(timestamps: np.ndarray) -> np.ndarray:
+    """شماره ماه از 1970-01 برای هر timestamp"""
+    return timestamps.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+
+
+def _month_label(index: int) -> str:
+    return str(np.datetime64(int(index), 'M'))
+
+
+def cohort_retention(
+    user_ids: np.ndarray,
+    timestamps: np.ndarray,
+    max_cohorts: int = 12,
+    max_age: int = 12
+) -> Optional[Dict[str, Any]]:
+    """
+    ماندگاری کوهورت بر اساس ماه اولین سفارش
+    
+    Returns:
+        {'cohorts': [...], 'sizes': [...], 'retention': [[...]]}
+        retention[i][k]: درصد کاربران کوهورت i که در ماه k بعد از اولین خرید سفارش داشته‌اند
+    """
+    if user_ids.size == 0:
+        return None
+    
+    users, inverse = np.unique(user_ids, return_inverse=True)
+    months = _month_index(timestamps)
+    
+    # ماه اولین سفارش هر کاربر
+    first = np.full(users.size, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(first, inverse, months)
+    
+    cohort = first[inverse]
+    age = months - cohort
+    
+    # فقط کوهورت‌های اخیر و سن‌های داخل بازه
+    cohort_ids = np.unique(first)[-max_cohorts:]
+    keep = (age < max_age) & (cohort >= cohort_ids[0])
+    
+    # هر کاربر در هر ماه فقط یک بار شمرده شود
+    active = np.unique(inverse[keep] * max_age + age[keep])
+    active_user = active // max_age
+    active_age = active % max_age
+    
+    row = np.searchsorted(cohort_ids, first[active_user])
+    counts = np.zeros((cohort_ids.size, max_age), dtype=np.int64)
+    np.add.at(counts, (row, active_age), 1)
+    
+    sizes = counts[:, 0]
+    retention = np.round(counts / np.maximum(sizes, 1)[:, None] * 100, 1)
+    
+    # سن‌هایی که هنوز نرسیده‌اند (ماه‌های آینده) خالی بمانند
+    latest = months.max()
+    for i, cohort_id in enumerate(cohort_ids):
+        retention[i, latest - cohort_id + 1:] = np.nan
+    
+    return {
+        'cohorts': [_month_label(c) for c in cohort_ids],
+        'sizes': sizes.tolist(),
+        'retention': [[None if np.isnan(v) else float(v) for v in r] for r in retention]
+    }
+
+
+def _quintile_scores(values: np.ndarray) -> np.ndarray:
+    """امتیاز 1 تا 5 بر اساس پنجک‌ها"""
+    edges = np.quantile(values, [0.2, 0.4, 0.6, 0.8])
+    return np.searchsorted(edges, values, side='right') + 1
+
+
+def rfm_segments(
+    user_ids: np.ndarray,
+    timestamps: np.ndarray,
+    amounts: np.ndarray,
+    now: Optional[float] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    بخش‌بندی RFM (تازگی، تکرار، مبلغ)
+    
+    Returns:
+        {'segments': [{'name', 'customers', 'revenue', 'avg_recency_days', 'avg_orders'}], 'customers': n}
+    """
+    if user_ids.size == 0:
+        return None
+    
+    now = time.time() if now is None else now
+    users, inverse = np.unique(user_ids, return_inverse=True)
+    
+    last = np.zeros(users.size, dtype=np.int64)
+    np.maximum.at(last, inverse, timestamps)
+    
+    recency_days = (now - last) / 86400
+    frequency = np.bincount(inverse)
+    monetary = np.bincount(inverse, weights=amounts)
+    
+    # تازگی کمتر = بهتر، پس امتیاز آن برعکس است
+    r = 6 - _quintile_scores(recency_days)
+    # تعداد سفارش مقادیر تکراری زیادی دارد؛ امتیاز بر اساس رتبه (مثل qcut روی rank)
+    rank = np.argsort(np.argsort(frequency, kind='stable'), kind='stable')
+    f = rank * 5 // users.size + 1
+    m = _quintile_scores(monetary)
+    fm = (f + m) / 2
+    
+    conditions = [
+        (r >= 4) & (fm >= 4),
+        (r >= 3) & (fm >= 3),
+        (r >= 4) & (frequency > 1),
+        (r >= 4),
+        (r <= 2) & (fm >= 3),
+        (r <= 2),
+    ]
+    labels = np.select(conditions, np.arange(len(conditions)), default=len(conditions))
+    
+    customers = np.bincount(labels, minlength=len(RFM_SEGMENTS))
+    revenue = np.bincount(labels, weights=monetary, minlength=len(RFM_SEGMENTS))
+    recency_sum = np.bincount(labels, weights=recency_days, minlength=len(RFM_SEGMENTS))
+    orders_sum = np.bincount(labels, weights=frequency, minlength=len(RFM_SEGMENTS))
+    
+    segments: List[Dict[str, Any]] = []
+    for i, name in enumerate(RFM_SEGMENTS):
+        count = int(customers[i])
+        segments.append({
+            'name': name,
+            'customers': count,
+            'revenue': int(revenue[i]),
+            'avg_recency_days': round(float(recency_sum[i] / count), 1) if count else 0.0,
+            'avg_orders': round(float(orders_sum[i] / count), 2) if count else 0.0
+        })
+    
+    return {'segments': segments, 'customers': int(users.size)}
+
+
+def _load_from_db(db) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    started = time.perf_counter()
+    arrays = load_order_arrays(db.stream_sale_orders())
+    logger.info(f"📥 {arrays[0].size} سفارش در {(time.perf_counter() - started) * 1000:.0f}ms بارگذاری شد")
+    return arrays
+
+
+def cohort_report(db) -> Optional[Dict[str, Any]]:
+    """گزارش کوهورت از روی دیتابیس"""
+    user_ids, timestamps, _ = _load_from_db(db)
+    return cohort_retention(user_ids, timestamps)
+
+
+def rfm_report(db) -> Optional[Dict[str, Any]]:
+    """گزارش RFM از روی دیتابیس"""
+    user_ids, timestamps, amounts = _load_from_db(db)
+    return rfm_segments(user_ids, timestamps, amounts)
+
+
+if __name__ == "__main__":
+    # تست سرعت: 1 میلیون سفارش برای 100 هزار کاربر در 18 ماه
+    rng = np.random.default_rng(42)
+    n_orders, n_users = 1_000_000, 100_000
+    now = time.time()
+    
+    user_ids = rng.integers(1, n_users, n_orders)
+    timestamps = (now - rng.integers(0, 540 * 86400, n_orders)).astype(np.int64)
+    amounts = rng.integers(100_000, 5_000_000, n_orders)
+    
+    started = time.perf_counter()
+    cohorts = cohort_retention(user_ids, timestamps)
+    print(f"cohort: {time.perf_counter() - started:.2f}s, {len(cohorts['cohorts'])} کوهورت")
+    print(f"  {cohorts['cohorts'][0]}: {cohorts['retention'][0][:4]}")
+    
+    started = time.perf_counter()
+    rfm = rfm_segments(user_ids, timestamps, amounts, now)
+    print(f"rfm: {time.perf_counter() - started:.2f}s, {rfm['customers']} مشتری")
+    for segment in rfm['segments']:
+        print(f"  {segment['name']:<20} {segment['customers']:>7} {segment['revenue']:>16,}")
@@ -4,13 +4,18 @@
 ویژگی‌ها:
 - ارسال خطاهای مهم به ادمین
 - دسته‌بندی خطاها (بحرانی، مهم، عادی)
-- جلوگیری از اسپم (throttling)
+- تجمیع خطاها بر اساس fingerprint (نوع + فریم‌های آخر stack) و ارسال
+  دوره‌ای یک پیام خلاصه به جای یک پیام برای هر خطا
 - فرمت زیبا و خوانا
 """
 
 import asyncio
-from datetime import datetime, timedelta
-from typing import Optional, Dict
+import html
+import json
+import os
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
 from telegram import Bot
 from telegram.error import TelegramError
 import traceback
@@ -18,25 +23,104 @@ import traceback
 from .logger import log_error, get_logger
 
 
+# ترتیب شدت خطاها (بالاتر = مهم‌تر)
+SEVERITY_ORDER = {"low": 0, "normal": 1, "high": 2, "critical": 3}
+
+SEVERITY_EMOJI = {
+    "critical": "🔴",
+    "high": "🟠",
+    "normal": "🟡",
+    "low": "🔵"
+}
+
+# سقف طول یک پیام تلگرام (با کمی حاشیه)
+MAX_MESSAGE_LENGTH = 4000
+
+
+def fingerprint(error: BaseException, depth: int = 3) -> Tuple:
+    """
+    اثر انگشت خطا: نوع خطا + depth فریم آخر traceback (فایل، تابع، خط)
+    
+    فقط زنجیره traceback پیمایش می‌شود؛ هیچ متنی فرمت نمی‌شود.
+    """
+    frames = []
+    tb = error.__traceback__
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        frames.append((os.path.basename(code.co_filename), code.co_name, tb.tb_lineno))
+        tb = tb.tb_next
+    
+    return (type(error).__name__, *frames[-depth:])
+
+
+class _DigestEntry:
+    """خطاهای تجمیع شده یک fingerprint در دوره فعلی"""
+    
+    __slots__ = ('error', 'severity', 'context', 'count', 'users', 'first_seen', 'last_seen', 'additional_info')
+    
+    def __init__(self, error: BaseException, severity: str, context: str, additional_info: str):
+        # نمونه خطا برای traceback؛ فقط هنگام ارسال digest فرمت می‌شود
+        self.error = error
+        self.severity = severity
+        self.context = context
+        self.additional_info = additional_info
+        self.count = 0
+        self.users: Set[int] = set()
+        self.first_seen = self.last_seen = datetime.now()
+
+
 class ErrorNotifier:
-    """کلاس اطلاع‌رسانی خطا به ادمین"""
+    """
+    کلاس اطلاع‌رسانی خطا به ادمین
     
-    def __init__(self, bot_token: str, admin_chat_id: int):
+    خطاها بر اساس fingerprint تجمیع و هر flush_interval ثانیه در یک پیام
+    خلاصه (digest) ارسال می‌شوند: تعداد، کاربران و یک traceback نمونه برای
+    هر fingerprint. خطای critical با fingerprint جدید flush را جلو می‌اندازد
+    (حداقل min_flush_gap ثانیه بین دو ارسال).
+    """
+    
+    def __init__(
+        self,
+        bot: Bot,
+        admin_chat_id: int,
+        flush_interval: float = 60,
+        min_flush_gap: float = 10,
+        max_fingerprints: int = 50,
+        max_error_keys: int = 500,
+        stats_path: Optional[str] = None
+    ):
         """
         Args:
-            bot_token: توکن ربات
+            bot: همان Application.bot (یک connection pool برای کل پروسه)
             admin_chat_id: شناسه چت ادمین
+            flush_interval: فاصله ارسال digest (ثانیه)
+            min_flush_gap: حداقل فاصله دو digest حتی برای خطای critical
+            max_fingerprints: سقف fingerprint های منتظر؛ بقیه فقط شمرده می‌شوند
+            max_error_keys: سقف کلیدهای آمار روزانه (LRU)
+            stats_path: فایل JSON آمار روزانه تا بعد از restart از دست نرود
         """
-        self.bot = Bot(token=bot_token)
+        self.bot = bot
         self.admin_chat_id = admin_chat_id
         self.logger = get_logger('error_notifier')
         
-        # برای جلوگیری از اسپم
-        self.last_notification: Dict[str, datetime] = {}
-        self.throttle_seconds = 300  # 5 دقیقه
+        self.flush_interval = flush_interval
+        self.min_flush_gap = min_flush_gap
+        self.max_fingerprints = max_fingerprints
+        
+        # خطاهای منتظر ارسال (صف محدود بر اساس fingerprint)
+        self.pending: Dict[Tuple, _DigestEntry] = {}
+        self.overflow = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_flush = 0.0
         
-        # آمار خطاها
-        self.error_counts: Dict[str, int] = {}
+        # آمار خطاها برای گزارش روزانه (LRU محدود؛ کلیدهای کم‌تکرار قدیمی حذف می‌شوند)
+        self.max_error_keys = max_error_keys
+        self.error_counts: "OrderedDict[str, int]" = OrderedDict()
+        self.evicted = 0
+        self.stats_since = datetime.now()
+        self.stats_path = stats_path
+        self._load_stats()
     
     async def notify(
         self,
@@ -47,7 +131,7 @@ class ErrorNotifier:
         additional_info: str = ""
     ):
         """
-        ارسال نوتیفیکیشن خطا به ادمین
+        ثبت خطا برای digest بعدی (بدون ارسال و بدون فرمت traceback)
         
         Args:
             error: خطای رخ داده
@@ -56,139 +140,223 @@ class ErrorNotifier:
             user_id: شناسه کاربری که خطا برایش رخ داده
             additional_info: اطلاعات اضافی
         """
+        self._count(f"{type(error).__name__}_{context}")
         
-        # چک throttling
-        error_key = f"{type(error).__name__}_{context}"
-        if not self._should_notify(error_key, severity):
-            self.logger.debug(f"خطا throttle شد: {error_key}")
-            return
-        
-        # آماده‌سازی پیام
-        message = self._format_error_message(
-            error, severity, context, user_id, additional_info
-        )
+        key = fingerprint(error)
+        entry = self.pending.get(key)
         
-        # ارسال به ادمین
-        try:
-            await self.bot.send_message(
-                chat_id=self.admin_chat_id,
-                text=message,
-                parse_mode='HTML'
-            )
+        if entry is None:
+            if len(self.pending) >= self.max_fingerprints:
+                self.overflow += 1
+                return
             
-            self.logger.info(f"نوتیفیکیشن خطا ارسال شد: {error_key}")
+            entry = self.pending[key] = _DigestEntry(error, severity, context, additional_info)
             
-            # به‌روزرسانی آمار
-            self.error_counts[error_key] = self.error_counts.get(error_key, 0) + 1
-            
-        except TelegramError as e:
-            self.logger.error(f"خطا در ارسال نوتیفیکیشن: {e}")
-    
-    def _should_notify(self, error_key: str, severity: str) -> bool:
-        """بررسی اینکه آیا باید نوتیفیکیشن ارسال شود یا نه"""
+            if severity == "critical":
+                self._ensure_task()
+                self._wakeup.set()
         
-        # خطاهای بحرانی همیشه ارسال می‌شوند
-        if severity == "critical":
-            return True
+        entry.count += 1
+        entry.last_seen = datetime.now()
+        if user_id and len(entry.users) < 100:
+            entry.users.add(user_id)
+        if SEVERITY_ORDER.get(severity, 1) > SEVERITY_ORDER.get(entry.severity, 1):
+            entry.severity = severity
         
-        # چک آخرین زمان ارسال
-        last_time = self.last_notification.get(error_key)
+        self._ensure_task()
+    
+    def _count(self, error_key: str):
+        """افزایش شمارنده گزارش روزانه"""
+        counts = self.error_counts
+        counts[error_key] = counts.get(error_key, 0) + 1
+        counts.move_to_end(error_key)
         
-        if last_time is None:
-            self.last_notification[error_key] = datetime.now()
-            return True
+        if len(counts) > self.max_error_keys:
+            _, count = counts.popitem(last=False)
+            self.evicted += count
+    
+    def _load_stats(self):
+        """بارگذاری آمار روزانه ذخیره شده (قبل از restart)"""
+        if not self.stats_path or not os.path.exists(self.stats_path):
+            return
         
-        # محاسبه زمان گذشته
-        elapsed = (datetime.now() - last_time).total_seconds()
+        try:
+            with open(self.stats_path, encoding='utf-8') as f:
+                state = json.load(f)
+            
+            self.stats_since = datetime.fromisoformat(state['since'])
+            self.evicted = int(state.get('evicted', 0))
+            self.error_counts.update(state['counts'])
+            self.logger.info("آمار خطاها از %s بارگذاری شد (%s کلید)", self.stats_path, len(self.error_counts))
+        
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self.logger.warning("فایل آمار خطاها نامعتبر است و نادیده گرفته شد: %s", e)
+    
+    def _write_stats(self, state: Dict):
+        tmp_path = f"{self.stats_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, self.stats_path)
+    
+    async def save_stats(self):
+        """ذخیره آمار روزانه (نوشتن اتمیک در thread)"""
+        if not self.stats_path:
+            return
         
-        # خطاهای high بعد از 2 دقیقه
-        if severity == "high" and elapsed >= 120:
-            self.last_notification[error_key] = datetime.now()
-            return True
+        state = {
+            'since': self.stats_since.isoformat(),
+            'evicted': self.evicted,
+            'counts': dict(self.error_counts)
+        }
         
-        # بقیه خطاها بعد از 5 دقیقه
-        if elapsed >= self.throttle_seconds:
-            self.last_notification[error_key] = datetime.now()
-            return True
+        try:
+            await asyncio.to_thread(self._write_stats, state)
+        except OSError as e:
+            self.logger.error("خطا در ذخیره آمار خطاها: %s", e)
+    
+    def _ensure_task(self):
+        """شروع task ارسال digest در اولین خطا (نیازمند event loop فعال)"""
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
         
-        return False
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            
+            # حتی خطای critical هم بیش از یک digest در هر min_flush_gap نمی‌سازد
+            gap = self.min_flush_gap - (loop.time() - self._last_flush)
+            if gap > 0:
+                await asyncio.sleep(gap)
+            
+            try:
+                if await self.flush():
+                    await self.save_stats()
+            except Exception as e:
+                self.logger.error("خطا در ارسال digest خطاها: %s", e)
+            
+            self._last_flush = loop.time()
     
-    def _format_error_message(
-        self,
-        error: Exception,
-        severity: str,
-        context: str,
-        user_id: Optional[int],
-        additional_info: str
-    ) -> str:
-        """فرمت کردن پیام خطا"""
-        
-        # ایموجی بر اساس شدت
-        emoji_map = {
-            "critical": "🔴",
-            "high": "🟠",
-            "normal": "🟡",
-            "low": "🔵"
-        }
-        emoji = emoji_map.get(severity, "⚠️")
+    async def flush(self) -> int:
+        """ارسال digest خطاهای منتظر؛ تعداد fingerprint های ارسال شده"""
+        if not self.pending and not self.overflow:
+            return 0
+        
+        entries, self.pending = self.pending, {}
+        overflow, self.overflow = self.overflow, 0
         
-        # شروع پیام
-        lines = [
-            f"{emoji} <b>خطای جدید!</b>",
-            "",
-            f"🕐 <b>زمان:</b> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-            f"⚡️ <b>شدت:</b> {severity.upper()}",
-        ]
+        for message in self._format_digest(list(entries.values()), overflow):
+            try:
+                await self.bot.send_message(
+                    chat_id=self.admin_chat_id,
+                    text=message,
+                    parse_mode='HTML'
+                )
+            except TelegramError as e:
+                self.logger.error("خطا در ارسال digest خطاها: %s", e)
+                break
         
-        # نوع خطا
-        lines.append(f"❌ <b>نوع خطا:</b> {type(error).__name__}")
+        self.logger.info(
+            "digest خطاها ارسال شد: %s fingerprint، %s خطا",
+            len(entries), sum(e.count for e in entries.values()) + overflow
+        )
+        return len(entries)
+    
+    async def stop(self):
+        """توقف task و ارسال خطاهای باقی‌مانده"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        await self.flush()
+        await self.save_stats()
+    
+    @staticmethod
+    def _format_traceback(error: BaseException) -> str:
+        """5 خط آخر traceback (حداکثر 400 کاراکتر)"""
+        tb_lines = traceback.format_exception(type(error), error, error.__traceback__)
+        tb_short = "".join(tb_lines[-5:])
+        if len(tb_short) > 400:
+            tb_short = tb_short[-400:]
+        return html.escape(tb_short, quote=False)
+    
+    def _format_entry(self, entry: _DigestEntry) -> str:
+        """فرمت یک fingerprint در digest"""
+        emoji = SEVERITY_EMOJI.get(entry.severity, "⚠️")
         
-        # پیام خطا
-        error_msg = str(error)
+        error_msg = str(entry.error)
         if len(error_msg) > 200:
             error_msg = error_msg[:200] + "..."
-        lines.append(f"📝 <b>پیام:</b> {error_msg}")
         
-        # محل رخ دادن
-        if context:
-            lines.append(f"📍 <b>محل:</b> {context}")
+        lines = [f"{emoji} <b>{type(entry.error).__name__}</b> × {entry.count}"]
         
-        # کاربر
-        if user_id:
-            lines.append(f"👤 <b>کاربر:</b> {user_id}")
+        if entry.context:
+            lines.append(f"📍 <b>محل:</b> {html.escape(entry.context, quote=False)}")
+        lines.append(f"📝 <b>پیام:</b> {html.escape(error_msg, quote=False)}")
         
-        # اطلاعات اضافی
-        if additional_info:
-            lines.append(f"ℹ️ <b>اطلاعات:</b> {additional_info}")
+        if entry.users:
+            sample = ", ".join(str(u) for u in list(entry.users)[:5])
+            lines.append(f"👤 <b>کاربران:</b> {len(entry.users)} ({sample})")
         
-        # آمار این خطا
-        error_key = f"{type(error).__name__}_{context}"
-        count = self.error_counts.get(error_key, 0)
-        if count > 0:
-            lines.append(f"📊 <b>تعداد تکرار:</b> {count + 1}")
+        if entry.additional_info:
+            lines.append(f"ℹ️ <b>اطلاعات:</b> {html.escape(entry.additional_info, quote=False)}")
         
-        # Traceback (فقط 5 خط آخر)
-        tb_lines = traceback.format_exception(type(error), error, error.__traceback__)
-        tb_short = "".join(tb_lines[-5:])
-        if len(tb_short) > 500:
-            tb_short = tb_short[-500:]
-        lines.append("")
-        lines.append("<b>🔍 Traceback:</b>")
-        lines.append(f"<pre>{tb_short}</pre>")
+        lines.append(
+            f"🕐 {entry.first_seen.strftime('%H:%M:%S')} - {entry.last_seen.strftime('%H:%M:%S')}"
+        )
+        lines.append(f"<pre>{self._format_traceback(entry.error)}</pre>")
         
         return "\n".join(lines)
     
+    def _format_digest(self, entries: List[_DigestEntry], overflow: int) -> List[str]:
+        """پیام(های) digest؛ مهم‌ترین و پرتکرارترین خطاها اول"""
+        entries.sort(key=lambda e: (SEVERITY_ORDER.get(e.severity, 1), e.count), reverse=True)
+        
+        total = sum(e.count for e in entries) + overflow
+        header = (
+            f"🚨 <b>خلاصه خطاها</b> ({datetime.now().strftime('%Y-%m-%d %H:%M:%S')})\n"
+            f"🔢 {total} خطا در {len(entries)} گروه"
+        )
+        if overflow:
+            header += f"\n⚠️ {overflow} خطای دیگر (سقف گروه‌ها پر بود)"
+        
+        # تقسیم به چند پیام در صورت عبور از سقف طول تلگرام
+        messages = []
+        current = header
+        for entry in entries:
+            block = self._format_entry(entry)
+            if len(current) + len(block) + 2 > MAX_MESSAGE_LENGTH:
+                messages.append(current)
+                current = block
+            else:
+                current += "\n\n" + block
+        messages.append(current)
+        
+        return messages
+    
     async def send_daily_report(self):
         """ارسال گزارش روزانه خطاها"""
         
+        since = self.stats_since.strftime('%Y-%m-%d %H:%M')
+        
         if not self.error_counts:
-            message = "✅ <b>گزارش روزانه</b>\n\nهیچ خطایی در 24 ساعت گذشته ثبت نشده است."
+            message = f"✅ <b>گزارش روزانه</b>\n\nهیچ خطایی از {since} ثبت نشده است."
         else:
             lines = [
                 "📊 <b>گزارش روزانه خطاها</b>",
                 "",
-                f"📅 تاریخ: {datetime.now().strftime('%Y-%m-%d')}",
-                f"🔢 تعداد کل خطاها: {sum(self.error_counts.values())}",
+                f"📅 تاریخ: {datetime.now().strftime('%Y-%m-%d')} (از {since})",
+                f"🔢 تعداد کل خطاها: {sum(self.error_counts.values()) + self.evicted}",
                 "",
                 "<b>🔝 پرتکرارترین خطاها:</b>"
             ]
@@ -201,12 +369,12 @@ class ErrorNotifier:
             )
             
             for i, (error_key, count) in enumerate(sorted_errors[:10], 1):
-                lines.append(f"{i}. {error_key}: {count} بار")
+                lines.append(f"{i}. {html.escape(error_key, quote=False)}: {count} بار")
             
-            message = "\n".join(lines)
+            if self.evicted:
+                lines.append(f"… و {self.evicted} خطای کم‌تکرار دیگر")
             
-            # ریست آمار
-            self.error_counts.clear()
+            message = "\n".join(lines)
         
         try:
             await self.bot.send_message(
@@ -217,6 +385,13 @@ class ErrorNotifier:
             self.logger.info("گزارش روزانه ارسال شد")
         except TelegramError as e:
             self.logger.error(f"خطا در ارسال گزارش روزانه: {e}")
+            return
+        
+        # ریست آمار فقط بعد از ارسال موفق
+        self.error_counts.clear()
+        self.evicted = 0
+        self.stats_since = datetime.now()
+        await self.save_stats()
     
     async def send_startup_notification(self):
         """اطلاع‌رسانی راه‌اندازی ربات"""
@@ -258,10 +433,16 @@ class ErrorNotifier:
 error_notifier: Optional[ErrorNotifier] = None
 
 
-def init_error_notifier(bot_token: str, admin_chat_id: int):
-    """مقداردهی اولیه error notifier"""
+def init_error_notifier(bot: Bot, admin_chat_id: int, **kwargs):
+    """
+    مقداردهی اولیه error notifier
+    
+    Args:
+        bot: Application.bot - ربات جدا با connection pool جدا ساخته نمی‌شود
+        **kwargs: پارامترهای digest و آمار در ErrorNotifier
+    """
     global error_notifier
-    error_notifier = ErrorNotifier(bot_token, admin_chat_id)
+    error_notifier = ErrorNotifier(bot, admin_chat_id, **kwargs)
 
 
 async def notify_error(
@@ -289,6 +470,12 @@ async def notify_error(
             )
 
 
+async def stop_error_notifier():
+    """ارسال خطاهای باقی‌مانده قبل از خاموش شدن"""
+    if error_notifier:
+        await error_notifier.stop()
+
+
 async def notify_startup():
     """نوتیفیکیشن راه‌اندازی"""
     if error_notifier:
@@ -0,0 +1,254 @@
+"""
+لاگ ساختاریافته رویدادها به شکل JSON lines (اختیاری)
+
+ویژگی‌ها:
+- فیلدهای ثابت: ts، event، user_id، handler، latency_ms، order_id (+ فیلدهای اضافه)
+- نمونه‌برداری جدا برای هر رویداد (مثلاً user_action=0.1، security=1)؛
+  نرخ نمونه‌برداری در فیلد sr ذخیره می‌شود تا شمارش‌ها قابل بازسازی باشند
+- نوشتن از طریق صف لاگ (thread جدا) و flush دوره‌ای به جای flush بعد از هر خط
+- فشرده‌سازی gzip هنگام rotation و حذف فایل‌های قدیمی بر اساس تعداد و سن
+
+نمونه خط:
+    {"ts":1718000000.123,"event":"order","user_id":42,"order_id":7,"action":"ثبت سفارش","sr":1}
+"""
+
+import gzip
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import time
+from logging.handlers import RotatingFileHandler
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from utils.logger import get_logger, persian_logger
+
+logger = get_logger('event_log')
+
+
+class GzipRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler با فشرده‌سازی backup ها و flush دوره‌ای
+    
+    Args:
+        max_age_days: backup های قدیمی‌تر از این حذف می‌شوند (0 = فقط بر اساس تعداد)
+        flush_interval: حداقل فاصله flush (ثانیه)؛ نوشتن‌ها در بافر فایل جمع می‌شوند
+    """
+    
+    def __init__(
+        self,
+        filename: str,
+        max_bytes: int,
+        backup_count: int,
+        max_age_days: float = 0,
+        flush_interval: float = 1.0
+    ):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+        self.max_age_days = max_age_days
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        
+        self.namer = lambda name: name + '.gz'
+        self.rotator = self._gzip_rotator
+    
+    @staticmethod
+    def _gzip_rotator(source: str, dest: str):
+        with open(source, 'rb') as src, gzip.open(dest, 'wb', compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(source)
+    
+    def flush(self):
+        # StreamHandler بعد از هر رکورد flush می‌کند؛ اینجا حداکثر یک بار در هر بازه
+        now = time.monotonic()
+        if now - self._last_flush >= self.flush_interval:
+            self._last_flush = now
+            super().flush()
+    
+    def close(self):
+        self._last_flush = 0
+        super().flush()
+        super().close()
+    
+    def doRollover(self):
+        super().doRollover()
+        self._purge_old()
+    
+    def _purge_old(self):
+        """حذف backup های قدیمی‌تر از max_age_days"""
+        if self.max_age_days <= 0:
+            return
+        
+        cutoff = time.time() - self.max_age_days * 86400
+        base = Path(self.baseFilename)
+        
+        for path in base.parent.glob(base.name + '.*.gz'):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+            except OSError:
+                pass
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """یک شیء JSON در هر خط از روی record.fields"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, 'fields', None) or {'event': record.getMessage()}
+        return json.dumps(
+            {'ts': round(record.created, 3), **fields},
+            ensure_ascii=False,
+            separators=(',', ':'),
+            default=str
+        )
+
+
+class EventLog:
+    """sink رویدادهای ساختاریافته"""
+    
+    def __init__(
+        self,
+        path: str = 'logs/events.jsonl',
+        sample_rates: Optional[Dict[str, float]] = None,
+        default_rate: float = 1.0,
+        max_bytes: int = 20 * 1024 * 1024,
+        backup_count: int = 10,
+        max_age_days: float = 14
+    ):
+        self.sample_rates = dict(sample_rates or {})
+        self.default_rate = default_rate
+        self.path = path
+        
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        handler = GzipRotatingFileHandler(path, max_bytes, backup_count, max_age_days)
+        handler.setFormatter(JsonLinesFormatter())
+        
+        # نوشتن از طریق همان صف و thread لاگ‌های متنی
+        self._logger = get_logger('events', log_to_file=False, log_to_console=False, extra_handlers=[handler])
+        self._random = random.random
+        
+        self.emitted = 0
+        self.sampled_out = 0
+        
+        logger.info(
+            "✅ Event log: %s (نمونه‌برداری: %s، پیش‌فرض %s)",
+            path, self.sample_rates or '-', default_rate
+        )
+    
+    def emit(
+        self,
+        event: str,
+        user_id: Optional[int] = None,
+        handler: Optional[str] = None,
+        latency_ms: Optional[float] = None,
+        order_id: Optional[int] = None,
+        **extra: Any
+    ):
+        """ثبت یک رویداد (با توجه به نرخ نمونه‌برداری همان رویداد)"""
+        rate = self.sample_rates.get(event, self.default_rate)
+        if rate < 1.0 and self._random() >= rate:
+            self.sampled_out += 1
+            return
+        
+        fields: Dict[str, Any] = {'event': event}
+        if user_id is not None:
+            fields['user_id'] = user_id
+        if handler is not None:
+            fields['handler'] = handler
+        if latency_ms is not None:
+            fields['latency_ms'] = round(latency_ms, 1)
+        if order_id is not None:
+            fields['order_id'] = order_id
+        fields.update(extra)
+        fields['sr'] = rate
+        
+        self.emitted += 1
+        self._logger.info(event, extra={'fields': fields})
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """آمار sink"""
+        return {
+            'path': self.path,
+            'emitted': self.emitted,
+            'sampled_out': self.sampled_out,
+            'sample_rates': self.sample_rates
+        }
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """'user_action=0.1,security=1' -> {'user_action': 0.1, 'security': 1.0}"""
+    rates = {}
+    for part in spec.split(','):
+        if not part.strip():
+            continue
+        name, _, value = part.partition('=')
+        rate = float(value)
+        if not 0.0 <= rate <= 1.0:
+            raise ValueError(f"نرخ نمونه‌برداری {name} باید بین 0 و 1 باشد")
+        rates[name.strip()] = rate
+    return rates
+
+
+# نمونه سراسری (None = غیرفعال)
+event_log: Optional[EventLog] = None
+
+
+def init_event_log(replace_text: bool = False, **kwargs) -> EventLog:
+    """
+    راه‌اندازی sink رویدادها و اتصال log_user/log_order/log_security به آن
+    
+    Args:
+        replace_text: لاگ‌های متنی همین رویدادها دیگر نوشته نشوند
+        **kwargs: پارامترهای EventLog
+    """
+    global event_log
+    event_log = EventLog(**kwargs)
+    persian_logger.event_sink = event_log
+    persian_logger.events_replace_text = replace_text
+    return event_log
+
+
+def track(event: str, **fields: Any):
+    """
+    ثبت رویداد اگر sink فعال باشد (در غیر این صورت تقریباً بدون هزینه)
+    
+    اگر handler داده نشود، نام تابع فراخواننده استفاده می‌شود.
+    """
+    if event_log is None:
+        return
+    
+    if 'handler' not in fields:
+        fields['handler'] = sys._getframe(1).f_code.co_name
+    
+    event_log.emit(event, **fields)
+
+
+if __name__ == "__main__":
+    # تست: 200 هزار رویداد با rotation کوچک
+    import tempfile
+    from utils.logger import get_logging_stats, shutdown_logging
+    
+    directory = tempfile.mkdtemp(prefix='event_log_')
+    log = init_event_log(
+        path=os.path.join(directory, 'events.jsonl'),
+        sample_rates={'user_action': 0.1},
+        max_bytes=2 * 1024 * 1024,
+        backup_count=3
+    )
+    
+    started = time.perf_counter()
+    for i in range(200_000):
+        track('user_action', user_id=i % 5000, action="مشاهده محصول")
+        if i % 20 == 0:
+            track('order', user_id=i % 5000, order_id=i, latency_ms=12.345, action="ثبت سفارش")
+    elapsed = time.perf_counter() - started
+    dropped = get_logging_stats()['dropped']
+    shutdown_logging()
+    
+    print(f"⏱️  {elapsed:.2f}s | {log.get_stats()} | حذف از صف: {dropped}")
+    for name in sorted(os.listdir(directory)):
+        print(f"  {name}: {os.path.getsize(os.path.join(directory, name)) / 1024:.0f} KB")
+    with open(os.path.join(directory, 'events.jsonl'), encoding='utf-8') as f:
+        print(f"  {f.readline().strip()}")
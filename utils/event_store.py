@@ -0,0 +1,210 @@
+"""
+ذخیره رویدادهای کاربران در جدول events برای گزارش قیف تبدیل
+
+ویژگی‌ها:
+- log_user رویداد را فقط به یک بافر حافظه اضافه می‌کند (بدون I/O در handler)
+- یک thread پس‌زمینه بافر را هر چند ثانیه (یا با پر شدن یک batch)
+  با یک executemany در یک تراکنش می‌نویسد
+- بافر محدود است؛ اگر دیتابیس کند باشد رویدادهای جدید حذف و شمرده می‌شوند
+- قیف با SQL روی ایندکس‌های (event, ts) و (user_id, event, ts) محاسبه می‌شود؛
+  مرحله بعدی هر کاربر با یک seek روی ایندکس دوم پیدا می‌شود
+"""
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.logger import get_logger, persian_logger
+
+logger = get_logger('event_store')
+
+# مراحل قیف خرید: همان action هایی که handler ها به log_user می‌دهند
+FUNNEL_STEPS = (
+    ("مشاهده محصول", "👀 مشاهده محصول"),
+    ("افزودن به سبد", "🛒 افزودن به سبد"),
+    ("ثبت سفارش", "✅ ثبت سفارش"),
+)
+
+
+class EventStore:
+    """
+    نویسنده دسته‌ای رویدادها در دیتابیس
+    
+    Args:
+        db: نمونه Database
+        flush_interval: حداکثر فاصله نوشتن (ثانیه)
+        batch_size: با رسیدن بافر به این اندازه زودتر نوشته می‌شود
+        max_buffer: سقف بافر؛ رویدادهای بیشتر حذف می‌شوند
+    """
+    
+    def __init__(
+        self,
+        db,
+        flush_interval: float = 2.0,
+        batch_size: int = 500,
+        max_buffer: int = 20000
+    ):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        
+        self._buffer: List[Tuple[float, int, str, Optional[str]]] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        
+        self.written = 0
+        self.dropped = 0
+        self.failed_batches = 0
+        
+        self._thread = threading.Thread(target=self._run, name='event-store', daemon=True)
+        self._thread.start()
+        
+        logger.info(
+            "✅ Event store: هر %ss یا %s رویداد (سقف بافر %s)",
+            flush_interval, batch_size, max_buffer
+        )
+    
+    def add(self, user_id: int, event: str, handler: Optional[str] = None):
+        """افزودن رویداد به بافر (بدون I/O)"""
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                return
+            
+            self._buffer.append((time.time(), user_id, event, handler))
+            full = len(self._buffer) >= self.batch_size
+        
+        if full:
+            self._wakeup.set()
+    
+    def _take(self) -> List[Tuple[float, int, str, Optional[str]]]:
+        with self._lock:
+            batch, self._buffer = self._buffer, []
+        return batch
+    
+    def flush(self) -> int:
+        """نوشتن فوری بافر"""
+        batch = self._take()
+        if not batch:
+            return 0
+        
+        try:
+            self.db.insert_events(batch)
+        except Exception as e:
+            # دیتابیس قفل/در دسترس نیست: این batch از دست می‌رود ولی thread ادامه می‌دهد
+            self.failed_batches += 1
+            self.dropped += len(batch)
+            logger.error("خطا در نوشتن %s رویداد: %s", len(batch), e)
+            return 0
+        
+        self.written += len(batch)
+        return len(batch)
+    
+    def _run(self):
+        while not self._stopping:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+    
+    def stop(self):
+        """توقف thread و نوشتن رویدادهای باقی‌مانده"""
+        if self._stopping:
+            return
+        
+        self._stopping = True
+        self._wakeup.set()
+        self._thread.join(timeout=10)
+        self.flush()
+        
+        logger.info("🛑 Event store: %s رویداد نوشته شد، %s حذف شد", self.written, self.dropped)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """آمار نویسنده"""
+        with self._lock:
+            pending = len(self._buffer)
+        
+        return {
+            'pending': pending,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed_batches': self.failed_batches
+        }
+
+
+def funnel_report(db, days: int = 7) -> List[Dict[str, Any]]:
+    """
+    قیف خرید چند روز اخیر
+    
+    Returns:
+        [{'step', 'label', 'users', 'from_previous', 'from_start'}] - درصدها بین 0 و 100
+    """
+    until = time.time()
+    counts = db.get_funnel([step for step, _ in FUNNEL_STEPS], until - days * 86400, until)
+    
+    report = []
+    for i, ((step, label), users) in enumerate(zip(FUNNEL_STEPS, counts)):
+        previous = counts[i - 1] if i > 0 else users
+        report.append({
+            'step': step,
+            'label': label,
+            'users': users,
+            'from_previous': users / previous * 100 if previous else 0.0,
+            'from_start': users / counts[0] * 100 if counts[0] else 0.0
+        })
+    
+    return report
+
+
+# نمونه سراسری (None = غیرفعال)
+event_store: Optional[EventStore] = None
+
+
+def init_event_store(db, **kwargs) -> EventStore:
+    """راه‌اندازی event store و اتصال log_user به آن"""
+    global event_store
+    event_store = EventStore(db, **kwargs)
+    persian_logger.event_store = event_store
+    return event_store
+
+
+def shutdown_event_store():
+    """نوشتن رویدادهای باقی‌مانده (قبل از shutdown_logging)"""
+    global event_store
+    if event_store is not None:
+        persian_logger.event_store = None
+        event_store.stop()
+        event_store = None
+
+
+if __name__ == "__main__":
+    # تست: 300 هزار رویداد برای 20 هزار کاربر و زمان محاسبه قیف
+    import os
+    import random
+    import tempfile
+    from database import Database
+    from utils.logger import shutdown_logging
+    
+    db = Database(os.path.join(tempfile.mkdtemp(prefix='event_store_'), 'shop.db'))
+    store = init_event_store(db, flush_interval=0.5)
+    
+    rng = random.Random(5)
+    started = time.perf_counter()
+    for i in range(300_000):
+        user_id = rng.randrange(20_000)
+        step = 0 if rng.random() < 0.8 else (1 if rng.random() < 0.7 else 2)
+        store.add(user_id, FUNNEL_STEPS[step][0], 'view_product')
+        if i % 1_000 == 0:
+            time.sleep(0.02)   # ترافیک واقعی پیوسته است، نه یک انفجار
+    
+    enqueue = time.perf_counter() - started - 300 * 0.02
+    shutdown_event_store()
+    print(f"افزودن: {enqueue / 300_000 * 1e6:.2f}µs/رویداد | {store.get_stats()}")
+    
+    started = time.perf_counter()
+    for row in funnel_report(db, days=1):
+        print(f"  {row['label']}: {row['users']} "
+              f"({row['from_previous']:.1f}% از قبلی، {row['from_start']:.1f}% از ابتدا)")
+    print(f"قیف در {(time.perf_counter() - started) * 1000:.0f}ms")
+    shutdown_logging()
@@ -0,0 +1,303 @@
+"""
+تشخیص کاربران و الگوهای پرترافیک (Heavy Hitters)
+
+ویژگی‌ها:
+- Count-Min Sketch با حافظه ثابت برای شمارش تقریبی درخواست‌ها در هر بازه
+- نگه‌داری top-k کاربران و الگوهای callback پرتکرار
+- بلاک موقت خودکار کاربرانی که از آستانه بازه عبور کنند
+- مصرف حافظه مستقل از تعداد کاربران متمایز
+"""
+
+import random
+import re
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from utils.logger import get_logger, log_security
+
+logger = get_logger('heavy_hitters')
+
+# عدد اول مرسن برای hash
+_PRIME = (1 << 61) - 1
+
+
+class CountMinSketch:
+    """
+    Count-Min Sketch: شمارش تقریبی با خطای فقط رو به بالا
+    
+    از conservative update استفاده می‌شود (فقط خانه‌هایی که کمتر از تخمین
+    جدید هستند بالا می‌روند) تا خطای ناشی از برخورد hash کمتر شود.
+    """
+    
+    def __init__(self, width: int = 16384, depth: int = 4):
+        """
+        Args:
+            width: تعداد ستون‌های هر سطر (خطا ~ N / width)
+            depth: تعداد توابع hash (احتمال خطا ~ e^-depth)
+        """
+        self.width = width
+        self.depth = depth
+        # خانواده hash دوبه‌دو مستقل: ((a * h + b) mod p) mod width
+        self._hashes = [
+            (random.randrange(1, _PRIME), random.randrange(0, _PRIME))
+            for _ in range(depth)
+        ]
+        self._rows = [array('L', bytes(array('L').itemsize * width)) for _ in range(depth)]
+    
+    def add(self, item: Hashable, count: int = 1) -> int:
+        """افزودن و برگرداندن تخمین جدید"""
+        width = self.width
+        h = hash(item)
+        indexes = [((a * h + b) % _PRIME) % width for a, b in self._hashes]
+        
+        estimate = min(row[i] for row, i in zip(self._rows, indexes)) + count
+        
+        for row, i in zip(self._rows, indexes):
+            if row[i] < estimate:
+                row[i] = estimate
+        
+        return estimate
+    
+    def estimate(self, item: Hashable) -> int:
+        """تخمین تعداد یک آیتم"""
+        width = self.width
+        h = hash(item)
+        return min(
+            row[((a * h + b) % _PRIME) % width]
+            for (a, b), row in zip(self._hashes, self._rows)
+        )
+    
+    def clear(self):
+        """صفر کردن تمام شمارنده‌ها"""
+        for row in self._rows:
+            for i in range(self.width):
+                row[i] = 0
+    
+    @property
+    def memory_bytes(self) -> int:
+        """حجم حافظه شمارنده‌ها"""
+        return sum(row.itemsize * len(row) for row in self._rows)
+
+
+class TopK:
+    """نگه‌داری k آیتم با بیشترین تخمین (همراه با sketch)"""
+    
+    def __init__(self, k: int = 20):
+        self.k = k
+        self._items: Dict[Hashable, int] = {}
+        self._min_count = 0
+    
+    def offer(self, item: Hashable, estimate: int):
+        """پیشنهاد آیتم با تخمین فعلی آن"""
+        items = self._items
+        
+        if item in items:
+            items[item] = estimate
+            return
+        
+        if len(items) < self.k:
+            items[item] = estimate
+            self._min_count = min(items.values())
+            return
+        
+        if estimate <= self._min_count:
+            return
+        
+        # جایگزینی کمترین آیتم
+        weakest = min(items, key=items.get)
+        del items[weakest]
+        items[item] = estimate
+        self._min_count = min(items.values())
+    
+    def most_common(self, n: Optional[int] = None) -> List[Tuple[Hashable, int]]:
+        """لیست مرتب شده آیتم‌ها"""
+        ranked = sorted(self._items.items(), key=lambda x: x[1], reverse=True)
+        return ranked[:n] if n else ranked
+    
+    def clear(self):
+        self._items.clear()
+        self._min_count = 0
+
+
+_DIGITS = re.compile(r'\d+')
+
+
+def normalize_pattern(callback_data: str) -> str:
+    """تبدیل callback_data به الگو (اعداد با # جایگزین می‌شوند)"""
+    return _DIGITS.sub('#', callback_data)[:64]
+
+
+class HeavyHitterDetector:
+    """تشخیص پرترافیک‌ها در بازه‌های زمانی ثابت و بلاک موقت خودکار"""
+    
+    def __init__(
+        self,
+        window_seconds: int = 60,
+        block_threshold: int = 120,
+        block_seconds: int = 900,
+        top_k: int = 20,
+        width: int = 16384,
+        depth: int = 4,
+        max_blocked: int = 10000
+    ):
+        """
+        Args:
+            window_seconds: طول هر بازه شمارش
+            block_threshold: تعداد درخواست یک کاربر در بازه که باعث بلاک موقت می‌شود
+            block_seconds: مدت بلاک موقت
+            top_k: تعداد پرترافیک‌های نگه‌داری شده
+            width, depth: ابعاد Count-Min Sketch
+            max_blocked: سقف تعداد بلاک‌های موقت همزمان
+        """
+        self.window_seconds = window_seconds
+        self.block_threshold = block_threshold
+        self.block_seconds = block_seconds
+        self.max_blocked = max_blocked
+        
+        self._users = CountMinSketch(width, depth)
+        self._patterns = CountMinSketch(width // 4 or 1, depth)
+        self._top_users = TopK(top_k)
+        self._top_patterns = TopK(top_k)
+        
+        self._window_start = time.time()
+        self._window_total = 0
+        
+        # خلاصه بازه قبلی برای گزارش
+        self.last_window: Dict[str, object] = {
+            'start': None,
+            'total': 0,
+            'users': [],
+            'patterns': []
+        }
+        
+        # بلاک‌های موقت: {user_id: expires_at}
+        self._blocked: "OrderedDict[int, float]" = OrderedDict()
+        self.auto_block_count = 0
+        
+        logger.info(
+            f"✅ Heavy hitter detector: {block_threshold} req/{window_seconds}s, "
+            f"sketch {depth}x{width}"
+        )
+    
+    def _rotate(self, now: float):
+        """بستن بازه فعلی و شروع بازه جدید"""
+        self.last_window = {
+            'start': self._window_start,
+            'total': self._window_total,
+            'users': self._top_users.most_common(),
+            'patterns': self._top_patterns.most_common()
+        }
+        
+        self._users.clear()
+        self._patterns.clear()
+        self._top_users.clear()
+        self._top_patterns.clear()
+        
+        self._window_start = now
+        self._window_total = 0
+    
+    def record(self, user_id: int, pattern: Optional[str] = None) -> bool:
+        """
+        ثبت یک درخواست
+        
+        Returns:
+            True اگر کاربر با این درخواست بلاک موقت شد
+        """
+        now = time.time()
+        
+        if now - self._window_start >= self.window_seconds:
+            self._rotate(now)
+        
+        self._window_total += 1
+        
+        estimate = self._users.add(user_id)
+        self._top_users.offer(user_id, estimate)
+        
+        if pattern:
+            self._top_patterns.offer(pattern, self._patterns.add(pattern))
+        
+        if estimate >= self.block_threshold and not self.is_blocked(user_id):
+            self._block(user_id, now, estimate)
+            return True
+        
+        return False
+    
+    def _block(self, user_id: int, now: float, estimate: int):
+        """بلاک موقت کاربر"""
+        self._blocked[user_id] = now + self.block_seconds
+        self._blocked.move_to_end(user_id)
+        
+        while len(self._blocked) > self.max_blocked:
+            self._blocked.popitem(last=False)
+        
+        self.auto_block_count += 1
+        logger.warning(f"بلاک موقت خودکار کاربر {user_id}: ~{estimate} درخواست")
+        log_security(
+            "بلاک موقت خودکار (heavy hitter)",
+            user_id,
+            f"~{estimate} req in {self.window_seconds}s, {self.block_seconds}s block"
+        )
+    
+    def is_blocked(self, user_id: int) -> bool:
+        """آیا کاربر در بلاک موقت است؟"""
+        expires_at = self._blocked.get(user_id)
+        
+        if expires_at is None:
+            return False
+        
+        if expires_at <= time.time():
+            del self._blocked[user_id]
+            return False
+        
+        return True
+    
+    def unblock(self, user_id: int):
+        """حذف بلاک موقت"""
+        self._blocked.pop(user_id, None)
+    
+    def get_report(self, n: int = 10) -> Dict[str, object]:
+        """گزارش پرترافیک‌های بازه فعلی و قبلی"""
+        now = time.time()
+        
+        return {
+            'window_seconds': self.window_seconds,
+            'current': {
+                'start': self._window_start,
+                'total': self._window_total,
+                'users': self._top_users.most_common(n),
+                'patterns': self._top_patterns.most_common(n)
+            },
+            'previous': {
+                'start': self.last_window['start'],
+                'total': self.last_window['total'],
+                'users': self.last_window['users'][:n],
+                'patterns': self.last_window['patterns'][:n]
+            },
+            'blocked': [
+                (user_id, int(expires_at - now))
+                for user_id, expires_at in self._blocked.items()
+                if expires_at > now
+            ][:n],
+            'auto_block_count': self.auto_block_count,
+            'memory_bytes': self._users.memory_bytes + self._patterns.memory_bytes
+        }
+
+
+if __name__ == "__main__":
+    # تست: سیل کاربران یکتا + یک کاربر پرترافیک
+    detector = HeavyHitterDetector(block_threshold=100)
+    
+    for i in range(200_000):
+        detector.record(1_000_000 + i, "product_view_#")
+        if i % 500 == 0:
+            detector.record(42, "add_to_cart_#_#")
+    
+    for _ in range(100):
+        detector.record(42, "add_to_cart_#_#")
+    
+    report = detector.get_report(5)
+    print(f"top users: {report['current']['users']}")
+    print(f"top patterns: {report['current']['patterns']}")
+    print(f"blocked: {report['blocked']}, memory: {report['memory_bytes']} bytes")
@@ -0,0 +1,208 @@
+"""
+اندازه‌گیری تأخیر event loop و کاهش بار تطبیقی (load shedding)
+
+یک task هر interval ثانیه می‌خوابد و دیرکرد بیدار شدنش را اندازه می‌گیرد؛
+این دیرکرد یعنی کارهای دیگر (handler ها، کوئری‌های بلاک‌کننده، لاگ) loop را
+گرفته‌اند. میانگین نمایی (EWMA) آن سطح بار را تعیین می‌کند:
+
+- NORMAL: همه چیز عادی
+- ELEVATED: عکس محصولات ارسال نمی‌شود، گزارش‌های تحلیلی و پیام همگانی
+  و job های شبانه تا کاهش بار عقب می‌افتند
+- OVERLOADED: علاوه بر آن، callback های کم‌اولویت (مرور محصولات، راهنما،
+  ...) در gate با پیام «شلوغ است» پاسخ می‌گیرند تا سبد خرید و ثبت سفارش
+  تأخیر محدودی داشته باشند
+
+برای جلوگیری از نوسان، خروج از هر سطح در نصف آستانه ورود آن است.
+بدون init_load_shedder همه توابع کمکی «بدون کاهش بار» برمی‌گردانند.
+"""
+
+import asyncio
+from typing import Optional
+
+from utils.logger import get_logger
+from utils.metrics import inc, observe, set_gauge
+
+logger = get_logger('load_shedder')
+
+NORMAL = 0
+ELEVATED = 1
+OVERLOADED = 2
+
+LEVEL_NAMES = ('normal', 'elevated', 'overloaded')
+
+
+class LoadShedder:
+    """
+    مانیتور lag و سطح بار
+    
+    Args:
+        interval: فاصله اندازه‌گیری (ثانیه)
+        elevated_lag: آستانه EWMA برای ELEVATED (ثانیه)
+        overloaded_lag: آستانه EWMA برای OVERLOADED (ثانیه)
+        alpha: وزن نمونه جدید در EWMA
+        enabled: اگر False باشد فقط lag اندازه‌گیری و منتشر می‌شود
+    """
+    
+    def __init__(
+        self,
+        interval: float = 0.25,
+        elevated_lag: float = 0.1,
+        overloaded_lag: float = 0.5,
+        alpha: float = 0.3,
+        enabled: bool = True
+    ):
+        self.interval = interval
+        self.thresholds = (0.0, elevated_lag, overloaded_lag)
+        self.alpha = alpha
+        self.enabled = enabled
+        
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.level = NORMAL
+        
+        self._normal: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        """شروع اندازه‌گیری روی event loop فعلی"""
+        loop = asyncio.get_running_loop()
+        self._normal = asyncio.Event()
+        self._normal.set()
+        self._task = loop.create_task(self._run())
+        
+        logger.info(
+            "✅ مانیتور lag: هر %ss، آستانه‌ها %s/%s ثانیه (کاهش بار: %s)",
+            self.interval, self.thresholds[ELEVATED], self.thresholds[OVERLOADED],
+            'فعال' if self.enabled else 'غیرفعال'
+        )
+    
+    async def stop(self):
+        """توقف task و آزاد کردن کارهای منتظر"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        # بدون اندازه‌گیری سطح دیگر به‌روز نمی‌شود؛ کسی نباید تا ابد منتظر بماند
+        if self._normal is not None:
+            self._set_level(NORMAL)
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - expected, 0.0)
+            
+            self.lag = self.alpha * lag + (1 - self.alpha) * self.lag
+            self.max_lag = max(self.max_lag, lag)
+            
+            observe('bot_event_loop_lag_seconds', lag)
+            set_gauge('bot_event_loop_lag_last_seconds', lag)
+            
+            if self.enabled:
+                self._set_level(self._next_level())
+    
+    def _next_level(self) -> int:
+        level = self.level
+        
+        # بالا رفتن: عبور EWMA از آستانه سطح بالاتر
+        while level < OVERLOADED and self.lag >= self.thresholds[level + 1]:
+            level += 1
+        
+        # پایین آمدن: EWMA کمتر از نصف آستانه سطح فعلی
+        while level > NORMAL and self.lag < self.thresholds[level] / 2:
+            level -= 1
+        
+        return level
+    
+    def _set_level(self, level: int):
+        if level == self.level:
+            return
+        
+        previous, self.level = self.level, level
+        set_gauge('bot_load_level', level)
+        
+        if level > previous:
+            logger.warning(
+                "⚠️  بار event loop: %s (lag %.0fms)", LEVEL_NAMES[level], self.lag * 1000
+            )
+        else:
+            logger.info("✅ بار event loop: %s (lag %.0fms)", LEVEL_NAMES[level], self.lag * 1000)
+        
+        if level == NORMAL:
+            self._normal.set()
+        else:
+            self._normal.clear()
+    
+    async def wait_for_capacity(self, timeout: Optional[float] = None) -> bool:
+        """
+        صبر تا برگشت بار به NORMAL
+        
+        Returns:
+            False اگر timeout رسید و بار هنوز بالاست
+        """
+        if self.level == NORMAL or self._normal is None:
+            return True
+        
+        try:
+            await asyncio.wait_for(self._normal.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+
+# نمونه سراسری (None = بدون مانیتور و بدون کاهش بار)
+load_shedder: Optional[LoadShedder] = None
+
+
+def init_load_shedder(**kwargs) -> LoadShedder:
+    """ساخت shedder سراسری (start باید داخل event loop صدا زده شود)"""
+    global load_shedder
+    load_shedder = LoadShedder(**kwargs)
+    return load_shedder
+
+
+def shedding(action: str, level: int = ELEVATED) -> bool:
+    """
+    آیا کار action باید در بار فعلی حذف/عقب انداخته شود؟
+    
+    مثال:
+        if shedding('product_photo'):
+            ... ارسال بدون عکس
+    """
+    if load_shedder is None or load_shedder.level < level:
+        return False
+    
+    inc('bot_load_shed_total', action=action)
+    return True
+
+
+async def wait_for_capacity(timeout: Optional[float] = None) -> bool:
+    """صبر تا کاهش بار (بدون shedder فوراً True)"""
+    if load_shedder is None:
+        return True
+    return await load_shedder.wait_for_capacity(timeout)
+
+
+if __name__ == "__main__":
+    # تست: بلاک کردن event loop با time.sleep و مشاهده تغییر سطح
+    import time
+    
+    async def _demo():
+        shedder = init_load_shedder(interval=0.05)
+        shedder.start()
+        
+        for block in (0.0, 0.2, 0.6, 0.6, 0.0, 0.0, 0.0, 0.0, 0.0):
+            time.sleep(block)   # عمداً بلاک‌کننده
+            await asyncio.sleep(0.2)
+            print(f"block={block:.1f}s lag={shedder.lag * 1000:6.0f}ms "
+                  f"level={LEVEL_NAMES[shedder.level]} shed_photo={shedding('product_photo')}")
+        
+        await shedder.stop()
+    
+    asyncio.run(_demo())
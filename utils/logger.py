@@ -7,20 +7,158 @@
 - سطوح مختلف لاگ (DEBUG, INFO, WARNING, ERROR, CRITICAL)
 - فرمت فارسی و خوانا
 - جداسازی لاگ‌های مختلف
+- نوشتن غیرمسدودکننده: رکوردها در صف محدود قرار می‌گیرند و یک thread جدا
+  (QueueListener) فایل‌ها و کنسول را می‌نویسد؛ rotation هم در همان thread انجام می‌شود
 """
 
+import atexit
 import logging
+import os
+import queue
 import sys
 from pathlib import Path
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, List, Optional
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    QueueHandler با صف محدود و سیاست سرریز
+    
+    سیاست‌ها (وقتی صف پر است):
+        drop_new: رکورد جدید حذف می‌شود (هشدار و خطا جای قدیمی‌ترین رکورد را می‌گیرند)
+        drop_oldest: قدیمی‌ترین رکورد صف حذف می‌شود
+        block: حداکثر block_timeout ثانیه صبر، سپس حذف
+    
+    فراخواننده (event loop) هیچ‌وقت بیش از block_timeout منتظر دیسک نمی‌ماند.
+    """
+    
+    POLICIES = ('drop_new', 'drop_oldest', 'block')
+    
+    def __init__(self, log_queue: queue.Queue, overflow: str = 'drop_new', block_timeout: float = 0.05):
+        super().__init__(log_queue)
+        
+        if overflow not in self.POLICIES:
+            raise ValueError(f"سیاست سرریز نامعتبر: {overflow}")
+        
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self.dropped = 0
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # صف داخل همین پروسه است: رکورد بدون فرمت منتقل می‌شود تا پیام و
+        # traceback در thread listener ساخته شوند، نه روی event loop
+        return record
+    
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        
+        if self.overflow == 'block':
+            try:
+                self.queue.put(record, timeout=self.block_timeout)
+                return
+            except queue.Full:
+                pass
+        
+        elif self.overflow == 'drop_oldest' or record.levelno >= logging.WARNING:
+            try:
+                self.queue.get_nowait()
+                self.queue.task_done()
+                self.dropped += 1
+                self.queue.put_nowait(record)
+                return
+            except (queue.Empty, queue.Full):
+                pass
+        
+        self.dropped += 1
+
+
+class LogSampler:
+    """
+    نمونه‌برداری قطعی برای رخدادهای پرتکرار: از هر every رخداد یک کلید، فقط اولی ثبت می‌شود
+    
+    مثال:
+        sampler = LogSampler(every=100)
+        if sampler.hit('cache_miss'):
+            logger.info("cache miss (1/%d)", sampler.every)
+    """
+    
+    def __init__(self, every: int = 1, max_keys: int = 1024):
+        self.every = max(int(every), 1)
+        self.max_keys = max_keys
+        self.counts: Dict[Any, int] = {}
+    
+    def hit(self, key: Any, every: Optional[int] = None) -> bool:
+        """آیا این رخداد باید ثبت شود؟"""
+        every = self.every if every is None else every
+        if every <= 1:
+            return True
+        
+        count = self.counts.get(key)
+        if count is None:
+            # شمارنده‌ها فقط برای حجم محدودی از کلیدها نگه داشته می‌شوند
+            if len(self.counts) >= self.max_keys:
+                self.counts.clear()
+            count = 0
+        
+        self.counts[key] = count + 1
+        return count % every == 0
+
+
+class _DrainingQueueListener(QueueListener):
+    """QueueListener که sentinel توقف را حتی با صف پر (با انتظار) در صف می‌گذارد"""
+    
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+class _RoutingHandler(logging.Handler):
+    """handler داخل QueueListener: ارسال هر رکورد به handler های logger خودش"""
+    
+    def __init__(self, queue_handler: BoundedQueueHandler):
+        super().__init__()
+        self.routes: Dict[str, List[logging.Handler]] = {}
+        self.queue_handler = queue_handler
+        self.reported_drops = 0
+    
+    def handle(self, record: logging.LogRecord):
+        # فقط thread listener این متد را صدا می‌زند؛ قفل لازم نیست
+        handlers = self.routes.get(record.name, ())
+        
+        for handler in handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+        
+        dropped = self.queue_handler.dropped
+        if dropped > self.reported_drops and handlers:
+            warning = logging.makeLogRecord({
+                'name': record.name,
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': f"⚠️  {dropped - self.reported_drops} رکورد لاگ به دلیل پر بودن صف حذف شد",
+            })
+            self.reported_drops = dropped
+            for handler in handlers:
+                handler.handle(warning)
+        
+        return True
 
 
 class PersianLogger:
     """کلاس مدیریت لاگ‌های فارسی"""
     
-    def __init__(self):
+    def __init__(self, queue_size: int = 10000, overflow: str = 'drop_new', db_sample_every: int = 1):
+        """
+        Args:
+            queue_size: حداکثر رکوردهای منتظر نوشتن
+            overflow: سیاست سرریز صف (BoundedQueueHandler.POLICIES)
+            db_sample_every: پیش‌فرض نمونه‌برداری log_db (1 = همه)
+        """
         self.logs_dir = Path("logs")
         self.logs_dir.mkdir(exist_ok=True)
         
@@ -32,6 +170,72 @@ class PersianLogger:
         
         # لاگرهای مختلف
         self.loggers = {}
+        
+        # sink رویدادهای JSON (utils.event_log)؛ None = غیرفعال
+        self.event_sink = None
+        # اگر True باشد لاگ‌های متنی کاربر/سفارش/امنیت فقط در sink نوشته می‌شوند
+        self.events_replace_text = False
+        # جدول events دیتابیس برای قیف تبدیل (utils.event_store)؛ None = غیرفعال
+        self.event_store = None
+        
+        # logger دیتابیس برای log_database (در اولین استفاده ساخته می‌شود)
+        self._db_logger: Optional[logging.Logger] = None
+        self.db_sampler = LogSampler(db_sample_every)
+        
+        # کنسول مشترک بین همه logger ها
+        self.console_handler = logging.StreamHandler(sys.stdout)
+        self.console_handler.setFormatter(self.log_format)
+        
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self._start_listener()
+    
+    def _start_listener(self):
+        """ساخت صف، QueueHandler مشترک و thread نویسنده"""
+        self.queue: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        self.queue_handler = BoundedQueueHandler(self.queue, self.overflow)
+        
+        routes = self.router.routes if hasattr(self, 'router') else {}
+        self.router = _RoutingHandler(self.queue_handler)
+        self.router.routes = routes
+        
+        self.listener = _DrainingQueueListener(self.queue, self.router)
+        self.listener.start()
+        
+        for logger in self.loggers.values():
+            logger.handlers = [self.queue_handler]
+    
+    def _after_fork(self):
+        """
+        در پروسه فرزند (مثلاً worker های رندر) thread listener وجود ندارد
+        و قفل صف ممکن است در لحظه fork گرفته شده باشد؛ صف و listener از نو ساخته می‌شوند.
+        """
+        self._start_listener()
+    
+    def shutdown(self):
+        """نوشتن همه رکوردهای باقی‌مانده و بستن فایل‌ها"""
+        if self.listener is None:
+            return
+        
+        # stop() منتظر می‌ماند تا صف خالی شود
+        self.listener.stop()
+        self.listener = None
+        
+        for handlers in self.router.routes.values():
+            for handler in handlers:
+                handler.flush()
+                if handler is not self.console_handler:
+                    handler.close()
+        self.console_handler.flush()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """آمار صف لاگ"""
+        return {
+            'queued': self.queue.qsize(),
+            'queue_size': self.queue_size,
+            'dropped': self.queue_handler.dropped,
+            'overflow': self.overflow
+        }
     
     def get_logger(
         self,
@@ -40,7 +244,8 @@ class PersianLogger:
         log_to_file: bool = True,
         log_to_console: bool = True,
         max_bytes: int = 10 * 1024 * 1024,  # 10MB
-        backup_count: int = 5
+        backup_count: int = 5,
+        extra_handlers: Optional[List[logging.Handler]] = None
     ) -> logging.Logger:
         """
         دریافت یک logger با تنظیمات دلخواه
@@ -52,6 +257,7 @@ class PersianLogger:
             log_to_console: نمایش در کنسول؟
             max_bytes: حداکثر حجم فایل لاگ (قبل از rotation)
             backup_count: تعداد فایل‌های backup
+            extra_handlers: handler های دیگر (مثلاً JSON) که در thread listener اجرا می‌شوند
         """
         
         # اگر قبلاً ساخته شده، برگردان
@@ -62,6 +268,10 @@ class PersianLogger:
         logger = logging.getLogger(name)
         logger.setLevel(level)
         logger.handlers.clear()  # پاک کردن handler های قبلی
+        logger.propagate = False
+        
+        # handler های واقعی در thread listener اجرا می‌شوند؛ logger فقط در صف می‌گذارد
+        handlers: List[logging.Handler] = []
         
         # Handler برای فایل
         if log_to_file:
@@ -74,14 +284,16 @@ class PersianLogger:
             )
             file_handler.setLevel(level)
             file_handler.setFormatter(self.log_format)
-            logger.addHandler(file_handler)
+            handlers.append(file_handler)
         
         # Handler برای کنسول
         if log_to_console:
-            console_handler = logging.StreamHandler(sys.stdout)
-            console_handler.setLevel(level)
-            console_handler.setFormatter(self.log_format)
-            logger.addHandler(console_handler)
+            handlers.append(self.console_handler)
+        
+        handlers.extend(extra_handlers or ())
+        
+        self.router.routes[name] = handlers
+        logger.addHandler(self.queue_handler)
         
         # ذخیره logger
         self.loggers[name] = logger
@@ -162,16 +374,30 @@ class PersianLogger:
         
         logger.error(message, exc_info=True)
     
-    def log_database(self, operation: str, details: str = ""):
-        """لاگ عملیات دیتابیس"""
-        logger = self.get_logger('database')
+    def log_database(self, operation: str, details: str = "", *args, every: Optional[int] = None):
+        """
+        لاگ عملیات دیتابیس (سطح DEBUG)
         
-        message = f"DB | {operation}"
+        details قالب %-style است و با args فقط وقتی DEBUG فعال باشد ساخته می‌شود.
         
-        if details:
-            message += f" | {details}"
+        Args:
+            every: فقط یکی از هر every رخداد همین (operation, details) ثبت شود
+                   (پیش‌فرض: db_sample_every)
+        """
+        logger = self._db_logger
+        if logger is None:
+            logger = self._db_logger = self.get_logger('database')
         
-        logger.debug(message)
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        
+        if not self.db_sampler.hit((operation, details), every):
+            return
+        
+        if details:
+            logger.debug("DB | %s | " + details, operation, *args)
+        else:
+            logger.debug("DB | %s", operation)
     
     def log_bot_event(self, event: str, details: str = ""):
         """لاگ رویدادهای ربات"""
@@ -200,7 +426,16 @@ class PersianLogger:
 
 
 # نمونه سراسری
-persian_logger = PersianLogger()
+persian_logger = PersianLogger(
+    queue_size=int(os.getenv('LOG_QUEUE_SIZE', '10000')),
+    overflow=os.getenv('LOG_OVERFLOW', 'drop_new'),
+    db_sample_every=int(os.getenv('LOG_DB_SAMPLE_EVERY', '1'))
+)
+
+# خالی کردن صف هنگام خروج و ساخت مجدد listener در پروسه‌های fork شده
+atexit.register(persian_logger.shutdown)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=persian_logger._after_fork)
 
 
 def get_logger(name: str, **kwargs) -> logging.Logger:
@@ -214,6 +449,16 @@ def get_logger(name: str, **kwargs) -> logging.Logger:
     return persian_logger.get_logger(name, **kwargs)
 
 
+def shutdown_logging():
+    """نوشتن لاگ‌های باقی‌مانده در صف (هنگام خاموش شدن ربات)"""
+    persian_logger.shutdown()
+
+
+def get_logging_stats() -> Dict[str, Any]:
+    """آمار صف لاگ"""
+    return persian_logger.get_stats()
+
+
 def log_startup():
     """لاگ راه‌اندازی ربات"""
     logger = get_logger('startup')
@@ -235,6 +480,18 @@ def log_shutdown():
 # توابع کوتاه برای راحتی کار
 def log_user(user_id: int, username: Optional[str], action: str, details: str = ""):
     """لاگ اقدام کاربر"""
+    sink = persian_logger.event_sink
+    store = persian_logger.event_store
+    if sink is not None or store is not None:
+        # نام handler = تابعی که log_user را صدا زده
+        handler = sys._getframe(1).f_code.co_name
+        if store is not None:
+            store.add(user_id, action, handler)
+        if sink is not None:
+            sink.emit('user_action', user_id=user_id, handler=handler, action=action)
+            if persian_logger.events_replace_text:
+                return
+    
     persian_logger.log_user_action(user_id, username, action, details)
 
 
@@ -245,6 +502,12 @@ def log_admin(admin_id: int, username: Optional[str], action: str, details: str
 
 def log_order(order_id: int, user_id: int, action: str, details: str = ""):
     """لاگ سفارش"""
+    sink = persian_logger.event_sink
+    if sink is not None:
+        sink.emit('order', user_id=user_id, order_id=order_id, handler=sys._getframe(1).f_code.co_name, action=action)
+        if persian_logger.events_replace_text:
+            return
+    
     persian_logger.log_order(order_id, user_id, action, details)
 
 
@@ -253,9 +516,14 @@ def log_error(error: Exception, context: str = "", user_id: Optional[int] = None
     persian_logger.log_error(error, context, user_id)
 
 
-def log_db(operation: str, details: str = ""):
-    """لاگ دیتابیس"""
-    persian_logger.log_database(operation, details)
+def log_db(operation: str, details: str = "", *args, every: Optional[int] = None):
+    """
+    لاگ دیتابیس (lazy)
+    
+    مثال:
+        log_db("SELECT", "user %s found", user_id)
+    """
+    persian_logger.log_database(operation, details, *args, every=every)
 
 
 def log_event(event: str, details: str = ""):
@@ -265,6 +533,12 @@ def log_event(event: str, details: str = ""):
 
 def log_security(event: str, user_id: Optional[int] = None, details: str = ""):
     """لاگ امنیتی"""
+    sink = persian_logger.event_sink
+    if sink is not None:
+        sink.emit('security', user_id=user_id, handler=sys._getframe(1).f_code.co_name, action=event)
+        if persian_logger.events_replace_text:
+            return
+    
     persian_logger.log_security(event, user_id, details)
 
 
@@ -295,7 +569,7 @@ if __name__ == "__main__":
         log_error(e, "تست خطا", 12345)
     
     # تست لاگ دیتابیس
-    log_db("SELECT", "users table - found 150 users")
+    log_db("SELECT", "users table - found %d users", 150)
     
     # تست لاگ رویداد
     log_event("ربات راه‌اندازی شد", "نسخه 2.0")
@@ -303,4 +577,13 @@ if __name__ == "__main__":
     # تست لاگ امنیتی
     log_security("تلاش ناموفق برای دسترسی ادمین", 12345, "IP: 192.168.1.1")
     
+    # تست سرعت: event loop فقط در صف می‌گذارد
+    import time
+    bench = get_logger('bench', log_to_console=False)
+    started = time.perf_counter()
+    for i in range(20000):
+        bench.info("پیام تست %d", i)
+    print(f"\n⏱️  20000 لاگ در {(time.perf_counter() - started) * 1000:.0f}ms (صف: {get_logging_stats()})")
+    
+    shutdown_logging()
     print("\n✅ تست‌ها کامل شد! فایل‌های لاگ رو توی پوشه logs/ چک کن.")
@@ -0,0 +1,363 @@
+"""
+متریک‌های داخلی ربات با خروجی متنی Prometheus (اختیاری)
+
+ویژگی‌ها:
+- counter، gauge و histogram با label، بدون وابستگی خارجی
+- endpoint محلی /metrics با asyncio.start_server (روی همان event loop)
+- wrapper زمان‌سنجی و شمارش فراخوانی‌های دیتابیس handler ها هنگام ثبت (instrument_handlers)
+- lag event loop توسط utils.load_shedder منتشر می‌شود
+- collector ها: مقادیری که فقط هنگام scrape خوانده می‌شوند (کش، صف لاگ، ...)
+
+وقتی غیرفعال است (metrics = None) هر فراخوانی inc/observe فقط یک مقایسه است.
+
+مثال:
+    inc('bot_gate_rejections_total', reason='rate_limit')
+    observe('bot_db_query_duration_seconds', 0.004, op='get_product')
+"""
+
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from telegram.ext import Application, ApplicationHandlerStop
+
+from utils.logger import get_logger
+from utils.query_counter import REPEAT_THRESHOLD, count_queries
+
+logger = get_logger('metrics')
+
+# bucket های پیش‌فرض زمان (ثانیه)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# bucket های شمارشی (تعداد کوئری در هر آپدیت)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# histogram هایی که bucket غیر زمانی دارند
+BUCKETS = {
+    'bot_handler_db_queries': COUNT_BUCKETS,
+}
+
+# توضیح (HELP) متریک‌های شناخته‌شده
+DESCRIPTIONS = {
+    'bot_updates_total': 'Updates received (all pass through the gate)',
+    'bot_handler_calls_total': 'Handler invocations',
+    'bot_handler_errors_total': 'Handler invocations that raised',
+    'bot_handler_duration_seconds': 'Handler latency',
+    'bot_db_query_duration_seconds': 'Database call latency by method',
+    'bot_handler_db_queries': 'Database calls per handler invocation',
+    'bot_handler_repeated_queries_total': 'Handler invocations repeating one database call (suspected N+1)',
+    'bot_gate_rejections_total': 'Updates rejected by the gate',
+    'bot_report_cache_hits_total': 'Analytics report cache hits',
+    'bot_report_cache_misses_total': 'Analytics report cache misses',
+    'bot_broadcast_messages': 'Progress of the current/last broadcast',
+    'bot_event_loop_lag_seconds': 'Event loop scheduling delay',
+    'bot_event_loop_lag_last_seconds': 'Last measured event loop delay',
+    'bot_load_level': 'Load shedding level (0 normal, 1 elevated, 2 overloaded)',
+    'bot_load_shed_total': 'Work skipped or deferred by load shedding',
+    'bot_log_queue_size': 'Records waiting in the logging queue',
+    'bot_log_dropped_total': 'Log records dropped by the queue',
+    'bot_event_store_pending': 'User events waiting to be written',
+    'bot_event_store_dropped_total': 'User events dropped by the event store',
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    """شمارش تجمعی bucket ها، مجموع و تعداد یک سری"""
+    
+    __slots__ = ('counts', 'sum', 'count')
+    
+    def __init__(self, size: int):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class Metrics:
+    """رجیستری متریک‌ها (thread-safe؛ زمان‌سنجی دیتابیس از thread ها هم می‌آید)"""
+    
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.gauges: Dict[str, Dict[LabelKey, float]] = {}
+        self.histograms: Dict[str, Dict[LabelKey, _Histogram]] = {}
+        self.collectors: List[Callable[["Metrics"], None]] = []
+        self._lock = threading.Lock()
+    
+    def inc(self, name: str, value: float = 1, **labels: Any):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+    
+    def set_gauge(self, name: str, value: float, **labels: Any):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self.gauges.setdefault(name, {})[key] = value
+    
+    def set_counter(self, name: str, value: float, **labels: Any):
+        """مقدار counter هایی که شمارنده خودشان را دارند (در collector ها)"""
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        with self._lock:
+            self.counters.setdefault(name, {})[key] = value
+    
+    def observe(self, name: str, value: float, **labels: Any):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        buckets = BUCKETS.get(name, self.buckets)
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(len(buckets) + 1)
+            hist.counts[index] += 1
+            hist.sum += value
+            hist.count += 1
+    
+    def add_collector(self, collector: Callable[["Metrics"], None]):
+        """تابعی که قبل از هر scrape اجرا می‌شود و gauge/counter ها را به‌روز می‌کند"""
+        self.collectors.append(collector)
+    
+    def render(self) -> str:
+        """خروجی متنی Prometheus (نسخه 0.0.4)"""
+        for collector in self.collectors:
+            try:
+                collector(self)
+            except Exception as e:
+                logger.warning("خطا در collector متریک‌ها: %s", e)
+        
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self.counters.items()):
+                self._header(lines, name, 'counter')
+                for key, value in series.items():
+                    lines.append(f"{name}{_labels(key)} {_number(value)}")
+            
+            for name, series in sorted(self.gauges.items()):
+                self._header(lines, name, 'gauge')
+                for key, value in series.items():
+                    lines.append(f"{name}{_labels(key)} {_number(value)}")
+            
+            for name, series in sorted(self.histograms.items()):
+                self._header(lines, name, 'histogram')
+                buckets = BUCKETS.get(name, self.buckets)
+                for key, hist in series.items():
+                    cumulative = 0
+                    for bound, count in zip(buckets, hist.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(key, ('le', _number(bound)))} {cumulative}")
+                    lines.append(f"{name}_bucket{_labels(key, ('le', '+Inf'))} {hist.count}")
+                    lines.append(f"{name}_sum{_labels(key)} {_number(hist.sum)}")
+                    lines.append(f"{name}_count{_labels(key)} {hist.count}")
+        
+        lines.append("")
+        return "\n".join(lines)
+    
+    @staticmethod
+    def _header(lines: List[str], name: str, kind: str):
+        description = DESCRIPTIONS.get(name)
+        if description:
+            lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = key + (extra,) if extra else key
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# ========== API سراسری (بدون هزینه وقتی غیرفعال است) ==========
+
+metrics: Optional[Metrics] = None
+
+
+def enabled() -> bool:
+    """آیا جمع‌آوری متریک فعال است؟"""
+    return metrics is not None
+
+
+def inc(name: str, value: float = 1, **labels: Any):
+    """افزایش counter"""
+    if metrics is not None:
+        metrics.inc(name, value, **labels)
+
+
+def set_gauge(name: str, value: float, **labels: Any):
+    """مقداردهی gauge"""
+    if metrics is not None:
+        metrics.set_gauge(name, value, **labels)
+
+
+def observe(name: str, value: float, **labels: Any):
+    """ثبت یک مقدار در histogram"""
+    if metrics is not None:
+        metrics.observe(name, value, **labels)
+
+
+def init_metrics(**kwargs) -> Metrics:
+    """راه‌اندازی رجیستری سراسری"""
+    global metrics
+    metrics = Metrics(**kwargs)
+    return metrics
+
+
+# ========== instrument کردن handler ها ==========
+
+def _handler_name(callback: Callable) -> str:
+    """UserHandler.start یا نام تابع محلی (بدون <locals>)"""
+    name = getattr(callback, '__qualname__', None) or repr(callback)
+    return name.rsplit('<locals>.', 1)[-1]
+
+
+def instrument(callback: Callable, name: Optional[str] = None) -> Callable:
+    """wrapper زمان‌سنجی و شمارش فراخوانی‌های دیتابیس یک callback ناهمگام handler"""
+    handler = name or _handler_name(callback)
+    
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        with count_queries() as queries:
+            try:
+                return await callback(update, context)
+            except ApplicationHandlerStop:
+                # توقف عمدی زنجیره (مثلاً رد در gate) خطا نیست
+                raise
+            except Exception:
+                inc('bot_handler_errors_total', handler=handler)
+                raise
+            finally:
+                observe('bot_handler_duration_seconds', time.perf_counter() - started, handler=handler)
+                observe('bot_handler_db_queries', queries.total, handler=handler)
+                inc('bot_handler_calls_total', handler=handler)
+                
+                repeated = queries.repeated(REPEAT_THRESHOLD)
+                if repeated:
+                    inc('bot_handler_repeated_queries_total', handler=handler)
+                    logger.warning("⚠️  N+1 مشکوک در %s: %s", handler, queries.describe())
+    
+    wrapper.__wrapped_handler__ = handler
+    return wrapper
+
+
+def _iter_handlers(handlers: Iterable) -> Iterable:
+    for handler in handlers:
+        # ConversationHandler: handler های داخلی
+        nested = []
+        for attr in ('entry_points', 'fallbacks'):
+            nested.extend(getattr(handler, attr, None) or [])
+        for state_handlers in (getattr(handler, 'states', None) or {}).values():
+            nested.extend(state_handlers)
+        
+        if nested:
+            yield from _iter_handlers(nested)
+        elif hasattr(handler, 'callback'):
+            yield handler
+
+
+def instrument_handlers(app: Application) -> int:
+    """
+    پیچیدن callback همه handler های ثبت شده (یک بار، بعد از ثبت)
+    
+    Returns:
+        تعداد handler های instrument شده
+    """
+    count = 0
+    for group in app.handlers.values():
+        for handler in _iter_handlers(group):
+            if hasattr(handler.callback, '__wrapped_handler__'):
+                continue
+            handler.callback = instrument(handler.callback)
+            count += 1
+    
+    logger.info("📏 %s handler برای متریک‌ها instrument شد", count)
+    return count
+
+
+# ========== endpoint ==========
+
+class MetricsServer:
+    """سرور HTTP حداقلی برای GET /metrics (فقط برای دسترسی محلی)"""
+    
+    def __init__(self, registry: Metrics, host: str = '127.0.0.1', port: int = 9108):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+    
+    async def start(self):
+        """شروع سرور روی event loop فعلی"""
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logger.info("📈 متریک‌ها: http://%s:%s/metrics", self.host, self.port)
+    
+    async def stop(self):
+        """توقف سرور"""
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+    
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            # خواندن header ها تا خط خالی
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            
+            parts = request_line.decode('latin-1').split()
+            path = parts[1].split('?', 1)[0] if len(parts) >= 2 else ''
+            
+            if len(parts) >= 2 and parts[0] == 'GET' and path == '/metrics':
+                status = '200 OK'
+                body = self.registry.render().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                status = '404 Not Found'
+                body = b'not found\n'
+                content_type = 'text/plain'
+            
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        
+        finally:
+            writer.close()
+
+
+if __name__ == "__main__":
+    # تست: ثبت چند متریک و نمایش خروجی
+    registry = init_metrics()
+    
+    for i in range(1000):
+        observe('bot_handler_duration_seconds', (i % 50) / 1000, handler='UserHandler.start')
+        inc('bot_handler_calls_total', handler='UserHandler.start')
+    inc('bot_gate_rejections_total', reason='rate_limit')
+    set_gauge('bot_broadcast_messages', 12, state='sent')
+    
+    started = time.perf_counter()
+    observe('bot_handler_db_queries', 3, handler='OrderHandler.view_cart')
+    for _ in range(100_000):
+        observe('bot_db_query_duration_seconds', 0.002, op='get_product')
+    print(f"observe: {(time.perf_counter() - started) * 10:.2f}µs\n")
+    
+    print(registry.render())
@@ -0,0 +1,169 @@
+"""
+پروفایل‌گیری موقت از پروسه در حال اجرا (بدون restart)
+
+دو خروجی همزمان:
+- cProfile روی thread event loop: فایل .prof برای snakeviz / pstats
+- نمونه‌برداری از stack همان thread در یک thread جدا (پیش‌فرض 200 بار در ثانیه):
+  فایل collapsed stacks ("a;b;c 42") برای flamegraph.pl یا speedscope؛
+  زمان انتظار در select هم دیده می‌شود، پس بیکاری و کندی از هم جدا هستند
+  (نمونه‌بردار برای گرفتن GIL صبر می‌کند، پس تکه‌های CPU کوتاه‌تر از
+  sys.getswitchinterval() کمتر از واقع دیده می‌شوند؛ cProfile این سوگیری را ندارد)
+
+وقتی پروفایلی در جریان نیست هیچ hook یا thread ای فعال نیست.
+"""
+
+import cProfile
+import io
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+from utils.logger import get_logger
+
+logger = get_logger('profiler')
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """نمونه‌برداری دوره‌ای از stack یک thread"""
+    
+    def __init__(self, thread_id: int, interval: float = 0.005, max_depth: int = 64):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        
+        # کش برچسب هر code object (ساخت رشته در هر نمونه گران است)
+        self._labels: Dict[object, str] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+    
+    def start(self):
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=2)
+    
+    def _run(self):
+        labels = self._labels
+        
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                label = labels.get(code)
+                if label is None:
+                    label = labels[code] = _frame_label(code)
+                stack.append(label)
+                frame = frame.f_back
+            
+            stack.reverse()
+            self.stacks[';'.join(stack)] += 1
+            self.samples += 1
+    
+    def collapsed(self) -> str:
+        """خروجی collapsed stacks (یک stack در هر خط با تعداد نمونه)"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileSession:
+    """
+    یک پروفایل: cProfile + نمونه‌بردار stack روی thread فراخواننده (event loop)
+    
+    start و stop باید از همان thread صدا زده شوند.
+    """
+    
+    def __init__(self, sample_interval: float = 0.005):
+        self.profile = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident(), sample_interval)
+        self.started_at = 0.0
+        self.duration = 0.0
+        self.updates = 0
+    
+    def start(self):
+        self.started_at = time.perf_counter()
+        self.sampler.start()
+        self.profile.enable()
+        logger.info("🔬 پروفایل شروع شد")
+    
+    def stop(self):
+        self.profile.disable()
+        self.sampler.stop()
+        self.duration = time.perf_counter() - self.started_at
+        logger.info(
+            "🔬 پروفایل تمام شد: %.1fs، %s آپدیت، %s نمونه stack",
+            self.duration, self.updates, self.sampler.samples
+        )
+    
+    def summary(self, limit: int = 10) -> str:
+        """پرهزینه‌ترین توابع بر اساس زمان تجمعی (متن کوتاه برای پیام)"""
+        out = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=out)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+        return out.getvalue()
+    
+    def write_files(self, prefix: str = 'profile') -> Tuple[str, str]:
+        """
+        نوشتن فایل‌ها در پوشه موقت (در worker thread صدا زده شود)
+        
+        Returns:
+            (مسیر .prof, مسیر collapsed) - حذف بر عهده فراخواننده است
+        """
+        directory = tempfile.mkdtemp(prefix=f"{prefix}_")
+        prof_path = os.path.join(directory, f"{prefix}.prof")
+        collapsed_path = os.path.join(directory, f"{prefix}.collapsed.txt")
+        
+        self.profile.dump_stats(prof_path)
+        with open(collapsed_path, 'w', encoding='utf-8') as f:
+            f.write(self.sampler.collapsed())
+        
+        return prof_path, collapsed_path
+
+
+def remove_files(*paths: Optional[str]):
+    """حذف فایل‌های پروفایل و پوشه موقت آن‌ها"""
+    for path in paths:
+        if path and os.path.exists(path):
+            os.remove(path)
+    
+    directories = {os.path.dirname(p) for p in paths if p}
+    for directory in directories:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+
+if __name__ == "__main__":
+    # تست: پروفایل یک کار CPU-bound و یک sleep
+    def busy(n):
+        return sum(i * i for i in range(n))
+    
+    session = ProfileSession()
+    session.start()
+    for _ in range(30):
+        busy(300_000)
+        time.sleep(0.01)
+    session.stop()
+    
+    print(session.summary(5))
+    prof, collapsed = session.write_files()
+    print(f"{prof} ({os.path.getsize(prof)} bytes)")
+    with open(collapsed, encoding='utf-8') as f:
+        for line in f.readlines()[:3]:
+            print(f"  {line.strip()[-120:]}")
+    remove_files(prof, collapsed)
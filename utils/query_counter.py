@@ -0,0 +1,111 @@
+"""
+شمارش فراخوانی‌های دیتابیس در هر آپدیت (تشخیص الگوی N+1)
+
+Database._get_connection هر فراخوانی را در شمارنده context فعلی ثبت می‌کند؛
+شمارنده یک ContextVar است، پس هر آپدیت (task) شمارنده خودش را دارد و
+asyncio.to_thread هم آن را به worker thread منتقل می‌کند.
+
+- wrapper متریک‌ها (utils.metrics.instrument) تعداد را برای هر handler ثبت
+  و تکرار یک متد در یک آپدیت را به‌عنوان N+1 مشکوک گزارش می‌کند
+- assert_max_queries برای تست‌ها: اجرای handler و خطا اگر بیش از n فراخوانی داشت
+
+مثال:
+    await assert_max_queries(order_handler.view_cart, 3, update, context)
+"""
+
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, List, Optional, Tuple
+
+# تکرار یک متد دیتابیس در یک آپدیت از این تعداد به بعد N+1 مشکوک است
+REPEAT_THRESHOLD = 5
+
+
+class QueryCount:
+    """تعداد فراخوانی‌های دیتابیس یک آپدیت به تفکیک متد"""
+    
+    __slots__ = ('total', 'ops')
+    
+    def __init__(self):
+        self.total = 0
+        self.ops: Counter = Counter()
+    
+    def add(self, op: str):
+        self.total += 1
+        self.ops[op] += 1
+    
+    def repeated(self, threshold: int = REPEAT_THRESHOLD) -> List[Tuple[str, int]]:
+        """متدهایی که حداقل threshold بار فراخوانی شده‌اند"""
+        return [(op, count) for op, count in self.ops.most_common() if count >= threshold]
+    
+    def describe(self) -> str:
+        """مثال: get_product×12, get_cart×1"""
+        return ", ".join(f"{op}×{count}" for op, count in self.ops.most_common())
+
+
+class QueryBudgetExceeded(AssertionError):
+    """handler بیش از سقف مجاز به دیتابیس مراجعه کرد"""
+
+
+_current: ContextVar[Optional[QueryCount]] = ContextVar('db_query_count', default=None)
+
+
+def current() -> Optional[QueryCount]:
+    """شمارنده فعال در context فعلی (None اگر شمارشی در جریان نیست)"""
+    return _current.get()
+
+
+@contextmanager
+def count_queries() -> Iterator[QueryCount]:
+    """شمارش فراخوانی‌های دیتابیس داخل این بلوک"""
+    count = QueryCount()
+    token = _current.set(count)
+    try:
+        yield count
+    finally:
+        _current.reset(token)
+
+
+async def assert_max_queries(callback: Callable, max_queries: int, *args: Any, **kwargs: Any) -> Any:
+    """
+    اجرای یک handler و بررسی سقف فراخوانی‌های دیتابیس آن
+    
+    Raises:
+        QueryBudgetExceeded: اگر تعداد فراخوانی‌ها بیش از max_queries باشد
+    """
+    with count_queries() as count:
+        result = await callback(*args, **kwargs)
+    
+    if count.total > max_queries:
+        name = getattr(callback, '__qualname__', repr(callback))
+        raise QueryBudgetExceeded(
+            f"{name}: {count.total} فراخوانی دیتابیس (حداکثر {max_queries}) - {count.describe()}"
+        )
+    
+    return result
+
+
+if __name__ == "__main__":
+    # تست: شمارش در task های همزمان و worker thread
+    import asyncio
+    
+    async def handler(n: int):
+        for _ in range(n):
+            current().add('get_product')
+            await asyncio.to_thread(lambda: current().add('get_cart'))
+    
+    async def _demo():
+        with count_queries() as a:
+            await asyncio.gather(asyncio.create_task(handler(1)), asyncio.create_task(handler(2)))
+        print(f"gather (context مشترک): {a.total} - {a.describe()}")
+        
+        await assert_max_queries(handler, 2, 1)
+        print("handler(1) در سقف 2")
+        
+        try:
+            await assert_max_queries(handler, 2, 6)
+        except QueryBudgetExceeded as e:
+            print(f"❌ {e}")
+    
+    asyncio.run(_demo())
@@ -1,112 +1,331 @@
 """
 سیستم Rate Limiting برای جلوگیری از سوء استفاده
 
-محدودسازی تعداد درخواست‌های کاربران
+پیاده‌سازی بر اساس GCRA (Generic Cell Rate Algorithm):
+- برای هر کلید فقط یک عدد float نگه داشته می‌شود (TAT: زمان نظری درخواست بعدی)
+- بررسی هر درخواست O(1) است (بدون لیست یا صف زمان‌ها)
+- چند سیاست نام‌دار: دقیقه‌ای، ساعتی و سیاست‌های مخصوص هر عملیات
+- حافظه محدود: کلیدهای بیکار حذف می‌شوند و تعداد کل کلیدها سقف دارد
+- وضعیت روی یک StateBackend ذخیره می‌شود (حافظه یا SQLite مشترک بین پروسه‌ها)
 """
 
-from collections import defaultdict
-from datetime import datetime, timedelta
-from typing import Dict, Tuple
+import math
+import time
+from dataclasses import dataclass
+from functools import wraps
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
 from utils.logger import get_logger, log_security
+from utils.state_backend import MemoryBackend, StateBackend
 
 logger = get_logger('rate_limiter')
 
 
+@dataclass(frozen=True)
+class RatePolicy:
+    """سیاست محدودسازی: حداکثر limit درخواست در window ثانیه"""
+    
+    name: str
+    limit: int
+    window: float
+    
+    @property
+    def emission_interval(self) -> float:
+        """فاصله زمانی هر درخواست در حالت یکنواخت (T در GCRA)"""
+        return self.window / self.limit
+
+
 class RateLimiter:
     """کلاس محدودسازی نرخ درخواست"""
     
-    def __init__(self, max_per_minute: int = 20, max_per_hour: int = 100):
+    def __init__(
+        self,
+        max_per_minute: int = 20,
+        max_per_hour: int = 100,
+        max_keys: int = 100_000,
+        backend: Optional[StateBackend] = None
+    ):
         """
         Args:
             max_per_minute: حداکثر درخواست در دقیقه
             max_per_hour: حداکثر درخواست در ساعت
+            max_keys: سقف تعداد کلیدهای وضعیت (هر کاربر × هر سیاست)
+            backend: محل ذخیره وضعیت (پیش‌فرض: حافظه همین پروسه)
         """
         self.max_per_minute = max_per_minute
         self.max_per_hour = max_per_hour
         
-        # ذخیره زمان درخواست‌ها
-        self.requests: Dict[int, list] = defaultdict(list)
+        # سیاست‌های نام‌دار
+        self.policies: Dict[str, RatePolicy] = {}
+        
+        # وضعیت GCRA: {(policy_name, key): TAT}
+        self.backend = backend or MemoryBackend(max_keys)
+        
+        self.add_policy('minute', max_per_minute, 60)
+        self.add_policy('hour', max_per_hour, 3600)
+        self.default_policies: Tuple[str, ...] = ('minute', 'hour')
+        
+        logger.info(
+            f"✅ Rate Limiter (GCRA, {self.backend.name}): "
+            f"{max_per_minute}/min, {max_per_hour}/hour"
+        )
+    
+    def add_policy(self, name: str, limit: int, window: float) -> RatePolicy:
+        """
+        تعریف یا جایگزینی یک سیاست نام‌دار
+        
+        Args:
+            name: نام سیاست (مثل 'minute' یا 'action:order')
+            limit: حداکثر تعداد درخواست
+            window: بازه زمانی (ثانیه)
+        """
+        if limit <= 0 or window <= 0:
+            raise ValueError(f"سیاست نامعتبر {name}: limit={limit}, window={window}")
         
-        logger.info(f"✅ Rate Limiter: {max_per_minute}/min, {max_per_hour}/hour")
+        policy = RatePolicy(name, limit, float(window))
+        self.policies[name] = policy
+        return policy
+    
+    def check(self, key: Hashable, *policy_names: str) -> Tuple[bool, int]:
+        """
+        بررسی و ثبت یک درخواست برای چند سیاست به‌صورت یکجا
+        
+        درخواست فقط وقتی ثبت می‌شود که همه سیاست‌ها اجازه بدهند؛
+        یعنی رد شدن در سیاست ساعتی، سهمیه دقیقه‌ای را مصرف نمی‌کند.
+        
+        Returns:
+            (allowed, retry_after) - retry_after بر حسب ثانیه
+        """
+        policies = self.policies
+        checks = [
+            ((name, key), policies[name].emission_interval, policies[name].window)
+            for name in policy_names or self.default_policies
+        ]
+        return self.backend.gcra_check(checks, time.time())
     
     def check_rate_limit(self, user_id: int) -> bool:
         """
-        بررسی محدودیت نرخ درخواست
+        بررسی محدودیت نرخ درخواست (دقیقه‌ای و ساعتی)
         
         Returns:
             True: اجازه درخواست
             False: محدودیت فعال
         """
-        now = datetime.now()
+        allowed, retry_after = self.check(user_id, *self.default_policies)
         
-        # دریافت لیست درخواست‌های کاربر
-        user_requests = self.requests[user_id]
+        if not allowed:
+            logger.warning(f"Rate limit برای کاربر {user_id}: {retry_after}s")
+            log_security("Rate limit hit", user_id, f"retry after {retry_after}s")
         
-        # پاکسازی درخواست‌های قدیمی (بیش از 1 ساعت)
-        cutoff_time = now - timedelta(hours=1)
-        user_requests[:] = [req_time for req_time in user_requests if req_time > cutoff_time]
+        return allowed
+    
+    def check_action_limit(
+        self,
+        user_id: int,
+        action: str,
+        max_requests: int,
+        window_seconds: int
+    ) -> Tuple[bool, int]:
+        """
+        بررسی محدودیت برای یک عملیات خاص
         
-        # شمارش درخواست‌های اخیر
-        minute_ago = now - timedelta(minutes=1)
-        requests_last_minute = sum(1 for req_time in user_requests if req_time > minute_ago)
-        requests_last_hour = len(user_requests)
+        Args:
+            user_id: شناسه کاربر
+            action: نام عملیات (مثل 'order', 'discount')
+            max_requests: حداکثر تعداد
+            window_seconds: بازه زمانی (ثانیه)
         
-        # بررسی محدودیت دقیقه
-        if requests_last_minute >= self.max_per_minute:
-            logger.warning(
-                f"Rate limit (minute) برای کاربر {user_id}: "
-                f"{requests_last_minute}/{self.max_per_minute}"
-            )
-            log_security(
-                "Rate limit hit (minute)",
-                user_id,
-                f"{requests_last_minute} requests"
-            )
-            return False
+        Returns:
+            (allowed, remaining_time)
+        """
+        name = f"action:{action}"
+        policy = self.policies.get(name)
         
-        # بررسی محدودیت ساعت
-        if requests_last_hour >= self.max_per_hour:
-            logger.warning(
-                f"Rate limit (hour) برای کاربر {user_id}: "
-                f"{requests_last_hour}/{self.max_per_hour}"
-            )
-            log_security(
-                "Rate limit hit (hour)",
-                user_id,
-                f"{requests_last_hour} requests"
-            )
-            return False
+        if policy is None or policy.limit != max_requests or policy.window != window_seconds:
+            self.add_policy(name, max_requests, window_seconds)
         
-        # ثبت درخواست جدید
-        user_requests.append(now)
+        allowed, retry_after = self.check(user_id, name)
         
-        logger.debug(f"Request allowed for user {user_id}: {requests_last_minute}/min, {requests_last_hour}/hour")
+        if not allowed:
+            logger.warning(f"Action limit '{action}' برای کاربر {user_id}: {retry_after}s")
+            log_security(f"Action limit hit ({action})", user_id, f"retry after {retry_after}s")
         
-        return True
+        return allowed, retry_after
     
     def get_user_stats(self, user_id: int) -> Tuple[int, int]:
         """
-        دریافت آمار درخواست‌های کاربر
+        دریافت آمار تقریبی درخواست‌های کاربر (بدون ساختن وضعیت جدید)
         
         Returns:
             (تعداد در دقیقه گذشته, تعداد در ساعت گذشته)
         """
-        now = datetime.now()
-        user_requests = self.requests[user_id]
+        now = time.time()
+        counts = []
         
-        minute_ago = now - timedelta(minutes=1)
-        requests_last_minute = sum(1 for req_time in user_requests if req_time > minute_ago)
-        requests_last_hour = len(user_requests)
+        for name in ('minute', 'hour'):
+            policy = self.policies[name]
+            tat = self.backend.gcra_get((name, user_id))
+            if tat is None:
+                counts.append(0)
+                continue
+            counts.append(max(0, math.ceil((tat - now) / policy.emission_interval)))
         
-        return requests_last_minute, requests_last_hour
+        return counts[0], counts[1]
     
     def reset_user(self, user_id: int):
-        """ریست کردن محدودیت کاربر (برای ادمین)"""
-        if user_id in self.requests:
-            self.requests.pop(user_id)
+        """ریست کردن محدودیت‌های کاربر (برای ادمین)"""
+        removed = 0
+        for name in self.policies:
+            if self.backend.gcra_delete((name, user_id)):
+                removed += 1
+        
+        if removed:
             logger.info(f"Rate limit reset for user {user_id}")
             log_security("Rate limit reset", user_id, "توسط ادمین")
+    
+    @property
+    def size(self) -> int:
+        """تعداد فعلی کلیدهای وضعیت"""
+        return self.backend.size()
+    
+    def get_memory_stats(self) -> Dict[str, Any]:
+        """آمار وضعیت rate limiter"""
+        return self.backend.stats()
+
+
+# نمونه سراسری (در main.py با init_rate_limiter مقداردهی می‌شود)
+rate_limiter = RateLimiter()
+
+
+def init_rate_limiter(
+    max_per_minute: int = 20,
+    max_per_hour: int = 100,
+    max_keys: int = 100_000,
+    backend: Optional[StateBackend] = None
+) -> RateLimiter:
+    """مقداردهی اولیه rate limiter سراسری"""
+    global rate_limiter
+    rate_limiter = RateLimiter(max_per_minute, max_per_hour, max_keys, backend)
+    return rate_limiter
+
+
+# ==================== Decorators ====================
+
+def _format_wait(seconds: int) -> str:
+    """تبدیل ثانیه به متن فارسی"""
+    minutes, seconds = divmod(seconds, 60)
+    
+    if minutes > 0:
+        text = f"{minutes} دقیقه"
+        if seconds > 0:
+            text += f" و {seconds} ثانیه"
+        return text
+    
+    return f"{seconds} ثانیه"
+
+
+def rate_limit(max_requests: int = 10, window_seconds: int = 10):
+    """
+    دکوریتور محدودسازی کلی
+    
+    مثال:
+        @rate_limit(max_requests=5, window_seconds=60)
+        async def my_handler(update, context):
+            ...
+    """
+    policy_name = f"rate:{max_requests}/{window_seconds}"
+    
+    def decorator(func: Callable):
+        @wraps(func)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+            user_id = update.effective_user.id
+            
+            if policy_name not in rate_limiter.policies:
+                rate_limiter.add_policy(policy_name, max_requests, window_seconds)
+            
+            allowed, remaining_time = rate_limiter.check(user_id, policy_name)
+            
+            if not allowed:
+                warning_msg = (
+                    f"⚠️ **شما خیلی سریع درخواست می‌فرستید!**\n\n"
+                    f"لطفاً {remaining_time} ثانیه صبر کنید.\n\n"
+                    f"📌 محدودیت: {max_requests} درخواست در {window_seconds} ثانیه"
+                )
+                
+                if update.message:
+                    await update.message.reply_text(warning_msg, parse_mode='Markdown')
+                elif update.callback_query:
+                    await update.callback_query.answer(
+                        f"⚠️ لطفاً {remaining_time} ثانیه صبر کنید",
+                        show_alert=True
+                    )
+                
+                return None
+            
+            return await func(update, context, *args, **kwargs)
+        
+        return wrapper
+    return decorator
+
+
+def action_limit(action: str, max_requests: int, window_seconds: int):
+    """
+    دکوریتور محدودسازی برای عملیات خاص
+    
+    مثال:
+        @action_limit('order', max_requests=3, window_seconds=3600)
+        async def create_order(update, context):
+            ...
+    """
+    action_names = {
+        'order': 'ثبت سفارش',
+        'discount': 'امتحان کد تخفیف',
+        'cart': 'افزودن به سبد'
+    }
+    
+    if window_seconds >= 60:
+        window_text = f"{window_seconds // 60} دقیقه"
+    else:
+        window_text = f"{window_seconds} ثانیه"
+    
+    def decorator(func: Callable):
+        @wraps(func)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE, *args, **kwargs):
+            user_id = update.effective_user.id
+            
+            allowed, remaining_time = rate_limiter.check_action_limit(
+                user_id, action, max_requests, window_seconds
+            )
+            
+            if not allowed:
+                time_str = _format_wait(remaining_time)
+                
+                warning_msg = (
+                    f"⚠️ **محدودیت {action_names.get(action, action)}**\n\n"
+                    f"شما به حداکثر تعداد مجاز رسیده‌اید.\n\n"
+                    f"⏰ لطفاً {time_str} صبر کنید.\n\n"
+                    f"📌 محدودیت: {max_requests} بار در هر {window_text}"
+                )
+                
+                if update.message:
+                    await update.message.reply_text(warning_msg, parse_mode='Markdown')
+                elif update.callback_query:
+                    await update.callback_query.answer(
+                        f"⚠️ لطفاً {time_str} صبر کنید",
+                        show_alert=True
+                    )
+                
+                return None
+            
+            return await func(update, context, *args, **kwargs)
+        
+        return wrapper
+    return decorator
 
 
 if __name__ == "__main__":
     print("⚠️  این ماژول باید در سایر handler ها استفاده شود")
+    print("برای مقایسه سرعت: python benchmarks/bench_rate_limiter.py")
@@ -0,0 +1,109 @@
+"""
+کش گزارش‌های تصویری
+
+ویژگی‌ها:
+- کلید: (نوع گزارش, دوره/روز, نسخه داده) - با تغییر داده خودبه‌خود باطل می‌شود
+- بعد از اولین ارسال فقط file_id تلگرام نگه‌داری می‌شود (بدون آپلود مجدد)
+- LRU با سقف تعداد آیتم
+"""
+
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Hashable, Optional, Tuple
+
+from utils.logger import get_logger
+
+logger = get_logger('report_cache')
+
+# (report_type, period, data_version)
+ReportKey = Tuple[str, Hashable, int]
+
+
+@dataclass
+class CachedReport:
+    """گزارش کش شده"""
+    caption: str
+    png: Optional[bytes] = None
+    file_id: Optional[str] = None
+    
+    @property
+    def photo(self):
+        """ورودی مناسب برای reply_photo (ترجیحاً file_id)"""
+        return self.file_id or self.png
+
+
+class ReportCache:
+    """کش LRU گزارش‌ها"""
+    
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[ReportKey, CachedReport]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key: ReportKey) -> Optional[CachedReport]:
+        """دریافت گزارش کش شده"""
+        entry = self._data.get(key)
+        
+        if entry is None:
+            self.misses += 1
+            return None
+        
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry
+    
+    def put(
+        self,
+        key: ReportKey,
+        caption: str,
+        png: Optional[bytes] = None,
+        file_id: Optional[str] = None
+    ) -> CachedReport:
+        """ذخیره گزارش (نسخه‌های قدیمی‌تر همان گزارش حذف می‌شوند)"""
+        report_type = key[0]
+        for stale in [k for k in self._data if k[0] == report_type and k != key]:
+            del self._data[stale]
+        
+        entry = CachedReport(caption, None if file_id else png, file_id)
+        self._data[key] = entry
+        self._data.move_to_end(key)
+        
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+        
+        return entry
+    
+    def set_file_id(self, key: ReportKey, file_id: str):
+        """ثبت file_id بعد از آپلود و آزاد کردن بایت‌های تصویر"""
+        entry = self._data.get(key)
+        if entry is not None:
+            entry.file_id = file_id
+            entry.png = None
+    
+    def clear(self):
+        """حذف همه آیتم‌ها"""
+        self._data.clear()
+    
+    def get_stats(self) -> Dict[str, int]:
+        """آمار کش"""
+        return {
+            'size': len(self._data),
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+if __name__ == "__main__":
+    # تست
+    cache = ReportCache(max_entries=2)
+    
+    cache.put(('sales_daily', '2024-01-01', 1), "فروش", png=b'png')
+    cache.set_file_id(('sales_daily', '2024-01-01', 1), "FILE_ID")
+    print(f"hit: {cache.get(('sales_daily', '2024-01-01', 1))}")
+    
+    # نسخه جدید داده، نسخه قبلی را حذف می‌کند
+    cache.put(('sales_daily', '2024-01-01', 2), "فروش", png=b'png2')
+    print(f"old version: {cache.get(('sales_daily', '2024-01-01', 1))}")
+    print(f"stats: {cache.get_stats()}")
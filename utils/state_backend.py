@@ -0,0 +1,456 @@
+"""
+ذخیره‌سازی وضعیت مشترک (rate limit و session کاربران)
+
+دو پیاده‌سازی:
+- MemoryBackend: داخل حافظه همین پروسه (پیش‌فرض، سریع‌ترین حالت)
+- SQLiteBackend: فایل SQLite در حالت WAL، مشترک بین چند پروسه روی یک سرور
+
+عملیات check-and-increment در rate limit و به‌روزرسانی session ها اتمیک
+هستند؛ در SQLite با تراکنش BEGIN IMMEDIATE، پس N پروسه دقیقاً همان
+محدودیت‌های یک پروسه را اعمال می‌کنند.
+"""
+
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+
+from utils.logger import get_logger
+
+logger = get_logger('state_backend')
+
+# (state_key, emission_interval, window)
+GcraCheck = Tuple[Hashable, float, float]
+
+
+def _gcra_step(tat: Optional[float], interval: float, window: float, now: float) -> Tuple[float, float]:
+    """یک گام GCRA: (TAT جدید, زمان انتظار) - انتظار مثبت یعنی رد"""
+    if tat is None or tat < now:
+        tat = now
+    new_tat = tat + interval
+    return new_tat, new_tat - now - window
+
+
+class StateBackend:
+    """رابط پایه ذخیره‌سازی وضعیت"""
+    
+    name = "base"
+    
+    # ========== Rate limit (GCRA) ==========
+    
+    def gcra_check(self, checks: Sequence[GcraCheck], now: float) -> Tuple[bool, int]:
+        """
+        بررسی و ثبت اتمیک یک درخواست برای چند سیاست
+        
+        Returns:
+            (allowed, retry_after)
+        """
+        raise NotImplementedError
+    
+    def gcra_get(self, state_key: Hashable) -> Optional[float]:
+        """خواندن TAT بدون ساختن کلید"""
+        raise NotImplementedError
+    
+    def gcra_delete(self, state_key: Hashable) -> bool:
+        """حذف یک کلید"""
+        raise NotImplementedError
+    
+    def size(self) -> int:
+        """تعداد کلیدهای rate limit"""
+        raise NotImplementedError
+    
+    def stats(self) -> Dict[str, Any]:
+        """آمار حافظه/ذخیره‌سازی"""
+        return {'backend': self.name, 'size': self.size()}
+    
+    # ========== Session ==========
+    
+    def session_get(self, user_id: int) -> Dict[str, Any]:
+        """دریافت کپی session کاربر"""
+        raise NotImplementedError
+    
+    def session_update(self, user_id: int, fn: Callable[[Dict[str, Any]], Any]) -> Any:
+        """اجرای اتمیک fn روی session کاربر و ذخیره نتیجه؛ خروجی fn برگردانده می‌شود"""
+        raise NotImplementedError
+    
+    def session_delete(self, user_id: int):
+        """حذف session کاربر"""
+        raise NotImplementedError
+    
+    def close(self):
+        """بستن منابع"""
+
+
+class BoundedTatStore:
+    """
+    نگه‌داری TAT ها در یک LRU با سقف حافظه
+    
+    کلیدی که TAT آن از زمان حال گذشته باشد هیچ اطلاعاتی ندارد (معادل کاربر
+    تازه است)، پس حذفش بی‌خطر است. این یعنی هر کلیدی که بیشتر از طولانی‌ترین
+    بازه سیاستش بیکار بماند حذف می‌شود. در هر نوشتن چند کلید قدیمی از ابتدای
+    LRU بررسی و در صورت انقضا حذف می‌شوند، و اگر تعداد از max_keys بیشتر شد
+    قدیمی‌ترین کلید (حتی اگر منقضی نشده باشد) کنار گذاشته می‌شود.
+    """
+    
+    # تعداد کلیدهای بررسی‌شده از ابتدای LRU در هر نوشتن
+    EXPIRE_SCAN = 2
+    
+    def __init__(self, max_keys: int = 100_000):
+        """
+        Args:
+            max_keys: حداکثر تعداد کلیدهای نگه‌داری شده
+        """
+        self.max_keys = max_keys
+        self._data: "OrderedDict[Hashable, float]" = OrderedDict()
+        
+        # آمار حذف‌ها
+        self.expired_count = 0
+        self.evicted_count = 0
+    
+    def __len__(self) -> int:
+        return len(self._data)
+    
+    def get(self, key: Hashable) -> Optional[float]:
+        """خواندن TAT بدون تغییر ترتیب LRU و بدون ساختن کلید"""
+        return self._data.get(key)
+    
+    def set(self, key: Hashable, tat: float, now: float):
+        """نوشتن TAT و اجرای حذف تدریجی"""
+        data = self._data
+        data[key] = tat
+        data.move_to_end(key)
+        
+        # حذف کلیدهای منقضی از ابتدای LRU
+        for _ in range(self.EXPIRE_SCAN):
+            oldest_key = next(iter(data))
+            if data[oldest_key] > now:
+                break
+            del data[oldest_key]
+            self.expired_count += 1
+        
+        # اعمال سقف حافظه
+        while len(data) > self.max_keys:
+            data.popitem(last=False)
+            self.evicted_count += 1
+    
+    def pop(self, key: Hashable) -> Optional[float]:
+        """حذف یک کلید"""
+        return self._data.pop(key, None)
+    
+    def sweep(self, now: Optional[float] = None) -> int:
+        """حذف کامل تمام کلیدهای منقضی (مثلاً در یک job دوره‌ای)"""
+        now = time.time() if now is None else now
+        expired = [key for key, tat in self._data.items() if tat <= now]
+        
+        for key in expired:
+            del self._data[key]
+        
+        self.expired_count += len(expired)
+        return len(expired)
+
+
+class MemoryBackend(StateBackend):
+    """وضعیت داخل حافظه همین پروسه"""
+    
+    name = "memory"
+    
+    def __init__(self, max_keys: int = 100_000):
+        self._tat = BoundedTatStore(max_keys)
+        self._sessions: Dict[int, Dict[str, Any]] = {}
+    
+    def gcra_check(self, checks: Sequence[GcraCheck], now: float) -> Tuple[bool, int]:
+        store = self._tat
+        updates: List[Tuple[Hashable, float]] = []
+        
+        for state_key, interval, window in checks:
+            new_tat, wait = _gcra_step(store.get(state_key), interval, window, now)
+            if wait > 0:
+                return False, math.ceil(wait)
+            updates.append((state_key, new_tat))
+        
+        for state_key, new_tat in updates:
+            store.set(state_key, new_tat, now)
+        
+        return True, 0
+    
+    def gcra_get(self, state_key: Hashable) -> Optional[float]:
+        return self._tat.get(state_key)
+    
+    def gcra_delete(self, state_key: Hashable) -> bool:
+        return self._tat.pop(state_key) is not None
+    
+    def size(self) -> int:
+        return len(self._tat)
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'backend': self.name,
+            'size': len(self._tat),
+            'max_keys': self._tat.max_keys,
+            'expired': self._tat.expired_count,
+            'evicted': self._tat.evicted_count,
+            'sessions': len(self._sessions)
+        }
+    
+    def session_get(self, user_id: int) -> Dict[str, Any]:
+        return json.loads(json.dumps(self._sessions.get(user_id, {})))
+    
+    def session_update(self, user_id: int, fn: Callable[[Dict[str, Any]], Any]) -> Any:
+        session = self._sessions.setdefault(user_id, {})
+        return fn(session)
+    
+    def session_delete(self, user_id: int):
+        self._sessions.pop(user_id, None)
+
+
+class SQLiteBackend(StateBackend):
+    """وضعیت مشترک بین چند پروسه با SQLite (WAL)"""
+    
+    name = "sqlite"
+    
+    # هر چند نوشتن یک بار کلیدهای منقضی پاک می‌شوند
+    SWEEP_EVERY = 1000
+    
+    def __init__(self, db_path: str, max_keys: int = 1_000_000):
+        """
+        Args:
+            db_path: مسیر فایل SQLite وضعیت (جدا از دیتابیس اصلی)
+            max_keys: سقف تعداد کلیدهای rate limit
+        """
+        self.db_path = db_path
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._writes = 0
+        
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        # isolation_level=None: تراکنش‌ها به‌صورت دستی با BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(
+            db_path,
+            timeout=10,
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS rate_state (
+                key TEXT PRIMARY KEY,
+                tat REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_rate_state_tat ON rate_state(tat)")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        
+        logger.info(f"✅ State backend (SQLite): {db_path}")
+    
+    @staticmethod
+    def _encode(state_key: Hashable) -> str:
+        if isinstance(state_key, tuple):
+            return "|".join(str(part) for part in state_key)
+        return str(state_key)
+    
+    def _transaction(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        """اجرای fn داخل تراکنش BEGIN IMMEDIATE (قفل نوشتن بین پروسه‌ها)"""
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn)
+                conn.execute("COMMIT")
+                return result
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+    
+    def gcra_check(self, checks: Sequence[GcraCheck], now: float) -> Tuple[bool, int]:
+        keys = [(self._encode(state_key), interval, window) for state_key, interval, window in checks]
+        
+        def _check(conn: sqlite3.Connection) -> Tuple[bool, int]:
+            updates = []
+            
+            for key, interval, window in keys:
+                row = conn.execute("SELECT tat FROM rate_state WHERE key = ?", (key,)).fetchone()
+                new_tat, wait = _gcra_step(row[0] if row else None, interval, window, now)
+                if wait > 0:
+                    return False, math.ceil(wait)
+                updates.append((key, new_tat))
+            
+            conn.executemany("""
+                INSERT INTO rate_state (key, tat) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET tat = excluded.tat
+            """, updates)
+            return True, 0
+        
+        allowed, retry_after = self._transaction(_check)
+        
+        if allowed:
+            self._writes += 1
+            if self._writes % self.SWEEP_EVERY == 0:
+                self.sweep(now)
+        
+        return allowed, retry_after
+    
+    def sweep(self, now: Optional[float] = None) -> int:
+        """حذف کلیدهای منقضی و اعمال سقف تعداد کلیدها"""
+        now = time.time() if now is None else now
+        
+        def _sweep(conn: sqlite3.Connection) -> int:
+            removed = conn.execute("DELETE FROM rate_state WHERE tat <= ?", (now,)).rowcount
+            
+            count = conn.execute("SELECT COUNT(*) FROM rate_state").fetchone()[0]
+            if count > self.max_keys:
+                removed += conn.execute("""
+                    DELETE FROM rate_state WHERE key IN (
+                        SELECT key FROM rate_state ORDER BY tat LIMIT ?
+                    )
+                """, (count - self.max_keys,)).rowcount
+            
+            return removed
+        
+        return self._transaction(_sweep)
+    
+    def gcra_get(self, state_key: Hashable) -> Optional[float]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tat FROM rate_state WHERE key = ?", (self._encode(state_key),)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def gcra_delete(self, state_key: Hashable) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM rate_state WHERE key = ?", (self._encode(state_key),)
+            )
+        return cursor.rowcount > 0
+    
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rate_state").fetchone()[0]
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sessions = self._conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        return {
+            'backend': self.name,
+            'size': self.size(),
+            'max_keys': self.max_keys,
+            'sessions': sessions
+        }
+    
+    def session_get(self, user_id: int) -> Dict[str, Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM sessions WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else {}
+    
+    def session_update(self, user_id: int, fn: Callable[[Dict[str, Any]], Any]) -> Any:
+        def _update(conn: sqlite3.Connection) -> Any:
+            row = conn.execute("SELECT data FROM sessions WHERE user_id = ?", (user_id,)).fetchone()
+            session = json.loads(row[0]) if row else {}
+            
+            result = fn(session)
+            
+            conn.execute("""
+                INSERT INTO sessions (user_id, data, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at
+            """, (user_id, json.dumps(session, ensure_ascii=False), time.time()))
+            return result
+        
+        return self._transaction(_update)
+    
+    def session_delete(self, user_id: int):
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+    
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_backend(kind: str = "memory", db_path: str = "data/state.db", max_keys: int = 100_000) -> StateBackend:
+    """ساخت backend بر اساس تنظیمات ('memory' یا 'sqlite')"""
+    if kind == "memory":
+        return MemoryBackend(max_keys)
+    if kind == "sqlite":
+        return SQLiteBackend(db_path, max_keys)
+    raise ValueError(f"state backend نامعتبر: {kind}")
+
+
+class SessionStore:
+    """session کاربران روی یک StateBackend (جایگزین context.user_data برای داده‌های مشترک)"""
+    
+    def __init__(self, backend: StateBackend):
+        self.backend = backend
+    
+    def get(self, user_id: int, field: str, default: Any = None) -> Any:
+        """خواندن یک فیلد از session"""
+        return self.backend.session_get(user_id).get(field, default)
+    
+    def set(self, user_id: int, field: str, value: Any):
+        """نوشتن یک فیلد در session"""
+        def _set(session: Dict[str, Any]):
+            session[field] = value
+        self.backend.session_update(user_id, _set)
+    
+    def update(self, user_id: int, fn: Callable[[Dict[str, Any]], Any]) -> Any:
+        """به‌روزرسانی اتمیک session"""
+        return self.backend.session_update(user_id, fn)
+    
+    def clear(self, user_id: int):
+        """حذف کامل session"""
+        self.backend.session_delete(user_id)
+
+
+def _worker(db_path: str, requests: int, limit: int, result_queue):
+    """پروسه تست: ارسال درخواست روی کلید مشترک"""
+    backend = SQLiteBackend(db_path)
+    allowed = 0
+    for _ in range(requests):
+        ok, _ = backend.gcra_check([(('minute', 'shared'), 3600 / limit, 3600)], time.time())
+        allowed += ok
+        backend.session_update(1, lambda s: s.__setitem__('n', s.get('n', 0) + 1))
+    backend.close()
+    result_queue.put(allowed)
+
+
+if __name__ == "__main__":
+    # تست چند پروسه‌ای: مجموع درخواست‌های مجاز باید دقیقاً برابر limit باشد
+    import multiprocessing
+    import tempfile
+    
+    workers, requests, limit = 4, 200, 150
+    path = os.path.join(tempfile.mkdtemp(), "state_test.db")
+    SQLiteBackend(path).close()
+    
+    queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=_worker, args=(path, requests, limit, queue))
+        for _ in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+    
+    total_allowed = sum(queue.get() for _ in processes)
+    backend = SQLiteBackend(path)
+    counter = backend.session_get(1).get('n')
+    
+    print(f"🧪 {workers} پروسه × {requests} درخواست، محدودیت {limit}")
+    print(f"   مجاز: {total_allowed} (انتظار: {limit})")
+    print(f"   شمارنده session: {counter} (انتظار: {workers * requests})")
+    print("✅ موفق" if total_allowed == limit and counter == workers * requests else "❌ ناموفق")
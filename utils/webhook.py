@@ -0,0 +1,269 @@
+"""
+دریافت آپدیت‌ها با webhook (جایگزین long polling)
+
+- allowed_updates از روی handler های ثبت شده ساخته می‌شود تا تلگرام فقط
+  انواعی را بفرستد که ربات واقعاً پردازش می‌کند (پیام ویرایش‌شده، poll و ... نه)
+- سرور webhook خود PTB (run_webhook) است و به tornado نیاز دارد:
+      pip install "python-telegram-bot[webhooks]"
+- آدرس Bot API قابل تغییر است (BOT_API_BASE_URL) تا بشود ربات را کامل
+  در برابر یک سرور محلی (telegram-bot-api یا FakeBotAPI همین ماژول) اجرا کرد
+"""
+
+import asyncio
+import json
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl
+
+from telegram import Update
+from telegram.ext import (
+    Application,
+    CallbackQueryHandler,
+    ChatJoinRequestHandler,
+    ChatMemberHandler,
+    ChosenInlineResultHandler,
+    CommandHandler,
+    ConversationHandler,
+    InlineQueryHandler,
+    MessageHandler,
+    PollAnswerHandler,
+    PollHandler,
+    PreCheckoutQueryHandler,
+    PrefixHandler,
+    ShippingQueryHandler,
+    TypeHandler,
+)
+
+from utils.logger import get_logger
+
+logger = get_logger('webhook')
+
+# نوع آپدیت هر کلاس handler
+HANDLER_UPDATE_TYPES = (
+    (CallbackQueryHandler, (Update.CALLBACK_QUERY,)),
+    (CommandHandler, (Update.MESSAGE,)),
+    (MessageHandler, (Update.MESSAGE,)),
+    (PrefixHandler, (Update.MESSAGE,)),
+    (InlineQueryHandler, (Update.INLINE_QUERY,)),
+    (ChosenInlineResultHandler, (Update.CHOSEN_INLINE_RESULT,)),
+    (ShippingQueryHandler, (Update.SHIPPING_QUERY,)),
+    (PreCheckoutQueryHandler, (Update.PRE_CHECKOUT_QUERY,)),
+    (PollHandler, (Update.POLL,)),
+    (PollAnswerHandler, (Update.POLL_ANSWER,)),
+    (ChatJoinRequestHandler, (Update.CHAT_JOIN_REQUEST,)),
+)
+
+
+def webhooks_available() -> bool:
+    """آیا وابستگی سرور webhook (tornado) نصب است؟"""
+    try:
+        import tornado  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def _update_types(handlers: Iterable) -> Set[str]:
+    types: Set[str] = set()
+    
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            nested = list(handler.entry_points) + list(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                nested.extend(state_handlers)
+            types |= _update_types(nested)
+            continue
+        
+        # TypeHandler(Update) مثل gate هر آپدیتی که برسد را می‌بیند و نوعی اضافه نمی‌کند
+        if isinstance(handler, TypeHandler):
+            continue
+        
+        if isinstance(handler, ChatMemberHandler):
+            if handler.chat_member_types in (ChatMemberHandler.MY_CHAT_MEMBER, ChatMemberHandler.ANY_CHAT_MEMBER):
+                types.add(Update.MY_CHAT_MEMBER)
+            if handler.chat_member_types in (ChatMemberHandler.CHAT_MEMBER, ChatMemberHandler.ANY_CHAT_MEMBER):
+                types.add(Update.CHAT_MEMBER)
+            continue
+        
+        for handler_class, update_types in HANDLER_UPDATE_TYPES:
+            if isinstance(handler, handler_class):
+                types.update(update_types)
+                break
+        else:
+            # handler ناشناخته: امن‌تر است همه انواع دریافت شوند
+            logger.warning("⚠️  نوع آپدیت %s مشخص نیست؛ همه انواع دریافت می‌شوند", type(handler).__name__)
+            types.update(Update.ALL_TYPES)
+    
+    return types
+
+
+def allowed_update_types(app: Application) -> List[str]:
+    """
+    انواع آپدیتی که handler های ثبت شده پردازش می‌کنند (بعد از ثبت همه handler ها)
+    
+    مثال: ['callback_query', 'message']
+    """
+    handlers = [handler for group in app.handlers.values() for handler in group]
+    return sorted(str(getattr(update_type, 'value', update_type)) for update_type in _update_types(handlers))
+
+
+class FakeBotAPI:
+    """
+    Bot API جعلی محلی برای تست end-to-end و benchmark (بدون اینترنت)
+    
+    فقط متدهایی که ربات هنگام راه‌اندازی و پاسخ ساده صدا می‌زند:
+    getMe، getUpdates (آپدیت‌های push_update)، sendMessage و بقیه با نتیجه True.
+    همه فراخوانی‌ها در calls ثبت می‌شوند.
+    
+    مثال:
+        api = FakeBotAPI()
+        url = await api.start()
+        Application.builder().token(TOKEN).base_url(f"{url}/bot").base_file_url(f"{url}/file/bot")
+    """
+    
+    BOT_USER = {'id': 123456789, 'is_bot': True, 'first_name': 'Shop', 'username': 'shop_bot'}
+    
+    def __init__(self):
+        self.calls: List[Tuple[str, Dict[str, str]]] = []
+        self.updates: List[Dict[str, Any]] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.url = ""
+    
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """شروع سرور؛ آدرس پایه (بدون /bot) را برمی‌گرداند"""
+        self._server = await asyncio.start_server(self._handle, host, port)
+        self.url = f"http://{host}:{self._server.sockets[0].getsockname()[1]}"
+        return self.url
+    
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+    
+    def push_update(self, update: Dict[str, Any]):
+        """آپدیتی که getUpdates بعدی برمی‌گرداند (قبل از اتصال ربات یا از همان event loop)"""
+        self.updates.append(update)
+    
+    @staticmethod
+    def command_update(update_id: int, text: str = '/start', user_id: int = 42) -> Dict[str, Any]:
+        """آپدیت یک دستور متنی از یک چت خصوصی"""
+        return {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id, 'date': int(time.time()), 'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}],
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test'}
+            }
+        }
+    
+    async def _result(self, method: str, params: Dict[str, str]) -> Any:
+        if method == 'getMe':
+            return self.BOT_USER
+        
+        if method == 'getUpdates':
+            offset = int(params.get('offset') or 0)
+            self.updates = [u for u in self.updates if u['update_id'] >= offset]
+            if not self.updates:
+                # long polling کوتاه تا ربات در حلقه تنگ درخواست نفرستد
+                await asyncio.sleep(min(float(params.get('timeout') or 0), 1.0))
+            return list(self.updates)
+        
+        if method == 'sendMessage':
+            return {
+                'message_id': len(self.calls), 'date': int(time.time()), 'text': params.get('text'),
+                'chat': {'id': int(params['chat_id']), 'type': 'private'}, 'from': self.BOT_USER
+            }
+        
+        return True
+    
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                
+                method = request_line.split()[1].decode().rsplit('/', 1)[-1]
+                params = dict(parse_qsl(body.decode('utf-8', 'replace')))
+                self.calls.append((method, params))
+                
+                payload = json.dumps({'ok': True, 'result': await self._result(method, params)}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+if __name__ == "__main__":
+    # تست end-to-end: ربات در حالت webhook در برابر FakeBotAPI
+    #   1. getMe و setWebhook به سرور جعلی می‌روند
+    #   2. یک آپدیت /start با secret درست به webhook ارسال و پاسخ sendMessage بررسی می‌شود
+    #   3. آپدیت با secret اشتباه باید 403 بگیرد
+    import urllib.error
+    import urllib.request
+    
+    TOKEN = "123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+    SECRET = "demo-secret_token"
+    
+    def post_update(port: int, secret: str) -> int:
+        request = urllib.request.Request(
+            f"http://127.0.0.1:{port}/telegram", data=json.dumps(FakeBotAPI.command_update(1)).encode(),
+            headers={'Content-Type': 'application/json', 'X-Telegram-Bot-Api-Secret-Token': secret}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+    
+    async def _demo():
+        api = FakeBotAPI()
+        api_url = await api.start()
+        
+        async def start(update, context):
+            await update.message.reply_text("سلام")
+        
+        app = (
+            Application.builder().token(TOKEN)
+            .base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+            .build()
+        )
+        app.add_handler(CommandHandler("start", start))
+        app.add_handler(CallbackQueryHandler(start))
+        allowed = allowed_update_types(app)
+        print(f"allowed_updates: {allowed}")
+        
+        port = 18443
+        async with app:
+            await app.updater.start_webhook(
+                listen='127.0.0.1', port=port, url_path='telegram',
+                webhook_url="https://example.com/telegram", secret_token=SECRET,
+                allowed_updates=allowed, max_connections=10
+            )
+            await app.start()
+            
+            print(f"secret درست: HTTP {await asyncio.to_thread(post_update, port, SECRET)}")
+            print(f"secret اشتباه: HTTP {await asyncio.to_thread(post_update, port, 'wrong')}")
+            await asyncio.sleep(0.5)
+            
+            await app.updater.stop()
+            await app.stop()
+        
+        await api.stop()
+        for method, params in api.calls:
+            print(f"  {method} {dict((k, v[:40]) for k, v in params.items())}")
+    
+    asyncio.run(_demo())